@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+API 并发基准测试
+以逐级增加的并发客户端数向运行中的 API 服务发送请求，按路径统计延迟分位数和状态码。
+/api/health 不访问存储，它的延迟反映事件循环是否被阻塞操作卡住
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List
+
+import httpx
+
+from storage_benchmark import git_commit, percentiles
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_URL = "http://127.0.0.1:8000"
+DEFAULT_LEVELS = [1, 4, 16, 64]
+
+# 混合 CSV 查询、SQLite 查询和不访问存储的健康检查
+DEFAULT_PATHS = [
+    "/api/health",
+    "/api/prices?limit=100",
+    "/api/prices?province=山东&limit=100",
+    "/api/statistics",
+    "/api/varieties",
+    "/api/prices/latest?limit=100",
+]
+
+
+async def run_level(client: httpx.AsyncClient, url: str, paths: List[str],
+                    concurrency: int, requests_per_client: int) -> Dict:
+    """concurrency 个客户端各自依次发送 requests_per_client 个请求，路径轮流使用"""
+    samples: Dict[str, List[float]] = {path: [] for path in paths}
+    statuses = Counter()
+    
+    async def worker(index: int):
+        for i in range(requests_per_client):
+            path = paths[(index + i) % len(paths)]
+            start = time.perf_counter()
+            try:
+                response = await client.get(url + path)
+                status = str(response.status_code)
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            samples[path].append(time.perf_counter() - start)
+            statuses[status] += 1
+    
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(index) for index in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    
+    total = concurrency * requests_per_client
+    return {
+        "concurrency": concurrency,
+        "requests": total,
+        "seconds": round(elapsed, 3),
+        "requests_per_second": round(total / elapsed, 1) if elapsed else 0,
+        "statuses": dict(statuses),
+        "latency": percentiles([value for values in samples.values() for value in values]),
+        "paths": {path: percentiles(values) for path, values in samples.items()},
+    }
+
+
+async def run_benchmark(url: str, paths: List[str], levels: List[int],
+                        requests_per_client: int, timeout: float) -> Dict:
+    """依次运行各并发级别，返回完整结果"""
+    url = url.rstrip("/")
+    limits = httpx.Limits(max_connections=max(levels), max_keepalive_connections=max(levels))
+    results = []
+    async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
+        # 预热：让服务端完成数据加载和索引构建
+        for path in paths:
+            await client.get(url + path)
+        
+        for concurrency in levels:
+            logger.info(f"并发 {concurrency}: 每个客户端 {requests_per_client} 个请求")
+            result = await run_level(client, url, paths, concurrency, requests_per_client)
+            results.append(result)
+            logger.info(f"完成: {result['requests_per_second']} 请求/秒, p99 {result['latency'].get('p99_ms')} ms, "
+                        f"状态码 {result['statuses']}")
+    
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "url": url,
+            "paths": paths,
+            "requests_per_client": requests_per_client,
+        },
+        "results": results,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="API 并发基准测试")
+    parser.add_argument("--url", default=DEFAULT_URL, help="API 服务地址")
+    parser.add_argument("--concurrency", nargs="+", type=int, default=DEFAULT_LEVELS, help="并发客户端数")
+    parser.add_argument("--requests", type=int, default=50, help="每个客户端发送的请求数")
+    parser.add_argument("--paths", nargs="+", default=DEFAULT_PATHS, help="请求路径（含查询参数）")
+    parser.add_argument("--timeout", type=float, default=60.0, help="单个请求的客户端超时（秒）")
+    parser.add_argument("--output", help="结果JSON文件，默认 benchmark_results/api_<提交>_<时间>.json")
+    args = parser.parse_args()
+    
+    if args.requests <= 0 or any(level <= 0 for level in args.concurrency):
+        parser.error("--requests 和 --concurrency 必须大于0")
+    
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    
+    report = asyncio.run(run_benchmark(args.url, args.paths, args.concurrency, args.requests, args.timeout))
+    
+    output = args.output
+    if not output:
+        os.makedirs("benchmark_results", exist_ok=True)
+        output = os.path.join(
+            "benchmark_results",
+            f"api_{report['meta']['commit'] or 'local'}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+        )
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"结果已保存: {output}")
+    
+    print(f"{'并发':>6} {'请求/秒':>10} {'p50 ms':>10} {'p99 ms':>10} {'health p99 ms':>14}")
+    for result in report["results"]:
+        health = result["paths"].get("/api/health", {})
+        print(f"{result['concurrency']:>6} {result['requests_per_second']:>10} "
+              f"{result['latency'].get('p50_ms', '-'):>10} {result['latency'].get('p99_ms', '-'):>10} "
+              f"{health.get('p99_ms', '-'):>14}")
@@ -5,13 +5,12 @@
 提供实时市场价格查询、地理位置就近推荐等功能
 """
 
-from fastapi import FastAPI, HTTPException, Query, Depends
+from fastapi import FastAPI, HTTPException, Query, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
-from typing import List, Optional, Dict, Any
-import sqlite3
+from typing import List, Optional, Dict, Any, Awaitable, Callable
 import json
 import os
 import logging
@@ -22,6 +21,11 @@ from contextlib import asynccontextmanager
 import uvicorn
 from market_crawler import MarketCrawler
 from csv_data_manager import CSVDataManager, get_csv_manager
+from database_manager import DatabaseManager
+from storage_executor import BoundedExecutor, StorageUnavailable
+from json_response import STREAM_CHUNK_ROWS, FastJSONResponse, Rows, dumps, ndjson_response, wants_ndjson
+from response_cache import DataGeneration, ResponseCache, SharedBackend, cache_key, is_not_modified, validator_headers
+import hmac
 import threading
 import time
 
@@ -62,174 +66,68 @@ class PriceQuery(BaseModel):
     start_date: Optional[str] = None
     end_date: Optional[str] = None
     limit: Optional[int] = 100
-
-# 数据库管理类
-class DatabaseManager:
-    def __init__(self, db_path: str = "market_data.db"):
-        self.db_path = db_path
-        self.init_database()
-    
-    def init_database(self):
-        """初始化数据库"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # 创建市场价格表
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS market_prices (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                market_id TEXT NOT NULL,
-                market_code TEXT,
-                market_name TEXT NOT NULL,
-                market_type TEXT,
-                variety_id TEXT,
-                variety_name TEXT NOT NULL,
-                min_price REAL DEFAULT 0,
-                avg_price REAL DEFAULT 0,
-                max_price REAL DEFAULT 0,
-                unit TEXT,
-                trade_date TEXT NOT NULL,
-                trade_volume REAL DEFAULT 0,
-                produce_place TEXT,
-                sale_place TEXT,
-                province TEXT,
-                province_code TEXT,
-                area_name TEXT,
-                area_code TEXT,
-                variety_type TEXT,
-                variety_type_id TEXT,
-                crawl_time TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE(market_id, variety_id, trade_date)
-            )
-        ''')
-        
-        # 创建索引
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_province ON market_prices(province)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_market_name ON market_prices(market_name)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_variety_name ON market_prices(variety_name)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_trade_date ON market_prices(trade_date)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_crawl_time ON market_prices(crawl_time)')
-        
-        conn.commit()
-        conn.close()
-        logger.info("数据库初始化完成")
-    
-    def insert_market_data(self, data_list: List[Dict]):
-        """批量插入市场数据"""
-        if not data_list:
-            return
-        
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        try:
-            for data in data_list:
-                cursor.execute('''
-                    INSERT OR REPLACE INTO market_prices (
-                        market_id, market_code, market_name, market_type,
-                        variety_id, variety_name, min_price, avg_price, max_price,
-                        unit, trade_date, trade_volume, produce_place, sale_place,
-                        province, province_code, area_name, area_code,
-                        variety_type, variety_type_id, crawl_time
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    data.get('市场ID', ''),
-                    data.get('市场代码', ''),
-                    data.get('市场名称', ''),
-                    data.get('市场类型', ''),
-                    data.get('品种ID', ''),
-                    data.get('品种名称', ''),
-                    data.get('最低价', 0),
-                    data.get('平均价', 0),
-                    data.get('最高价', 0),
-                    data.get('计量单位', ''),
-                    data.get('交易日期', ''),
-                    data.get('交易量', 0),
-                    data.get('产地', ''),
-                    data.get('销售地', ''),
-                    data.get('省份', ''),
-                    data.get('省份代码', ''),
-                    data.get('地区名称', ''),
-                    data.get('地区代码', ''),
-                    data.get('品种类型', ''),
-                    data.get('品种类型ID', ''),
-                    data.get('爬取时间', '')
-                ))
-            
-            conn.commit()
-            logger.info(f"成功插入 {len(data_list)} 条数据")
-            
-        except Exception as e:
-            conn.rollback()
-            logger.error(f"插入数据失败: {str(e)}")
-            raise
-        finally:
-            conn.close()
-    
-    def query_prices(self, query: PriceQuery) -> List[Dict]:
-        """查询价格数据"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # 构建查询条件
-        conditions = []
-        params = []
-        
-        if query.province:
-            conditions.append("province LIKE ?")
-            params.append(f"%{query.province}%")
-        
-        if query.market_name:
-            conditions.append("market_name LIKE ?")
-            params.append(f"%{query.market_name}%")
-        
-        if query.variety_name:
-            conditions.append("variety_name LIKE ?")
-            params.append(f"%{query.variety_name}%")
-        
-        if query.start_date:
-            conditions.append("trade_date >= ?")
-            params.append(query.start_date)
-        
-        if query.end_date:
-            conditions.append("trade_date <= ?")
-            params.append(query.end_date)
-        
-        where_clause = " AND ".join(conditions) if conditions else "1=1"
-        
-        sql = f'''
-            SELECT * FROM market_prices 
-            WHERE {where_clause}
-            ORDER BY trade_date DESC, crawl_time DESC
-            LIMIT ?
-        '''
-        params.append(query.limit)
-        
-        try:
-            cursor.execute(sql, params)
-            columns = [description[0] for description in cursor.description]
-            results = []
-            
-            for row in cursor.fetchall():
-                result = dict(zip(columns, row))
-                results.append(result)
-            
-            return results
-            
-        except Exception as e:
-            logger.error(f"查询数据失败: {str(e)}")
-            raise
-        finally:
-            conn.close()
+    cursor: Optional[str] = None  # 上一页返回的 next_cursor
 
 # 全局变量
-db_manager = DatabaseManager()
+# API_PROFILE_QUERIES=1 时记录每条SQL的耗时，供 /api/admin/query-stats 查看；默认关闭
+PROFILE_QUERIES = os.environ.get("API_PROFILE_QUERIES", "").lower() in ("1", "true", "yes")
+# /api/admin/* 管理接口的访问令牌，未设置时管理接口不可用
+ADMIN_TOKEN = os.environ.get("API_ADMIN_TOKEN", "")
+
+db_manager = DatabaseManager(profile_queries=PROFILE_QUERIES)
 csv_manager = get_csv_manager()  # CSV数据管理器
 crawler = MarketCrawler()
 crawler_thread = None
 crawler_running = False
 
+# 阻塞的 SQLite 查询和 CSV/pandas 计算分别放到有界线程池执行，不占用事件循环；
+# 线程数、排队数和单个请求的时限可通过环境变量调整
+REQUEST_TIMEOUT = float(os.environ.get("API_REQUEST_TIMEOUT", "30"))
+db_executor = BoundedExecutor(
+    "db",
+    workers=int(os.environ.get("API_DB_WORKERS", "8")),
+    queue_size=int(os.environ.get("API_DB_QUEUE", "64")),
+    timeout=REQUEST_TIMEOUT
+)
+csv_executor = BoundedExecutor(
+    "csv",
+    workers=int(os.environ.get("API_CSV_WORKERS", "4")),
+    queue_size=int(os.environ.get("API_CSV_QUEUE", "32")),
+    timeout=REQUEST_TIMEOUT
+)
+
+# 读接口的响应按数据代数缓存，爬取入库后代数递增，旧响应随之失效；
+# 设置 API_CACHE_REDIS_URL 时多个工作进程共用一层 Redis 缓存
+data_generation = DataGeneration()  # 与定时任务、回填共用 generation_path() 指向的代数文件
+response_cache = ResponseCache(
+    max_entries=int(os.environ.get("API_CACHE_ENTRIES", "1024")),
+    max_bytes=int(float(os.environ.get("API_CACHE_MB", "64")) * 1024 * 1024),
+    shared=SharedBackend.from_url(os.environ["API_CACHE_REDIS_URL"]) if os.environ.get("API_CACHE_REDIS_URL") else None
+)
+
+async def cached_json(endpoint: str, params: Dict, compute: Callable[[], Awaitable[Dict]],
+                      request: Optional[Request] = None) -> Response:
+    """返回当前数据代数下 endpoint + params 的 JSON 响应，未命中时执行 compute() 并缓存响应体
+    
+    传入 request 时响应带 ETag/Last-Modified，客户端的条件 GET 在数据未变时直接得到 304，不访问存储。
+    """
+    # 先取代数再计算：计算期间数据更新时，结果存在旧代数下，随后即失效
+    state = data_generation.current()
+    generation = state["generation"]
+    key = cache_key(endpoint, params)
+    headers = None
+    if request is not None:
+        headers = validator_headers(key, state)
+        if is_not_modified(request.headers, headers):
+            return Response(status_code=304, headers=headers)
+    
+    body = response_cache.get(key, generation)
+    if body is None:
+        content = await compute()
+        body = dumps(content)
+        response_cache.put(key, generation, body)
+    return Response(content=body, media_type="application/json", headers=headers)
+
 # 地理位置服务
 class LocationService:
     @staticmethod
@@ -237,8 +135,7 @@ class LocationService:
         """根据地理位置获取附近的市场"""
         # 这里使用简单的距离计算，实际应用中可以使用更精确的地理计算
         # 暂时返回所有市场数据，按省份优先级排序
-        query = PriceQuery(limit=50)
-        all_markets = db_manager.query_prices(query)
+        all_markets = db_manager.query_prices({}, limit=50)
         
         # 简单的地理位置匹配逻辑（可以根据需要改进）
         # 这里按省份进行粗略的地理位置匹配
@@ -333,6 +230,9 @@ def run_crawler():
                 # 同时保存到CSV文件
                 csv_manager.save_data(all_data)
 
+                # 两处都写入后再递增数据代数，响应缓存随之失效
+                data_generation.bump("crawl")
+
                 logger.info(f"本轮爬取完成，共获取 {len(all_data)} 条数据，已保存到数据库和CSV文件")
             
             # 等待30分钟后进行下一轮爬取
@@ -356,6 +256,8 @@ async def lifespan(app: FastAPI):
     # 关闭时执行
     global crawler_running
     crawler_running = False
+    db_executor.shutdown()
+    csv_executor.shutdown()
     logger.info("API服务关闭")
 
 app = FastAPI(
@@ -374,6 +276,11 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.exception_handler(StorageUnavailable)
+async def storage_unavailable_handler(request, exc: StorageUnavailable):
+    """存储线程池已满返回 503，超时返回 504"""
+    return JSONResponse(status_code=exc.status_code, content={"detail": str(exc)})
+
 # 挂载静态文件
 if os.path.exists("static"):
     app.mount("/static", StaticFiles(directory="static"), name="static")
@@ -399,32 +306,118 @@ async def health_check():
     return {
         "status": "healthy",
         "timestamp": datetime.now().isoformat(),
-        "crawler_running": crawler_running
+        "crawler_running": crawler_running,
+        "executors": {
+            "db": db_executor.status(),
+            "csv": csv_executor.status()
+        },
+        "cache": response_cache.status()
     }
 
 @app.post("/api/prices/query")
-async def query_prices(query: PriceQuery):
-    """查询市场价格（从SQLite数据库）"""
+async def query_prices(query: PriceQuery, request: Request):
+    """查询市场价格（从SQLite数据库），支持游标分页；NDJSON 模式下边读边发送，limit 为空时不限条数"""
     try:
-        results = db_manager.query_prices(query)
-        return {
+        filters = query.model_dump(exclude={"limit", "cursor"}, exclude_none=True)
+        
+        if wants_ndjson(request):
+            if query.cursor:
+                db_manager.decode_cursor(query.cursor)  # 开始发送前校验游标
+            return ndjson_response(
+                db_executor, db_manager.iter_prices, filters, chunk_size=STREAM_CHUNK_ROWS,
+                limit=query.limit if query.limit and query.limit > 0 else None, cursor=query.cursor
+            )
+        
+        async def compute():
+            page = await db_executor.run(db_manager.query_price_rows, filters, limit=query.limit, cursor=query.cursor)
+            return {
+                "success": True,
+                "count": len(page["rows"]),
+                "data": Rows(page["columns"], page["rows"]),
+                "next_cursor": page["next_cursor"],
+                "source": "database"
+            }
+        
+        return await cached_json("/api/prices/query", query.model_dump(), compute)
+    except StorageUnavailable:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"查询价格失败: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/prices/latest")
+async def get_latest_prices(
+    request: Request,
+    province: Optional[str] = None,
+    variety: Optional[str] = None,
+    market: Optional[str] = None,
+    limit: int = 100
+):
+    """查询各市场各品种的最新价格（从SQLite最新价格表）；NDJSON 模式下 limit 不大于0时不限条数"""
+    try:
+        filters = {
+            "province": province,
+            "variety_name": variety,
+            "market_name": market
+        }
+        if wants_ndjson(request):
+            return ndjson_response(
+                db_executor, db_manager.iter_latest_prices, filters,
+                limit=limit if limit > 0 else None, chunk_size=STREAM_CHUNK_ROWS
+            )
+        
+        results = await db_executor.run(lambda: Rows.collect(db_manager.iter_latest_prices(filters, limit)))
+        return FastJSONResponse({
             "success": True,
             "count": len(results),
             "data": results,
             "source": "database"
-        }
+        })
+    except StorageUnavailable:
+        raise
     except Exception as e:
-        logger.error(f"查询价格失败: {str(e)}")
+        logger.error(f"查询最新价格失败: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/prices/changes")
+async def get_price_changes(since: int = 0, limit: int = 1000):
+    """按版本号增量获取价格变更，客户端保存 next_since 用于下次请求"""
+    try:
+        result = await db_executor.run(db_manager.get_price_changes, since, limit=limit)
+    except StorageUnavailable:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"查询价格变更失败: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    if result["reset_required"]:
+        raise HTTPException(
+            status_code=410,
+            detail=f"版本 {since} 之后的变更日志已被清理，请先全量同步，当前版本 {result['current_version']}"
+        )
+    
+    return {
+        "success": True,
+        "count": len(result["changes"]),
+        **result
+    }
+
 @app.get("/api/prices")
 async def get_prices(
+    request: Request,
     province: Optional[str] = None,
     variety: Optional[str] = None,
     market: Optional[str] = None,
-    limit: int = 100
+    limit: int = 100,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None
 ):
-    """从CSV文件查询市场价格（推荐使用）"""
+    """从CSV文件查询市场价格（推荐使用），指定交易日期范围时只读取范围内的月分区；
+    NDJSON 模式下逐块转换并发送，limit 不大于0时不限条数"""
     try:
         # 构建过滤条件
         filters = {}
@@ -434,16 +427,27 @@ async def get_prices(
             filters['品种名称'] = variety
         if market:
             filters['市场名称'] = market
+        
+        if wants_ndjson(request):
+            return ndjson_response(
+                csv_executor, csv_manager.iter_search_data, filters, limit, start_date, end_date,
+                chunk_size=STREAM_CHUNK_ROWS
+            )
 
-        results = csv_manager.search_data(filters, limit)
+        async def compute():
+            results = await csv_executor.run(csv_manager.search_data, filters, limit, start_date, end_date)
+            return {
+                "success": True,
+                "count": len(results),
+                "data": results,
+                "source": "csv",
+                "filters": filters
+            }
 
-        return {
-            "success": True,
-            "count": len(results),
-            "data": results,
-            "source": "csv",
-            "filters": filters
-        }
+        params = {**filters, "limit": limit, "start_date": start_date, "end_date": end_date}
+        return await cached_json("/api/prices", params, compute, request)
+    except StorageUnavailable:
+        raise
     except Exception as e:
         logger.error(f"从CSV查询价格失败: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -452,7 +456,8 @@ async def get_prices(
 async def get_nearby_prices(location: LocationRequest):
     """根据地理位置获取附近市场价格"""
     try:
-        results = LocationService.get_nearby_markets(
+        results = await db_executor.run(
+            LocationService.get_nearby_markets,
             location.latitude, 
             location.longitude, 
             location.radius
@@ -467,6 +472,8 @@ async def get_nearby_prices(location: LocationRequest):
             "count": len(results),
             "data": results
         }
+    except StorageUnavailable:
+        raise
     except Exception as e:
         logger.error(f"获取附近价格失败: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -480,52 +487,111 @@ async def get_provinces():
     }
 
 @app.get("/api/varieties")
-async def get_varieties(province: Optional[str] = None):
+async def get_varieties(request: Request, province: Optional[str] = None):
     """获取品种列表（从CSV文件）"""
     try:
-        varieties = csv_manager.get_varieties(province)
+        async def compute():
+            varieties = await csv_executor.run(csv_manager.get_varieties, province)
+            return {
+                "success": True,
+                "count": len(varieties),
+                "data": varieties,
+                "source": "csv"
+            }
 
-        return {
-            "success": True,
-            "count": len(varieties),
-            "data": varieties,
-            "source": "csv"
-        }
+        return await cached_json("/api/varieties", {"province": province}, compute, request)
+    except StorageUnavailable:
+        raise
     except Exception as e:
         logger.error(f"获取品种列表失败: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/markets")
-async def get_markets(province: Optional[str] = None):
+async def get_markets(request: Request, province: Optional[str] = None):
     """获取市场列表（从CSV文件）"""
     try:
-        markets = csv_manager.get_markets(province)
+        async def compute():
+            markets = await csv_executor.run(csv_manager.get_markets, province)
+            return {
+                "success": True,
+                "count": len(markets),
+                "data": markets,
+                "source": "csv"
+            }
 
-        return {
-            "success": True,
-            "count": len(markets),
-            "data": markets,
-            "source": "csv"
-        }
+        return await cached_json("/api/markets", {"province": province}, compute, request)
+    except StorageUnavailable:
+        raise
     except Exception as e:
         logger.error(f"获取市场列表失败: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/statistics")
-async def get_statistics():
-    """获取数据统计信息"""
+async def get_statistics(request: Request, start_date: Optional[str] = None, end_date: Optional[str] = None):
+    """获取数据统计信息，可按交易日期范围统计"""
     try:
-        stats = csv_manager.get_statistics()
+        async def compute():
+            stats = await csv_executor.run(csv_manager.get_statistics, start_date, end_date)
+            return {
+                "success": True,
+                "data": stats,
+                "source": "csv"
+            }
 
-        return {
-            "success": True,
-            "data": stats,
-            "source": "csv"
-        }
+        return await cached_json("/api/statistics", {"start_date": start_date, "end_date": end_date}, compute,
+                                 request)
+    except StorageUnavailable:
+        raise
     except Exception as e:
         logger.error(f"获取统计信息失败: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def require_admin(request: Request):
+    """管理接口的令牌校验：请求头 X-Admin-Token 或 Authorization: Bearer <令牌> 须与 API_ADMIN_TOKEN 一致"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="管理接口未启用，请设置 API_ADMIN_TOKEN")
+    
+    token = request.headers.get("x-admin-token", "")
+    authorization = request.headers.get("authorization", "")
+    if not token and authorization.lower().startswith("bearer "):
+        token = authorization[7:].strip()
+    if not hmac.compare_digest(token.encode("utf-8"), ADMIN_TOKEN.encode("utf-8")):
+        raise HTTPException(status_code=401, detail="管理接口令牌无效")
+
+@app.get("/api/admin/query-stats", dependencies=[Depends(require_admin)])
+async def get_query_stats(top: int = 20, order_by: Optional[str] = None):
+    """查看SQL性能统计：最慢、最频繁的SQL形态和最近的慢查询（含执行计划）"""
+    try:
+        return {
+            "success": True,
+            "data": db_manager.get_query_stats(top, order_by=order_by)
+        }
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/api/admin/cache", dependencies=[Depends(require_admin)])
+async def get_cache_stats():
+    """查看响应缓存的占用、命中和淘汰统计，以及当前数据代数"""
+    return {
+        "success": True,
+        "data": {
+            **response_cache.status(),
+            "data_generation": data_generation.current()
+        }
+    }
+
+@app.post("/api/admin/cache/clear", dependencies=[Depends(require_admin)])
+async def clear_cache():
+    """清空本进程的响应缓存"""
+    response_cache.clear()
+    return {"success": True}
+
+@app.post("/api/admin/query-stats/reset", dependencies=[Depends(require_admin)])
+async def reset_query_stats():
+    """清空SQL性能统计"""
+    db_manager.reset_query_stats()
+    return {"success": True}
+
 if __name__ == "__main__":
     uvicorn.run(
         "api_server:app",
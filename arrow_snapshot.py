@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Arrow 快照
+将 CSV 分区合并后的数据写成未压缩的 Arrow IPC (Feather v2) 文件，由版本文件指向当前快照。
+多个 API 工作进程以内存映射方式打开同一个快照，数据留在操作系统页缓存中由各进程共享，
+冷启动时不需要解析 CSV
+"""
+
+import hashlib
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_PREFIX = "market_prices-"
+SNAPSHOT_SUFFIX = ".arrow"
+VERSION_FILE = "VERSION"
+LOCK_FILE = ".publish.lock"
+
+# 保留的快照文件数：刚读到旧版本文件的进程仍能打开上一个快照
+KEEP_SNAPSHOTS = 2
+
+# 快照来源（分段签名、各分区行区间）保存在 Arrow schema 元数据中
+METADATA_KEY = b"market_prices"
+
+
+def signature_digest(signature) -> str:
+    """分段签名的摘要，版本文件据此标明快照对应的数据状态"""
+    return hashlib.sha1(json.dumps(signature, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class ArrowSnapshot:
+    """快照目录：market_prices-<版本>.arrow 和指向当前版本的 VERSION 文件"""
+    
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.version_file = os.path.join(directory, VERSION_FILE)
+    
+    def version_stat(self) -> Optional[Tuple[int, int, int]]:
+        """版本文件的 (inode, 修改时间, 大小)，每次发布都会替换为新文件"""
+        try:
+            stat = os.stat(self.version_file)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+    
+    def read_version(self) -> Optional[Dict]:
+        """读取当前版本信息，没有快照时返回 None"""
+        try:
+            with open(self.version_file, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"读取快照版本文件失败: {e}")
+            return None
+    
+    @contextmanager
+    def publish_lock(self):
+        """跨进程的发布锁，不等待；其他进程正在发布时得到 False"""
+        os.makedirs(self.directory, exist_ok=True)
+        try:
+            import fcntl
+        except ImportError:
+            # 不支持 flock 的平台只依赖进程内的锁
+            yield True
+            return
+        
+        with open(os.path.join(self.directory, LOCK_FILE), "w") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+    
+    def publish(self, df: pd.DataFrame, digest: str, metadata: Dict) -> Dict:
+        """写入新快照并切换版本文件，调用方持有发布锁"""
+        try:
+            import pyarrow as pa
+        except ImportError:
+            raise ImportError("发布 Arrow 快照需要安装 pyarrow: pip install pyarrow")
+        
+        start = time.time()
+        current = self.read_version()
+        version = current["version"] + 1 if current else 1
+        name = f"{SNAPSHOT_PREFIX}{version:08d}{SNAPSHOT_SUFFIX}"
+        path = os.path.join(self.directory, name)
+        
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        table = table.replace_schema_metadata({
+            **(table.schema.metadata or {}),
+            METADATA_KEY: json.dumps(metadata, ensure_ascii=False).encode("utf-8"),
+        })
+        # 不压缩，读取时才能直接映射文件中的缓冲区
+        tmp_path = path + ".tmp"
+        with pa.OSFile(tmp_path, "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        with open(tmp_path, "rb+") as f:
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        
+        info = {
+            "version": version,
+            "file": name,
+            "digest": digest,
+            "rows": len(df),
+            "bytes": os.path.getsize(path),
+            "created_at": time.strftime('%Y-%m-%d %H:%M:%S'),
+        }
+        tmp_version = self.version_file + ".tmp"
+        with open(tmp_version, "w", encoding="utf-8") as f:
+            json.dump(info, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_version, self.version_file)
+        
+        self._prune(version)
+        info["seconds"] = round(time.time() - start, 3)
+        logger.info(f"发布Arrow快照 {name}: {len(df)} 条记录, {info['bytes'] / 1024 / 1024:.1f} MB, "
+                    f"耗时 {info['seconds']} 秒")
+        return info
+    
+    def _prune(self, version: int):
+        """删除较旧的快照；已映射这些文件的进程在解除映射前仍可正常读取"""
+        for name in os.listdir(self.directory):
+            if not (name.startswith(SNAPSHOT_PREFIX) and name.endswith(SNAPSHOT_SUFFIX)):
+                continue
+            try:
+                file_version = int(name[len(SNAPSHOT_PREFIX):-len(SNAPSHOT_SUFFIX)])
+            except ValueError:
+                continue
+            if file_version <= version - KEEP_SNAPSHOTS:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
+    
+    def load(self, version: Dict) -> Tuple[pd.DataFrame, Dict]:
+        """以内存映射方式打开快照，返回 (DataFrame, 元数据)
+        
+        没有空值的数值列直接引用映射的缓冲区，category 列只复制取值编号和取值列表。
+        """
+        try:
+            import pyarrow as pa
+        except ImportError:
+            raise ImportError("读取 Arrow 快照需要安装 pyarrow: pip install pyarrow")
+        
+        source = pa.memory_map(os.path.join(self.directory, version["file"]), "r")
+        table = pa.ipc.open_file(source).read_all()
+        metadata = json.loads(table.schema.metadata[METADATA_KEY].decode("utf-8"))
+        return table.to_pandas(split_blocks=True), metadata
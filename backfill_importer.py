@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+历史数据批量回填
+扫描爬虫输出目录（market_data/<日期>/<市场>/、summary/、merged/）下的 CSV 和 JSON 文件，
+在进程池中并行解析，按 (市场ID, 品种ID, 交易日期) 去重保留爬取时间最新的记录后批量写入数据库。
+写入期间删除分区二级索引并放宽同步设置，结束后统一重建；已导入的文件按大小和修改时间记录，
+中断后重新运行会跳过未变化的文件
+"""
+
+import argparse
+import csv
+import json
+import logging
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from database_manager import DatabaseManager
+from response_cache import DataGeneration
+
+logger = logging.getLogger(__name__)
+
+DATA_EXTENSIONS = (".csv", ".json")
+
+# summary/、merged/ 和各市场目录下的 *_summary.csv 是爬虫生成的汇总副本
+DERIVED_DIRS = ("summary", "merged")
+DERIVED_SUFFIX = "_summary.csv"
+
+# 解析结果按固定字段顺序以元组传回主进程，减少进程间序列化开销
+RECORD_FIELDS = [
+    "市场ID", "市场代码", "市场名称", "市场类型",
+    "省份", "省份代码", "地区名称", "地区代码",
+    "品种ID", "品种名称", "品种类型", "品种类型ID",
+    "计量单位", "产地", "销售地", "交易日期",
+    "最低价", "平均价", "最高价", "交易量", "爬取时间",
+]
+KEY_INDEXES = tuple(RECORD_FIELDS.index(field) for field in ("市场ID", "品种ID", "交易日期"))
+CRAWL_TIME_INDEX = RECORD_FIELDS.index("爬取时间")
+
+# 经 pandas 读写过的汇总文件中，编号可能变成数字或带 ".0" 的字符串
+ID_FIELDS = {"市场ID", "市场代码", "省份代码", "地区代码", "品种ID", "品种类型ID"}
+
+# pandas 的 to_json 将日期写成毫秒时间戳
+DATE_FIELDS = {"交易日期", "爬取时间"}
+
+DEFAULT_BATCH_SIZE = 50000
+PROGRESS_LOG_SECONDS = 10
+
+
+def discover_files(data_dir: str, include_derived: bool = True) -> List[str]:
+    """按路径顺序列出数据目录下的 CSV 和 JSON 文件"""
+    files = []
+    for root, dirs, names in os.walk(data_dir):
+        if not include_derived and os.path.abspath(root) == os.path.abspath(data_dir):
+            dirs[:] = [name for name in dirs if name not in DERIVED_DIRS]
+        dirs.sort()
+        for name in sorted(names):
+            if not name.lower().endswith(DATA_EXTENSIONS):
+                continue
+            if not include_derived and name.endswith(DERIVED_SUFFIX):
+                continue
+            files.append(os.path.abspath(os.path.join(root, name)))
+    return files
+
+
+def _normalize(field: str, value):
+    """统一不同来源文件中同一字段的表示"""
+    if value is None:
+        return ""
+    if field in DATE_FIELDS and isinstance(value, (int, float)):
+        moment = datetime.fromtimestamp(value / 1000, timezone.utc)
+        if field == "交易日期" and moment.time() == datetime.min.time():
+            return moment.strftime("%Y-%m-%d")
+        return moment.strftime("%Y-%m-%d %H:%M:%S")
+    if field in ID_FIELDS:
+        if isinstance(value, float) and value.is_integer():
+            return str(int(value))
+        value = str(value)
+        if value.endswith(".0") and value[:-2].isdigit():
+            return value[:-2]
+    return value
+
+
+def _read_records(path: str) -> Iterator[Dict]:
+    if path.lower().endswith(".csv"):
+        with open(path, "r", encoding="utf-8-sig", newline="") as f:
+            yield from csv.DictReader(f)
+        return
+    
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        data = [data]
+    for item in data:
+        if isinstance(item, dict):
+            yield item
+
+
+def parse_file(path: str) -> Tuple[str, List[tuple], int, Optional[str]]:
+    """解析单个文件并在文件内去重，返回 (路径, 记录元组列表, 原始记录数, 错误信息)
+    
+    在工作进程中执行，缺少市场ID、品种ID或交易日期的记录会被丢弃。
+    """
+    records = {}
+    count = 0
+    try:
+        for item in _read_records(path):
+            count += 1
+            record = tuple(_normalize(field, item.get(field)) for field in RECORD_FIELDS)
+            key = tuple(record[index] for index in KEY_INDEXES)
+            if not all(key):
+                continue
+            existing = records.get(key)
+            if existing is None or str(record[CRAWL_TIME_INDEX]) >= str(existing[CRAWL_TIME_INDEX]):
+                records[key] = record
+    except Exception as e:
+        return path, [], count, str(e)
+    return path, list(records.values()), count, None
+
+
+class BackfillImporter:
+    """并行解析历史文件并批量写入数据库"""
+    
+    def __init__(self, db_manager: DatabaseManager, data_dir: str = "market_data",
+                 workers: Optional[int] = None, batch_size: int = DEFAULT_BATCH_SIZE,
+                 include_derived: bool = True):
+        if batch_size <= 0:
+            raise ValueError("batch_size 必须大于0")
+        self.db_manager = db_manager
+        self.data_dir = data_dir
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.include_derived = include_derived
+    
+    def _pending_files(self, conn, force: bool) -> Tuple[List[Tuple[str, int, float]], int]:
+        """返回需要导入的 (路径, 大小, 修改时间) 和跳过的文件数"""
+        loaded = {} if force else self.db_manager.get_backfilled_files(conn)
+        pending = []
+        skipped = 0
+        for path in discover_files(self.data_dir, self.include_derived):
+            stat = os.stat(path)
+            if loaded.get(path) == (stat.st_size, stat.st_mtime):
+                skipped += 1
+                continue
+            pending.append((path, stat.st_size, stat.st_mtime))
+        return pending, skipped
+    
+    def run(self, force: bool = False, optimize: bool = True) -> Dict:
+        """执行回填，force 时忽略已导入记录重新导入全部文件"""
+        if not os.path.isdir(self.data_dir):
+            raise ValueError(f"数据目录不存在: {self.data_dir}")
+        
+        start_time = time.time()
+        stats = {
+            "files_loaded": 0,
+            "files_failed": 0,
+            "records_parsed": 0,
+            "records_unique": 0,  # 批次内去重后的记录数
+            "rows_written": 0,
+        }
+        failed_files = []
+        
+        with self.db_manager.bulk_connection() as conn:
+            pending, skipped = self._pending_files(conn, force)
+            if not pending and not self.db_manager.get_unfinished_backfill(conn):
+                logger.info(f"没有需要回填的文件, 跳过未变化的 {skipped} 个")
+                return {"run_id": None, "data_dir": self.data_dir, "files_total": skipped,
+                        "files_skipped": skipped, **stats, "failed_files": []}
+            
+            logger.info(f"回填开始: 待导入 {len(pending)} 个文件, 跳过未变化的 {skipped} 个, "
+                        f"{self.workers} 个解析进程")
+            # 删除索引推迟到第一次写入前，全部文件解析失败时不必重建；上次中断的批次直接继续
+            run_id = None
+            if self.db_manager.get_unfinished_backfill(conn):
+                run_id = self.db_manager.begin_bulk_load(conn)
+            
+            # 批次缓冲：去重键 -> 记录元组，以及随批次一起提交的文件
+            buffer: Dict[tuple, tuple] = {}
+            buffer_files: List[tuple] = []
+            
+            def flush():
+                nonlocal run_id
+                if not buffer_files:
+                    return
+                if run_id is None:
+                    run_id = self.db_manager.begin_bulk_load(conn)
+                data_list = [dict(zip(RECORD_FIELDS, record)) for record in buffer.values()]
+                stats["rows_written"] += self.db_manager.bulk_upsert(conn, data_list, buffer_files, run_id)
+                stats["records_unique"] += len(data_list)
+                stats["files_loaded"] += len(buffer_files)
+                buffer.clear()
+                buffer_files.clear()
+            
+            file_stats = {path: (size, mtime) for path, size, mtime in pending}
+            last_log = time.time()
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                queue = iter(pending)
+                running = set()
+                while True:
+                    # 限制在途任务数量，避免解析结果堆积在主进程内存中
+                    while len(running) < self.workers * 2:
+                        item = next(queue, None)
+                        if item is None:
+                            break
+                        running.add(executor.submit(parse_file, item[0]))
+                    if not running:
+                        break
+                    
+                    done, running = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        path, records, count, error = future.result()
+                        stats["records_parsed"] += count
+                        if error:
+                            stats["files_failed"] += 1
+                            failed_files.append({"path": path, "error": error})
+                            logger.error(f"解析文件失败 {path}: {error}")
+                            continue
+                        
+                        for record in records:
+                            key = tuple(record[index] for index in KEY_INDEXES)
+                            existing = buffer.get(key)
+                            if existing is None or str(record[CRAWL_TIME_INDEX]) >= str(existing[CRAWL_TIME_INDEX]):
+                                buffer[key] = record
+                        size, mtime = file_stats[path]
+                        buffer_files.append((path, size, mtime, len(records)))
+                        if len(buffer) >= self.batch_size:
+                            flush()
+                    
+                    if time.time() - last_log >= PROGRESS_LOG_SECONDS:
+                        last_log = time.time()
+                        elapsed = last_log - start_time
+                        logger.info(f"回填进度: 文件 {stats['files_loaded']}/{len(pending)}, "
+                                    f"解析 {stats['records_parsed']} 条, 写入 {stats['rows_written']} 条, "
+                                    f"{stats['files_loaded'] / elapsed:.1f} 文件/秒, "
+                                    f"{stats['records_parsed'] / elapsed:.0f} 条/秒")
+            flush()
+            load_seconds = time.time() - start_time
+            
+            finish_timings = self.db_manager.finish_bulk_load(conn, run_id) if run_id else None
+        
+        optimize_result = None
+        if optimize and run_id:
+            optimize_result = self.db_manager.optimize_database(force=True)["action"]
+        
+        result = {
+            "run_id": run_id,
+            "data_dir": self.data_dir,
+            "files_total": len(pending) + skipped,
+            "files_skipped": skipped,
+            **stats,
+            "failed_files": failed_files,
+            "load_seconds": round(load_seconds, 3),
+            "finish_seconds": finish_timings,
+            "optimize": optimize_result,
+            "total_seconds": round(time.time() - start_time, 3),
+            "files_per_second": round(stats["files_loaded"] / load_seconds, 2) if load_seconds > 0 else 0.0,
+            "rows_per_second": round(stats["records_parsed"] / load_seconds, 1) if load_seconds > 0 else 0.0,
+        }
+        logger.info(f"回填完成: {result['files_loaded']} 个文件, 解析 {result['records_parsed']} 条, "
+                    f"去重后 {result['records_unique']} 条, 写入 {result['rows_written']} 条, "
+                    f"{result['files_per_second']} 文件/秒, {result['rows_per_second']} 条/秒, "
+                    f"总耗时 {result['total_seconds']} 秒")
+        return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="历史数据批量回填")
+    parser.add_argument("--data-dir", default="market_data", help="爬虫数据目录")
+    parser.add_argument("--db", default="market_data.db", help="数据库文件路径")
+    parser.add_argument("--workers", type=int, help="解析进程数，默认CPU核数")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="每个事务写入的记录数")
+    parser.add_argument("--skip-derived", action="store_true", help="跳过 summary/、merged/ 和 *_summary.csv 汇总副本")
+    parser.add_argument("--force", action="store_true", help="忽略导入记录，重新导入全部文件")
+    parser.add_argument("--no-optimize", action="store_true", help="完成后不执行 ANALYZE")
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    
+    importer = BackfillImporter(
+        DatabaseManager(args.db),
+        data_dir=args.data_dir,
+        workers=args.workers,
+        batch_size=args.batch_size,
+        include_derived=not args.skip_derived
+    )
+    result = importer.run(force=args.force, optimize=not args.no_optimize)
+    if result["rows_written"]:
+        # 运行中的 API 服务据此使响应缓存失效
+        DataGeneration().bump("backfill")
+    print("回填结果:", json.dumps(result, ensure_ascii=False, indent=2))
@@ -65,10 +65,11 @@ fi
 # 4. 数据文件检查
 echo
 echo "📊 数据文件状态:"
-if [ -f "data/market_prices.csv" ]; then
-    CSV_SIZE=$(du -h data/market_prices.csv | cut -f1)
-    CSV_LINES=$(wc -l < data/market_prices.csv 2>/dev/null)
-    echo -e "  ${GREEN}✅ CSV数据文件${NC}: $CSV_SIZE ($CSV_LINES 行)"
+if ls data/market_prices/*/segment-*.csv >/dev/null 2>&1; then
+    CSV_SIZE=$(du -sh data/market_prices | cut -f1)
+    CSV_SEGMENTS=$(ls data/market_prices/*/segment-*.csv | wc -l)
+    CSV_LINES=$(cat data/market_prices/*/segment-*.csv 2>/dev/null | wc -l)
+    echo -e "  ${GREEN}✅ CSV数据文件${NC}: $CSV_SIZE ($CSV_SEGMENTS 个分段, $CSV_LINES 行)"
 else
     echo -e "  ${RED}❌ CSV数据文件不存在${NC}"
 fi
@@ -161,7 +162,7 @@ if [ -z "$SCHEDULER_PIDS" ]; then
     echo "  🔧 启动调度器: python3 scheduler_service.py &"
 fi
 
-if [ ! -f "data/market_prices.csv" ]; then
+if ! ls data/market_prices/*/segment-*.csv >/dev/null 2>&1; then
     echo "  📊 初始化数据: python3 market_crawler.py"
 fi
 
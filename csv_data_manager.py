@@ -5,36 +5,515 @@ CSV数据管理器 - 简单的数据存储和查询
 """
 
 import os
+import importlib.util
+import re
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+import numpy as np
 import pandas as pd
 import json
 from datetime import datetime
-from typing import Dict, List, Optional
+from typing import Any, Callable, Dict, List, Optional
 import logging
+from arrow_snapshot import ArrowSnapshot, signature_digest
+from data_exporter import export_chunks
+from response_cache import DataGeneration
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# CSV 列类型：重复值很多的文本列用 category，价格用 float32，交易量用 float64（超过 2^24 的整数不能用 float32 精确表示），
+# 日期列解析为 datetime，其余列按字符串读取，不做类型推断
+CATEGORY_COLUMNS = [
+    '省份', '省份代码', '市场ID', '市场代码', '市场名称', '市场类型', '地区名称', '地区代码',
+    '品种ID', '品种名称', '品种类型', '品种类型ID', '计量单位', '产地', '销售地'
+]
+PRICE_COLUMNS = ['最低价', '平均价', '最高价']
+FLOAT_COLUMNS = PRICE_COLUMNS + ['交易量']
+DATE_COLUMNS = ['交易日期', '爬取时间', '保存时间']
+
+# 日期列按列固定输出格式，不按取值推断：00:00:00 的爬取时间仍输出时分秒
+DATE_FORMATS = {
+    '交易日期': '%Y-%m-%d',
+    '爬取时间': '%Y-%m-%d %H:%M:%S',
+    '保存时间': '%Y-%m-%d %H:%M:%S',
+}
+DEFAULT_DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# 这些编码列在类型化加载之前由 read_csv 推断为整数，接口输出时全部取值都是整数文本的列仍返回 int
+INTEGER_CODE_COLUMNS = ['市场代码', '省份代码', '地区代码', '品种类型ID']
+INTEGER_PATTERN = re.compile(r'^-?\d+$')
+
+# 输出时 float32 还原为 float64 后保留的小数位，避免 1.71 显示为 1.7100000381
+FLOAT_OUTPUT_DECIMALS = 4
+
+# float32 只用于内存中的数据；保存、合并、清理和迁移按 float64 读写，重写分段不损失精度
+STORAGE_FLOAT_DTYPE = 'float64'
+
+# 分段存储：每次保存写入 market_prices/<YYYY-MM>/segment-<序号>.csv，读取时按序号合并，
+# 同一 (市场名称, 品种名称, 交易日期) 以序号大的分段为准；分区内分段数达到阈值后在后台合并
+DEDUPE_COLUMNS = ['市场名称', '品种名称', '交易日期']
+SEGMENT_PREFIX = 'segment-'
+SEGMENT_PATTERN = re.compile(r'^segment-(\d+)\.csv$')
+COMPACT_SEGMENTS = 8
+
+# 按交易日期所在月份分区，交易日期缺失或无法解析的记录放在 undated 分区
+PARTITION_FORMAT = '%Y-%m'
+UNDATED_PARTITION = 'undated'
+PARTITION_PATTERN = re.compile(r'^(\d{4}-\d{2}|undated)$')
+
+# 读取期间分段被合并删除时重新列出分段的次数
+LOAD_RETRIES = 3
+
+# 分区目录中的锁文件：多个工作进程向同一分区写入时，选择分段序号和替换分段在锁内进行
+PARTITION_LOCK = '.lock'
+
+
+@contextmanager
+def file_lock(path: str):
+    """跨进程的排他锁（flock），等待其他进程释放；不支持 flock 的平台只依赖进程内的锁"""
+    try:
+        import fcntl
+    except ImportError:
+        yield
+        return
+    
+    with open(path, "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def column_float_dtype(column: str, float_dtype: str = 'float32') -> str:
+    """数值列的类型：价格列用 float_dtype，交易量始终用 float64"""
+    return float_dtype if column in PRICE_COLUMNS else 'float64'
+
+
+def apply_schema(df: pd.DataFrame, float_dtype: str = 'float32') -> pd.DataFrame:
+    """按 CSV 列类型转换 DataFrame，已是目标类型的列不重复转换；写回磁盘的数据 float_dtype 用 float64"""
+    for column in df.columns:
+        if column in CATEGORY_COLUMNS and not isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].astype('string').astype('category')
+        elif column in FLOAT_COLUMNS and df[column].dtype != column_float_dtype(column, float_dtype):
+            df[column] = pd.to_numeric(df[column], errors='coerce').astype(column_float_dtype(column, float_dtype))
+        elif column in DATE_COLUMNS and not pd.api.types.is_datetime64_any_dtype(df[column]):
+            parsed = pd.to_datetime(df[column], format='ISO8601', errors='coerce')
+            # 存在无法解析的值时保留原始文本，避免重新保存时丢失数据
+            if (parsed.isna() & df[column].notna()).any():
+                logger.warning(f"列 {column} 含有无法解析的日期，按文本保留")
+                continue
+            df[column] = parsed
+    return df
+
+
+def format_output(df: pd.DataFrame) -> pd.DataFrame:
+    """将类型化的列转换回接口和导出使用的文本和数值形式"""
+    df = format_dates(df.copy())
+    for column in df.columns:
+        series = df[column]
+        if series.dtype == 'float32':
+            df[column] = series.astype('float64').round(FLOAT_OUTPUT_DECIMALS)
+        elif is_integer_codes(column, series):
+            df[column] = series.astype(object).map(int, na_action='ignore')
+    return df.astype(object).where(df.notna(), None)
+
+
+def is_integer_codes(column: str, series: pd.Series) -> bool:
+    """编码列的全部取值都是整数文本时输出为 int；按整列（全部取值集合）判断，与类型化加载之前 read_csv 的推断结果一致"""
+    if column not in INTEGER_CODE_COLUMNS or not isinstance(series.dtype, pd.CategoricalDtype):
+        return False
+    categories = series.cat.categories
+    return bool(len(categories)) and all(INTEGER_PATTERN.match(str(value)) for value in categories)
+
+
+def output_column_types(df: pd.DataFrame) -> Dict[str, str]:
+    """format_output 输出的各列类型（INTEGER / REAL / TEXT），按整个 DataFrame 确定，供 Parquet 导出使用"""
+    column_types = {}
+    for column in df.columns:
+        series = df[column]
+        if is_integer_codes(column, series) or pd.api.types.is_integer_dtype(series):
+            column_types[str(column)] = 'INTEGER'
+        elif pd.api.types.is_float_dtype(series):
+            column_types[str(column)] = 'REAL'
+        elif (isinstance(series.dtype, pd.CategoricalDtype) or pd.api.types.is_datetime64_any_dtype(series)
+              or pd.api.types.is_string_dtype(series)):
+            column_types[str(column)] = 'TEXT'
+    return column_types
+
+
+def format_dates(df: pd.DataFrame) -> pd.DataFrame:
+    """将 datetime 列按 DATE_FORMATS 转换为文本，缺失值为 None；直接修改传入的 DataFrame"""
+    for column in df.columns:
+        series = df[column]
+        if pd.api.types.is_datetime64_any_dtype(series):
+            formatted = series.dt.strftime(DATE_FORMATS.get(column, DEFAULT_DATE_FORMAT))
+            df[column] = formatted.astype(object).where(series.notna(), None)
+    return df
+
+
+def merge_segments(frames: List[pd.DataFrame], dedupe: bool = True,
+                   float_dtype: str = 'float32') -> pd.DataFrame:
+    """按顺序合并各分段，dedupe 时同一键保留最后出现的记录"""
+    if len(frames) == 1:
+        df = frames[0]
+    else:
+        # 先统一各分段 category 列的取值集合，拼接后仍是 category，不会退化为 object
+        frames = list(frames)
+        for column in CATEGORY_COLUMNS:
+            dtypes = [frame[column].dtype for frame in frames if column in frame.columns]
+            if len(dtypes) < 2 or not all(isinstance(dtype, pd.CategoricalDtype) for dtype in dtypes):
+                continue
+            categories = dtypes[0].categories.append([dtype.categories for dtype in dtypes[1:]]).unique()
+            frames = [
+                frame.assign(**{column: frame[column].cat.set_categories(categories)})
+                if column in frame.columns else frame
+                for frame in frames
+            ]
+        df = apply_schema(pd.concat(frames, ignore_index=True), float_dtype)
+    
+    if not dedupe or not all(column in df.columns for column in DEDUPE_COLUMNS):
+        return df
+    return df.drop_duplicates(subset=DEDUPE_COLUMNS, keep='last', ignore_index=True)
+
+
+def split_partitions(df: pd.DataFrame) -> List[tuple]:
+    """按交易日期所在月份拆分为 (分区名, DataFrame) 列表，按分区名排序"""
+    if df.empty:
+        return []
+    if '交易日期' not in df.columns:
+        return [(UNDATED_PARTITION, df)]
+    
+    dates = df['交易日期']
+    if not pd.api.types.is_datetime64_any_dtype(dates):
+        dates = pd.to_datetime(dates, format='ISO8601', errors='coerce')
+    names = dates.dt.strftime(PARTITION_FORMAT).fillna(UNDATED_PARTITION).to_numpy()
+    return [(name, frame) for name, frame in df.groupby(names, sort=True)]
+
+
+class ColumnIndex:
+    """单列倒排索引：category 列的每个取值对应一个按行号升序排列的行号数组
+    
+    模糊匹配只在几百个不同取值上执行，再映射到行号，不需要逐行做字符串匹配。
+    """
+    
+    def __init__(self, series: pd.Series):
+        self.categories = [str(value) for value in series.cat.categories]
+        # 取值编号整体加1，空值（-1）落在第0个桶
+        self.codes = series.cat.codes.to_numpy().astype(np.int32) + 1
+        row_type = np.int32 if len(series) < 2 ** 31 else np.int64
+        self.rows_by_code = np.argsort(self.codes, kind='stable').astype(row_type)
+        self.offsets = np.concatenate((
+            [0], np.cumsum(np.bincount(self.codes, minlength=len(self.categories) + 1))
+        ))
+    
+    def match(self, value: str) -> np.ndarray:
+        """返回包含 value 的取值编号，与 str.contains(value, case=False) 的匹配规则一致"""
+        pattern = re.compile(str(value), re.IGNORECASE)
+        return np.array(
+            [code + 1 for code, category in enumerate(self.categories) if pattern.search(category)],
+            dtype=np.int32
+        )
+    
+    def count(self, codes: np.ndarray) -> int:
+        """匹配取值的总行数，用于选择最有选择性的条件"""
+        return int((self.offsets[codes + 1] - self.offsets[codes]).sum())
+    
+    def rows(self, codes: np.ndarray) -> np.ndarray:
+        """匹配取值的行号，按升序合并"""
+        parts = [self.rows_by_code[self.offsets[code]:self.offsets[code + 1]] for code in codes]
+        if not parts:
+            return np.empty(0, dtype=self.rows_by_code.dtype)
+        if len(parts) == 1:
+            return parts[0]
+        return np.sort(np.concatenate(parts))
+    
+    def contains(self, rows: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        """判断候选行的取值是否在匹配集合中，返回布尔掩码"""
+        table = np.zeros(len(self.categories) + 1, dtype=bool)
+        table[codes] = True
+        return table[self.codes[rows]]
+
+
 class CSVDataManager:
     """CSV数据管理器"""
     
-    def __init__(self, data_dir: str = "data"):
+    def __init__(self, data_dir: str = "data", snapshot: Optional[bool] = None):
         self.data_dir = data_dir
+        # 旧版的单文件存储，启动时迁移到按月分区的目录
         self.csv_file = os.path.join(data_dir, "market_prices.csv")
+        # 按交易日期所在月份分区：market_prices/<YYYY-MM>/segment-<序号>.csv，
+        # 每次保存在涉及的分区中各写入一个新的不可变分段，读取时按分段顺序合并
+        self.segment_dir = os.path.join(data_dir, "market_prices")
+        
+        # 所有分区合并后的 DataFrame 常驻内存，按各分段的 (路径, 修改时间, 大小) 判断是否需要重新读取；
+        # generation 在每次重新加载或写入后递增，派生结果按 generation 缓存
+        self.lock = threading.RLock()
+        # 同一时间只运行一个合并或清理任务
+        self.compaction_lock = threading.Lock()
+        self.generation = 0
+        self._frame: Optional[pd.DataFrame] = None
+        self._frame_signature = None
+        # 分区名 -> (分段签名, DataFrame)，全量数据加载后指向合并结果中对应的行区间
+        self._partitions: Dict[str, tuple] = {}
+        self._partition_rows: Dict[str, tuple] = {}
+        self._derived: Dict[Any, Any] = {}
+        self.load_stats: Dict[str, Any] = {}
+        
+        # 多个工作进程共享的 Arrow 快照，未指定时安装了 pyarrow 即启用
+        if snapshot is None:
+            snapshot = importlib.util.find_spec("pyarrow") is not None
+        self.snapshot = ArrowSnapshot(os.path.join(data_dir, "snapshot")) if snapshot else None
+        self.snapshot_lock = threading.Lock()
+        # 内存中的数据对应的版本文件状态，以及映射的快照版本（数据来自 CSV 时为 None）
+        self._snapshot_stat = None
+        self._snapshot_version = None
+        
         self.ensure_data_dir()
+        self._migrate_layout()
     
     def ensure_data_dir(self):
         """确保数据目录存在"""
-        if not os.path.exists(self.data_dir):
-            os.makedirs(self.data_dir)
-            logger.info(f"创建数据目录: {self.data_dir}")
+        for path in (self.data_dir, self.segment_dir):
+            if not os.path.exists(path):
+                # 多个工作进程可能同时创建
+                os.makedirs(path, exist_ok=True)
+                logger.info(f"创建数据目录: {path}")
+    
+    def _migrate_layout(self):
+        """把旧版 market_prices.csv 和未分区的分段按月拆分到分区目录
+        
+        每个工作进程导入模块时都会执行；迁移在跨进程的文件锁内进行，拿到锁后重新列出待迁移的文件，
+        先完成迁移的进程已删除源文件时其余进程直接返回。
+        """
+        if not self._migration_sources():
+            return
+        
+        with self.lock, file_lock(os.path.join(self.segment_dir, PARTITION_LOCK)):
+            sources = self._migration_sources()
+            if not sources:
+                return
+            
+            logger.info(f"迁移 {len(sources)} 个CSV文件到按月分区的目录: {self.segment_dir}")
+            df = merge_segments([self._read_csv(path, STORAGE_FLOAT_DTYPE)[0] for path in sources],
+                                float_dtype=STORAGE_FLOAT_DTYPE)
+            for partition, frame in split_partitions(df):
+                self._append_segment(partition, frame)
+            for path in sources:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+    
+    def _migration_sources(self) -> List[str]:
+        """待迁移的旧版单文件和未分区分段"""
+        sources = [self.csv_file] if os.path.exists(self.csv_file) else []
+        return sources + [path for _, path in self._segment_files(None)]
+    
+    def _partition_dir(self, partition: Optional[str]) -> str:
+        return self.segment_dir if partition is None else os.path.join(self.segment_dir, partition)
+    
+    def _partition_names(self) -> List[str]:
+        """按月份顺序返回已有的分区名"""
+        try:
+            names = os.listdir(self.segment_dir)
+        except FileNotFoundError:
+            return []
+        return sorted(name for name in names if PARTITION_PATTERN.match(name)
+                      and os.path.isdir(os.path.join(self.segment_dir, name)))
+    
+    def _segment_files(self, partition: Optional[str]) -> List[tuple]:
+        """按写入顺序返回分区内的 (序号, 路径) 列表，partition 为 None 时列出未分区的旧版分段"""
+        directory = self._partition_dir(partition)
+        try:
+            names = os.listdir(directory)
+        except FileNotFoundError:
+            return []
+        segments = []
+        for name in names:
+            match = SEGMENT_PATTERN.match(name)
+            if match:
+                segments.append((int(match.group(1)), os.path.join(directory, name)))
+        segments.sort()
+        return segments
+    
+    def _partition_signature(self, partition: str) -> tuple:
+        """分区内各分段的 (路径, 修改时间, 大小)，按写入顺序排列；列出后被合并删除的分段不计入"""
+        signature = []
+        for _, path in self._segment_files(partition):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            signature.append((path, stat.st_mtime_ns, stat.st_size))
+        return tuple(signature)
+    
+    def _file_signature(self, partitions: List[str] = None) -> tuple:
+        """各分区的 (分区名, 分段签名)，省略没有分段的分区"""
+        names = self._partition_names() if partitions is None else partitions
+        signature = ((name, self._partition_signature(name)) for name in names)
+        return tuple(item for item in signature if item[1])
+    
+    def _append_segment(self, partition: str, df: pd.DataFrame) -> str:
+        """在分区中写入一个新的分段，序号大于分区内所有已有分段；调用方持有 self.lock
+        
+        其他工作进程可能同时写入同一分区，选择序号到改名完成期间持有分区的文件锁。
+        """
+        directory = self._partition_dir(partition)
+        os.makedirs(directory, exist_ok=True)
+        with file_lock(os.path.join(directory, PARTITION_LOCK)):
+            segments = self._segment_files(partition)
+            seq = segments[-1][0] + 1 if segments else 0
+            path = os.path.join(directory, f"{SEGMENT_PREFIX}{seq:08d}.csv")
+            self._write_file(df, path + ".tmp")
+            os.replace(path + ".tmp", path)
+        return path
+    
+    def storage_info(self) -> Dict:
+        """分区和分段数量、占用的磁盘空间以及当前快照的版本"""
+        signature = self._file_signature()
+        info = {
+            "segment_dir": self.segment_dir,
+            "partitions": len(signature),
+            "segments": sum(len(segments) for _, segments in signature),
+            "bytes": sum(size for _, segments in signature for _, _, size in segments),
+        }
+        if self.snapshot:
+            version = self.snapshot.read_version()
+            info["snapshot"] = dict(version, current=version.get("digest") == signature_digest(signature)) if version else None
+        return info
+    
+    @staticmethod
+    def _read_csv(path: str, float_dtype: str = 'float32'):
+        """按列类型读取 CSV，安装了 pyarrow 时使用多线程的 pyarrow 解析器，返回 (DataFrame, 引擎名)"""
+        columns = pd.read_csv(path, encoding='utf-8-sig', nrows=0).columns
+        
+        try:
+            import pyarrow as pa
+            import pyarrow.csv as pa_csv
+        except ImportError:
+            pa = None
+        
+        if pa is not None:
+            # 直接读成字典编码和浮点数，转换为 pandas 时得到 category 列，编号等列不会被推断成数字
+            column_types = {}
+            for column in columns:
+                if column in CATEGORY_COLUMNS:
+                    column_types[column] = pa.dictionary(pa.int32(), pa.string())
+                elif column in FLOAT_COLUMNS:
+                    column_types[column] = pa.float32() if column_float_dtype(column, float_dtype) == 'float32' else pa.float64()
+                else:
+                    column_types[column] = pa.string()
+            table = pa_csv.read_csv(path, convert_options=pa_csv.ConvertOptions(
+                column_types=column_types, strings_can_be_null=True
+            ))
+            return apply_schema(table.to_pandas(), float_dtype), "pyarrow"
+        
+        dtype = {
+            column: 'category' if column in CATEGORY_COLUMNS
+            else column_float_dtype(column, float_dtype) if column in FLOAT_COLUMNS else str
+            for column in columns
+        }
+        return apply_schema(pd.read_csv(path, encoding='utf-8-sig', dtype=dtype), float_dtype), "c"
+    
+    @staticmethod
+    def _write_file(df: pd.DataFrame, path: str):
+        """写入 CSV 并刷到磁盘，调用方写入临时文件后改名，读取方不会看到写了一半的分段
+        
+        调用方应传入 float64 的数据；仍为 float32 的列按输出精度还原，不写出 1.7100000381 这样的值。
+        日期列按 DATE_FORMATS 写成文本，不依赖 to_csv 对 datetime 的默认格式。
+        """
+        narrowed = [column for column in df.columns if df[column].dtype == 'float32']
+        if narrowed:
+            df = df.astype({column: 'float64' for column in narrowed}).round(
+                {column: FLOAT_OUTPUT_DECIMALS for column in narrowed}
+            )
+        if any(pd.api.types.is_datetime64_any_dtype(df[column]) for column in df.columns):
+            df = format_dates(df.copy())
+        with open(path, 'w', encoding='utf-8-sig', newline='') as f:
+            df.to_csv(f, index=False)
+            f.flush()
+            os.fsync(f.fileno())
+    
+    def memory_report(self, compare_untyped: bool = True) -> Dict:
+        """返回内存中数据的按列占用，compare_untyped 时另外按默认类型推断读取一次作对比"""
+        df = self.load_data()
+        columns = {
+            str(column): {
+                "dtype": str(df[column].dtype),
+                "bytes": int(df[column].memory_usage(deep=True, index=False))
+            }
+            for column in df.columns
+        }
+        report = {
+            **self.load_stats,
+            "typed_bytes": int(df.memory_usage(deep=True).sum()),
+            "columns": columns
+        }
+        
+        paths = [path for _, segments in self._file_signature() for path, _, _ in segments]
+        if compare_untyped and paths:
+            start = time.time()
+            untyped = pd.concat(
+                [pd.read_csv(path, encoding='utf-8-sig') for path in paths], ignore_index=True
+            ).drop_duplicates(subset=DEDUPE_COLUMNS, keep='last')
+            report["untyped_load_seconds"] = round(time.time() - start, 3)
+            report["untyped_bytes"] = int(untyped.memory_usage(deep=True).sum())
+            report["ratio"] = round(report["untyped_bytes"] / report["typed_bytes"], 2) if report["typed_bytes"] else None
+            for column in untyped.columns:
+                if str(column) in columns:
+                    columns[str(column)]["untyped_bytes"] = int(untyped[column].memory_usage(deep=True, index=False))
+        
+        return report
+    
+    def _invalidate(self):
+        """丢弃内存中的数据和派生结果，下次访问时重新读取"""
+        with self.lock:
+            self._frame = None
+            self._frame_signature = None
+            self._partitions.clear()
+            self._partition_rows.clear()
+            self._snapshot_stat = None
+            self._snapshot_version = None
+            self._derived.clear()
+            self.generation += 1
+    
+    def _memoize(self, key, compute: Callable[[pd.DataFrame], Any]):
+        """按当前数据版本缓存派生结果（省份、品种、市场列表和统计信息）"""
+        df = self.load_data()
+        with self.lock:
+            generation = self.generation
+            if key in self._derived:
+                return self._derived[key]
+        
+        value = compute(df)
+        with self.lock:
+            # 计算期间数据已更新时不写入缓存
+            if generation == self.generation:
+                self._derived[key] = value
+        return value
     
     def save_data(self, data_list: List[Dict]) -> int:
-        """保存数据到CSV文件"""
+        """保存数据，在涉及的月分区中各写入一个新的分段，耗时只与本批数据量有关"""
         if not data_list:
             logger.warning("没有数据需要保存")
             return 0
         
+        with self.lock:
+            saved, partitions = self._save_data(data_list)
+            crowded = [name for name in partitions if len(self._segment_files(name)) >= COMPACT_SEGMENTS]
+        
+        if crowded:
+            self.compact_in_background(crowded)
+        if saved:
+            self.publish_in_background()
+        return saved
+    
+    def _save_data(self, data_list: List[Dict]) -> tuple:
         try:
             # 转换为DataFrame
             df = pd.DataFrame(data_list)
@@ -42,75 +521,437 @@ class CSVDataManager:
             # 添加保存时间戳
             df['保存时间'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
             
-            # 如果CSV文件已存在，追加数据
-            if os.path.exists(self.csv_file):
-                # 读取现有数据
-                existing_df = pd.read_csv(self.csv_file, encoding='utf-8-sig')
-                
-                # 合并数据，去重
-                combined_df = pd.concat([existing_df, df], ignore_index=True)
-                
-                # 根据关键字段去重（市场名称、品种名称、交易日期）
-                if all(col in combined_df.columns for col in ['市场名称', '品种名称', '交易日期']):
-                    combined_df = combined_df.drop_duplicates(
-                        subset=['市场名称', '品种名称', '交易日期'], 
-                        keep='last'
-                    )
-                
-                df = combined_df
+            # 与内存中的数据使用相同的列类型，日期列才能正确去重；价格按 float64 写入，不损失精度
+            df = apply_schema(df, STORAGE_FLOAT_DTYPE)
             
-            # 保存到CSV
-            df.to_csv(self.csv_file, index=False, encoding='utf-8-sig')
+            # 批次内按关键字段去重（市场名称、品种名称、交易日期），与已有数据的去重在读取合并时完成
+            if all(col in df.columns for col in DEDUPE_COLUMNS):
+                df = df.drop_duplicates(subset=DEDUPE_COLUMNS, keep='last')
             
-            logger.info(f"成功保存 {len(data_list)} 条数据到 {self.csv_file}")
-            logger.info(f"CSV文件总记录数: {len(df)}")
-            
-            return len(data_list)
+            partitions = []
+            for partition, frame in split_partitions(df):
+                path = self._append_segment(partition, frame)
+                partitions.append(partition)
+                logger.info(f"成功保存 {len(frame)} 条数据到 {path}")
             
+            return len(data_list), partitions
+        
         except Exception as e:
             logger.error(f"保存数据到CSV失败: {e}")
-            return 0
+            return 0, []
     
-    def load_data(self) -> pd.DataFrame:
-        """从CSV文件加载数据"""
+    def load_data(self, start_date: str = None, end_date: str = None) -> pd.DataFrame:
+        """从CSV分区加载数据，指定日期范围时只读取范围内的月分区
+        
+        文件未变化时直接返回内存中的 DataFrame，该对象在多个请求间共享，调用方不能原地修改。
+        """
         try:
-            if not os.path.exists(self.csv_file):
-                logger.warning(f"CSV文件不存在: {self.csv_file}")
-                return pd.DataFrame()
-            
-            df = pd.read_csv(self.csv_file, encoding='utf-8-sig')
-            logger.info(f"从CSV加载了 {len(df)} 条记录")
-            return df
-            
+            if start_date or end_date:
+                return self._load_range(start_date, end_date)
+            return self._load_frame()
         except Exception as e:
             logger.error(f"从CSV加载数据失败: {e}")
             return pd.DataFrame()
     
-    def search_data(self, filters: Dict = None, limit: int = 100) -> List[Dict]:
-        """搜索数据"""
+    def _load_partition(self, name: str, signature: tuple) -> tuple:
+        """返回分区的 DataFrame 和读取的分段数；调用方持有 self.lock
+        
+        已缓存的分段未变化、只是新增了分段时，只读取新分段并与缓存合并。
+        """
+        cached = self._partitions.get(name)
+        if cached is not None and cached[0] == signature:
+            return cached[1], 0
+        
+        incremental = cached is not None and signature[:len(cached[0])] == cached[0]
+        pending = signature[len(cached[0]):] if incremental else signature
+        frames = [self._read_csv(path)[0] for path, _, _ in pending]
+        df = merge_segments([cached[1]] + frames if incremental else frames)
+        self._partitions[name] = (signature, df)
+        return df, len(pending)
+    
+    def _load_frame(self) -> pd.DataFrame:
+        """返回缓存的全部数据，分段变化时在锁内重新读取变化的分区，读取失败时抛出异常
+        
+        启用快照时，版本文件指向的快照与当前分段一致则直接映射快照，不解析 CSV。
+        """
+        signature = self._file_signature()
+        frame = self._frame
+        if frame is not None and signature == self._frame_signature and self._snapshot_unchanged():
+            return frame
+        
+        with self.lock:
+            # 等待锁期间其他线程可能已完成加载
+            for _ in range(LOAD_RETRIES):
+                signature = self._file_signature()
+                version_stat = self.snapshot.version_stat() if self.snapshot else None
+                if (self._frame is not None and signature == self._frame_signature
+                        and version_stat == self._snapshot_stat):
+                    return self._frame
+                
+                if not signature:
+                    logger.warning(f"CSV数据不存在: {self.segment_dir}")
+                    return pd.DataFrame()
+                
+                if self.snapshot:
+                    df = self._load_snapshot(signature, version_stat)
+                    if df is not None:
+                        return df
+                
+                start = time.time()
+                try:
+                    loaded = [(name, *self._load_partition(name, segments)) for name, segments in signature]
+                except FileNotFoundError:
+                    # 读取期间分段被其他进程合并或清理，重新列出分段
+                    continue
+                
+                # 分区之间交易日期不重叠，直接拼接
+                df = merge_segments([frame for _, frame, _ in loaded], dedupe=False)
+                rows = {}
+                offset = 0
+                for name, frame, _ in loaded:
+                    rows[name] = (offset, offset + len(frame))
+                    offset += len(frame)
+                segments_read = sum(count for _, _, count in loaded)
+                self.load_stats = {
+                    "rows": len(df),
+                    "source": "csv",
+                    "partitions": len(signature),
+                    "segments": sum(len(segments) for _, segments in signature),
+                    "segments_read": segments_read,
+                    "load_seconds": round(time.time() - start, 3),
+                    "memory_bytes": int(df.memory_usage(deep=True).sum()),
+                }
+                logger.info(f"从CSV加载了 {len(df)} 条记录 ({len(signature)} 个分区, 读取 {segments_read} 个分段), "
+                            f"占用 {self.load_stats['memory_bytes'] / 1024 / 1024:.1f} MB, "
+                            f"耗时 {self.load_stats['load_seconds']} 秒")
+                
+                # 读取期间分段被外部修改时不缓存，下次访问重新读取
+                if self._file_signature() == signature:
+                    self._set_frame(df, signature, rows)
+                    self._snapshot_stat = version_stat
+                    self._snapshot_version = None
+                    # 快照落后于分段时在后台重新发布
+                    self.publish_in_background()
+                return df
+            
+            raise RuntimeError(f"分段在读取期间反复变化: {self.segment_dir}")
+    
+    def _set_frame(self, df: pd.DataFrame, signature: tuple, rows: Dict[str, tuple]):
+        """替换缓存的全部数据；调用方持有 self.lock"""
+        # 分区缓存改为指向合并结果中的行区间，不额外占用内存
+        self._partitions = {
+            name: (segments, df.iloc[rows[name][0]:rows[name][1]]) for name, segments in signature
+        }
+        self._partition_rows = rows
+        self._derived.clear()
+        self.generation += 1
+        self._frame = df
+        self._frame_signature = signature
+    
+    def _snapshot_unchanged(self) -> bool:
+        return self.snapshot is None or self.snapshot.version_stat() == self._snapshot_stat
+    
+    def _load_snapshot(self, signature: tuple, version_stat) -> Optional[pd.DataFrame]:
+        """版本文件指向的快照与当前分段一致时映射快照，否则返回 None；调用方持有 self.lock"""
+        version = self.snapshot.read_version()
+        if not version or version.get("digest") != signature_digest(signature):
+            return None
+        
+        if self._snapshot_version == version["version"] and self._frame_signature == signature:
+            self._snapshot_stat = version_stat
+            return self._frame
+        
+        start = time.time()
+        try:
+            df, metadata = self.snapshot.load(version)
+        except Exception as e:
+            logger.warning(f"读取Arrow快照失败，改为读取CSV: {e}")
+            return None
+        
+        df = apply_schema(df)
+        rows = {name: tuple(bounds) for name, bounds in metadata["partition_rows"].items()}
+        self._set_frame(df, signature, rows)
+        self._snapshot_stat = version_stat
+        self._snapshot_version = version["version"]
+        self.load_stats = {
+            "rows": len(df),
+            "source": "snapshot",
+            "snapshot_version": version["version"],
+            "partitions": len(signature),
+            "segments": sum(len(segments) for _, segments in signature),
+            "segments_read": 0,
+            "load_seconds": round(time.time() - start, 3),
+            "memory_bytes": int(df.memory_usage(deep=True).sum()),
+        }
+        logger.info(f"映射Arrow快照 {version['file']}: {len(df)} 条记录, 耗时 {self.load_stats['load_seconds']} 秒")
+        return df
+    
+    def publish_in_background(self):
+        """在后台线程中发布快照，已有发布任务在运行时跳过"""
+        if self.snapshot is None or self.snapshot_lock.locked():
+            return
+        threading.Thread(target=self.publish_snapshot, name="csv-snapshot", daemon=True).start()
+    
+    def publish_snapshot(self) -> Optional[Dict]:
+        """把当前数据写成 Arrow 快照并切换版本文件
+        
+        快照已是最新、未启用快照或其他线程/进程正在发布时返回 None。
+        """
+        if self.snapshot is None or not self.snapshot_lock.acquire(blocking=False):
+            return None
+        try:
+            with self.snapshot.publish_lock() as acquired:
+                if not acquired:
+                    return None
+                
+                df = self._load_frame()
+                with self.lock:
+                    if df is not self._frame:
+                        # 读取期间数据已变化，由下一次加载重新触发
+                        return None
+                    signature = self._frame_signature
+                    rows = dict(self._partition_rows)
+                
+                digest = signature_digest(signature)
+                version = self.snapshot.read_version()
+                if version and version.get("digest") == digest:
+                    return None
+                return self.snapshot.publish(df, digest, {"signature": signature, "partition_rows": rows})
+        except Exception as e:
+            logger.error(f"发布Arrow快照失败: {e}")
+            return None
+        finally:
+            self.snapshot_lock.release()
+    
+    def _load_range(self, start_date: Optional[str], end_date: Optional[str]) -> pd.DataFrame:
+        """读取交易日期在 [start_date, end_date] 内的数据，只打开范围内的月分区"""
+        start = pd.Timestamp(start_date) if start_date else None
+        end = pd.Timestamp(end_date) if end_date else None
+        if start is not None and end is not None and start > end:
+            raise ValueError(f"开始日期 {start_date} 晚于结束日期 {end_date}")
+        
+        names = [
+            name for name in self._partition_names()
+            if name != UNDATED_PARTITION
+            and (start is None or name >= start.strftime(PARTITION_FORMAT))
+            and (end is None or name <= end.strftime(PARTITION_FORMAT))
+        ]
+        signature = self._file_signature(names)
+        if not signature:
+            return pd.DataFrame()
+        
+        with self.lock:
+            frame = self._frame
+            if frame is not None and all(item in self._frame_signature for item in signature):
+                # 全部数据已在内存中，直接取对应分区的行区间
+                frames = [frame.iloc[slice(*self._partition_rows[name])] for name, _ in signature]
+            else:
+                for _ in range(LOAD_RETRIES):
+                    try:
+                        frames = [self._load_partition(name, segments)[0] for name, segments in signature]
+                        break
+                    except FileNotFoundError:
+                        signature = self._file_signature(names)
+                else:
+                    raise RuntimeError(f"分段在读取期间反复变化: {self.segment_dir}")
+        
+        if not frames:
+            return pd.DataFrame()
+        df = merge_segments(frames, dedupe=False)
+        dates = df['交易日期']
+        if not pd.api.types.is_datetime64_any_dtype(dates):
+            dates = pd.to_datetime(dates, format='ISO8601', errors='coerce')
+        mask = dates.notna()
+        if start is not None:
+            mask &= dates >= start
+        if end is not None:
+            mask &= dates <= end
+        return df[mask.to_numpy()]
+    
+    def compact_in_background(self, partitions: List[str] = None):
+        """在后台线程中合并分段，已有合并任务在运行时跳过"""
+        if self.compaction_lock.locked():
+            return
+        threading.Thread(target=self.compact_segments, args=(partitions,),
+                         name="csv-compaction", daemon=True).start()
+    
+    def compact_segments(self, partitions: List[str] = None) -> Optional[Dict]:
+        """把分区内的所有分段合并为一个，默认处理全部分区，已有合并任务在运行时返回 None
+        
+        合并结果写入临时文件后替换序号最大的分段，再删除其余旧分段；
+        合并期间新写入的分段序号更大，不受影响。
+        """
+        if not self.compaction_lock.acquire(blocking=False):
+            return None
+        try:
+            start = time.time()
+            result = {"partitions": 0, "segments_merged": 0, "bytes_before": 0, "bytes_after": 0}
+            for name in partitions or self._partition_names():
+                if len(self._segment_files(name)) < 2:
+                    continue
+                merged = self._rewrite_partition(name)
+                if merged:
+                    result["partitions"] += 1
+                    for key in ("segments_merged", "bytes_before", "bytes_after"):
+                        result[key] += merged[key]
+            result["seconds"] = round(time.time() - start, 3)
+            if result["partitions"]:
+                logger.info(f"合并了 {result['partitions']} 个分区的 {result['segments_merged']} 个CSV分段, "
+                            f"耗时 {result['seconds']} 秒")
+                # 分段文件变化后快照的签名随之失效
+                self.publish_in_background()
+            return result
+        except Exception as e:
+            logger.error(f"合并CSV分段失败: {e}")
+            return None
+        finally:
+            self.compaction_lock.release()
+    
+    def _rewrite_partition(self, name: str,
+                           transform: Callable[[pd.DataFrame], pd.DataFrame] = None) -> Optional[Dict]:
+        """合并分区内的所有分段，可选地对合并结果做变换，原子替换后更新内存中的数据"""
+        with self.lock:
+            snapshot = self._partition_signature(name)
+        if not snapshot:
+            return None
+        
+        # 读取和写入在锁外进行，期间的保存和查询不被阻塞；
+        # 内存中缓存的是 float32，写回磁盘的数据按 float64 重新读取
+        frame = merge_segments([self._read_csv(path, STORAGE_FLOAT_DTYPE)[0] for path, _, _ in snapshot],
+                               float_dtype=STORAGE_FLOAT_DTYPE)
+        if transform is not None:
+            frame = transform(frame)
+        
+        target = snapshot[-1][0]
+        # 其他进程可能同时合并同一分区，临时文件按进程区分
+        tmp_path = f"{target}.{os.getpid()}.tmp"
+        self._write_file(frame, tmp_path)
+        
+        with self.lock, file_lock(os.path.join(self._partition_dir(name), PARTITION_LOCK)):
+            os.replace(tmp_path, target)
+            for path, _, _ in snapshot[:-1]:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            
+            # 合并结果即为快照范围内的数据，之后新增的分段在下次读取时增量合并
+            stat = os.stat(target)
+            compacted = ((target, stat.st_mtime_ns, stat.st_size),)
+            self._partitions[name] = (compacted, apply_schema(frame.copy()))
+            if transform is None and self._frame_signature and (name, snapshot) in self._frame_signature:
+                # 内容不变，只更新签名，全部数据不需要重新拼接
+                self._frame_signature = tuple(
+                    (item[0], compacted) if item[0] == name else item for item in self._frame_signature
+                )
+        
+        return {
+            "segments_merged": len(snapshot),
+            "rows": len(frame),
+            "bytes_before": sum(size for _, _, size in snapshot),
+            "bytes_after": stat.st_size,
+        }
+    
+    def _column_index(self, df: pd.DataFrame, column: str) -> Optional[ColumnIndex]:
+        """获取 category 列在当前数据版本上的倒排索引，首次使用时构建"""
+        if not isinstance(df[column].dtype, pd.CategoricalDtype):
+            return None
+        
+        if df is not self._frame:
+            # 按日期范围读取的部分数据不缓存索引
+            return ColumnIndex(df[column])
+        
+        frame, index = self._memoize(('index', column), lambda frame: (frame, ColumnIndex(frame[column])))
+        if frame is not df:
+            # 构建期间数据已重新加载，为当前 DataFrame 单独构建
+            return ColumnIndex(df[column])
+        return index
+    
+    def _match_rows(self, df: pd.DataFrame, filters: Dict = None) -> Optional[np.ndarray]:
+        """返回满足全部过滤条件的行号（升序），没有有效条件时返回 None
+        
+        有索引的列先取匹配行数最少的条件的行号列表，再用其余列的取值编号逐一筛选候选行；
+        没有索引的列只在剩余的候选行上做字符串匹配。
+        """
+        conditions = [(key, value) for key, value in (filters or {}).items() if value and key in df.columns]
+        if not conditions:
+            return None
+        
+        indexed = []
+        scanned = []
+        for key, value in conditions:
+            index = self._column_index(df, key)
+            if index is None:
+                scanned.append((key, value))
+                continue
+            codes = index.match(value)
+            indexed.append((index.count(codes), index, codes))
+        
+        if indexed:
+            indexed.sort(key=lambda item: item[0])
+            _, index, codes = indexed[0]
+            rows = index.rows(codes)
+            for _, index, codes in indexed[1:]:
+                rows = rows[index.contains(rows, codes)]
+        else:
+            rows = np.arange(len(df))
+        
+        for key, value in scanned:
+            # 支持模糊搜索
+            values = df[key].iloc[rows].astype(str)
+            rows = rows[values.str.contains(str(value), case=False, na=False).to_numpy()]
+        
+        return rows
+    
+    def filter_data(self, filters: Dict = None) -> pd.DataFrame:
+        """按条件过滤数据，返回DataFrame"""
         df = self.load_data()
         
+        if df.empty:
+            return df
+        
+        rows = self._match_rows(df, filters)
+        return df if rows is None else df.iloc[rows]
+    
+    def search_data(self, filters: Dict = None, limit: int = 100,
+                    start_date: str = None, end_date: str = None) -> List[Dict]:
+        """搜索数据，只为返回的前 limit 行构造字典；指定日期范围时只读取范围内的月分区"""
+        df = self._search_frame(filters, limit, start_date, end_date)
+        
         if df.empty:
             return []
         
-        # 应用过滤条件
-        if filters:
-            for key, value in filters.items():
-                if value and key in df.columns:
-                    # 支持模糊搜索
-                    df = df[df[key].astype(str).str.contains(str(value), case=False, na=False)]
+        # 转换为字典列表（只转换返回的行）
+        return format_output(df).to_dict('records')
+    
+    def iter_search_data(self, filters: Dict = None, limit: int = 100, start_date: str = None,
+                         end_date: str = None, chunk_size: int = 5000):
+        """与 search_data 条件相同，按块产出 (列名, 行列表)，每次只转换一块"""
+        yield from self.iter_chunks(self._search_frame(filters, limit, start_date, end_date), chunk_size)
+    
+    def _search_frame(self, filters: Dict, limit: int, start_date: str, end_date: str) -> pd.DataFrame:
+        """按过滤条件选出的前 limit 行（limit 不大于0时不限），保持类型化的列"""
+        df = self.load_data(start_date, end_date)
+        
+        if df.empty:
+            return df
         
-        # 限制返回数量
-        if limit > 0:
+        rows = self._match_rows(df, filters)
+        if rows is not None:
+            if limit > 0:
+                rows = rows[:limit]
+            df = df.iloc[rows]
+        elif limit > 0:
+            # 限制返回数量
             df = df.head(limit)
-        
-        # 转换为字典列表
-        return df.to_dict('records')
+        return df
     
     def get_provinces(self) -> List[str]:
         """获取所有省份列表"""
-        df = self.load_data()
-        
+        return list(self._memoize('provinces', self._compute_provinces))
+    
+    @staticmethod
+    def _compute_provinces(df: pd.DataFrame) -> List[str]:
         if df.empty or '省份' not in df.columns:
             return []
         
@@ -119,8 +960,12 @@ class CSVDataManager:
     
     def get_varieties(self, province: str = None) -> List[str]:
         """获取品种列表"""
-        df = self.load_data()
-        
+        return list(self._memoize(
+            ('varieties', province), lambda df: self._compute_varieties(df, province)
+        ))
+    
+    @staticmethod
+    def _compute_varieties(df: pd.DataFrame, province: str = None) -> List[str]:
         if df.empty or '品种名称' not in df.columns:
             return []
         
@@ -133,8 +978,12 @@ class CSVDataManager:
     
     def get_markets(self, province: str = None) -> List[str]:
         """获取市场列表"""
-        df = self.load_data()
-        
+        return list(self._memoize(
+            ('markets', province), lambda df: self._compute_markets(df, province)
+        ))
+    
+    @staticmethod
+    def _compute_markets(df: pd.DataFrame, province: str = None) -> List[str]:
         if df.empty or '市场名称' not in df.columns:
             return []
         
@@ -159,10 +1008,14 @@ class CSVDataManager:
         
         return self.search_data(filters, limit)
     
-    def get_statistics(self) -> Dict:
-        """获取数据统计信息"""
-        df = self.load_data()
-        
+    def get_statistics(self, start_date: str = None, end_date: str = None) -> Dict:
+        """获取数据统计信息，指定日期范围时只统计范围内的月分区"""
+        if start_date or end_date:
+            return self._compute_statistics(self.load_data(start_date, end_date))
+        return dict(self._memoize('statistics', self._compute_statistics))
+    
+    @staticmethod
+    def _compute_statistics(df: pd.DataFrame) -> Dict:
         if df.empty:
             return {
                 "总记录数": 0,
@@ -187,53 +1040,76 @@ class CSVDataManager:
         else:
             stats["最新更新时间"] = None
         
+        if isinstance(stats["最新更新时间"], pd.Timestamp):
+            stats["最新更新时间"] = stats["最新更新时间"].strftime('%Y-%m-%d %H:%M:%S')
+        elif pd.isna(stats["最新更新时间"]):
+            stats["最新更新时间"] = None
+        
         return stats
     
-    def export_data(self, output_file: str, filters: Dict = None, format: str = "csv"):
-        """导出数据"""
-        data = self.search_data(filters, limit=0)  # 不限制数量
-        
-        if not data:
-            logger.warning("没有数据可导出")
-            return
+    @staticmethod
+    def iter_chunks(df: pd.DataFrame, chunk_size: int = 5000):
+        """将DataFrame按块转换为 (列名, 行列表)，空值转换为None"""
+        columns = [str(column) for column in df.columns]
+        for start in range(0, len(df), chunk_size):
+            chunk = df.iloc[start:start + chunk_size]
+            chunk = format_output(chunk)
+            yield columns, list(chunk.itertuples(index=False, name=None))
+    
+    def export_data(self, output_file: str, filters: Dict = None, format: str = "csv",
+                    chunk_size: int = 5000, compression: str = None,
+                    split_by_province: bool = False) -> Dict:
+        """导出数据，支持 csv / json / ndjson / parquet / excel
         
-        df = pd.DataFrame(data)
+        split_by_province 仅对 Excel 有效，每个省份写入单独的工作表。
+        """
+        df = self.filter_data(filters)
         
-        if format.lower() == "csv":
-            df.to_csv(output_file, index=False, encoding='utf-8-sig')
-        elif format.lower() == "json":
-            df.to_json(output_file, orient='records', force_ascii=False, indent=2)
-        elif format.lower() == "excel":
-            df.to_excel(output_file, index=False)
-        else:
-            raise ValueError(f"不支持的格式: {format}")
+        if df.empty:
+            logger.warning("没有数据可导出")
+            return {"output_file": output_file, "format": format, "rows": 0}
         
-        logger.info(f"数据已导出到 {output_file}, 共 {len(data)} 条记录")
+        split_by = '省份' if split_by_province and '省份' in df.columns else None
+        return export_chunks(self.iter_chunks(df, chunk_size), output_file, format,
+                             compression, split_by=split_by, column_types=output_column_types(df))
     
     def cleanup_old_data(self, days: int = 30):
-        """清理旧数据"""
-        df = self.load_data()
-        
-        if df.empty or '交易日期' not in df.columns:
-            logger.warning("没有日期字段，无法清理旧数据")
-            return
+        """清理旧数据：整月早于截止日期的分区直接删除，截止日期所在的分区合并时过滤"""
+        with self.compaction_lock:
+            self._cleanup_old_data(days)
+    
+    def _cleanup_old_data(self, days: int):
+        # 计算截止日期
+        cutoff_date = pd.Timestamp.now() - pd.Timedelta(days=days)
+        cutoff_partition = cutoff_date.strftime(PARTITION_FORMAT)
         
         try:
-            # 转换日期格式
-            df['交易日期'] = pd.to_datetime(df['交易日期'])
+            removed = []
+            for name in self._partition_names():
+                if name == UNDATED_PARTITION or name >= cutoff_partition:
+                    continue
+                with self.lock:
+                    shutil.rmtree(self._partition_dir(name))
+                    self._partitions.pop(name, None)
+                removed.append(name)
             
-            # 计算截止日期
-            cutoff_date = pd.Timestamp.now() - pd.Timedelta(days=days)
+            deleted = {"rows": 0}
             
-            # 过滤数据
-            old_count = len(df)
-            df = df[df['交易日期'] >= cutoff_date]
-            new_count = len(df)
+            def drop_old(frame: pd.DataFrame) -> pd.DataFrame:
+                # 内存中的 DataFrame 是共享的，过滤得到新的对象，不原地修改
+                kept = frame[pd.to_datetime(frame['交易日期']) >= cutoff_date]
+                deleted["rows"] = len(frame) - len(kept)
+                return kept
             
-            # 保存清理后的数据
-            df.to_csv(self.csv_file, index=False, encoding='utf-8-sig')
+            if cutoff_partition in self._partition_names():
+                self._rewrite_partition(cutoff_partition, drop_old)
             
-            logger.info(f"清理完成: 删除了 {old_count - new_count} 条旧数据")
+            logger.info(f"清理完成: 删除了 {len(removed)} 个月分区, "
+                        f"{cutoff_partition} 分区中删除了 {deleted['rows']} 条旧数据")
+            self.publish_in_background()
+            if removed or deleted["rows"]:
+                # API 服务据此使包含已删除数据的缓存响应失效
+                DataGeneration().bump("csv_cleanup")
             
         except Exception as e:
             logger.error(f"清理旧数据失败: {e}")
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+流式数据导出
+按块消费 (列名, 行列表) 迭代器并增量写出 CSV / JSON / NDJSON / Parquet / Excel，
+内存占用只与块大小有关，与结果总量无关
+"""
+
+import bz2
+import csv
+import gzip
+import json
+import logging
+import lzma
+import re
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 文本格式支持的压缩方式
+TEXT_COMPRESSORS = {
+    "gzip": gzip.open,
+    "bz2": bz2.open,
+    "xz": lzma.open,
+}
+
+SUPPORTED_FORMATS = ["csv", "json", "ndjson", "parquet", "excel"]
+
+# Excel 单个工作表的最大行数（含表头）
+EXCEL_MAX_ROWS = 1048576
+EXCEL_SHEET_NAME = "数据"
+
+# 每写出多少块打印一次进度
+PROGRESS_LOG_CHUNKS = 20
+
+Chunk = Tuple[List[str], List[tuple]]
+
+
+def _open_text(output_file: str, compression: Optional[str], encoding: str = "utf-8"):
+    """打开文本输出文件，按需套上压缩流"""
+    if not compression:
+        return open(output_file, "w", encoding=encoding, newline="")
+    if compression not in TEXT_COMPRESSORS:
+        raise ValueError(f"不支持的压缩方式: {compression}")
+    return TEXT_COMPRESSORS[compression](output_file, "wt", encoding=encoding, newline="")
+
+
+class _ProgressReporter:
+    """统计导出行数和速率"""
+    
+    def __init__(self, output_file: str):
+        self.output_file = output_file
+        self.start_time = time.time()
+        self.rows = 0
+        self.chunks = 0
+    
+    def update(self, row_count: int):
+        self.rows += row_count
+        self.chunks += 1
+        if self.chunks % PROGRESS_LOG_CHUNKS == 0:
+            logger.info(f"导出进度 {self.output_file}: {self.rows} 条, {self.rows_per_second:.0f} 条/秒")
+    
+    @property
+    def elapsed(self) -> float:
+        return time.time() - self.start_time
+    
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.elapsed if self.elapsed > 0 else 0.0
+    
+    def result(self, format: str, compression: Optional[str]) -> Dict:
+        return {
+            "output_file": self.output_file,
+            "format": format,
+            "compression": compression,
+            "rows": self.rows,
+            "seconds": round(self.elapsed, 3),
+            "rows_per_second": round(self.rows_per_second, 1),
+        }
+
+
+def _write_csv(chunks: Iterable[Chunk], output_file: str, compression: Optional[str],
+               progress: _ProgressReporter):
+    with _open_text(output_file, compression, encoding="utf-8-sig") as f:
+        writer = csv.writer(f)
+        header_written = False
+        for columns, rows in chunks:
+            if not header_written:
+                writer.writerow(columns)
+                header_written = True
+            writer.writerows(rows)
+            progress.update(len(rows))
+
+
+def _write_ndjson(chunks: Iterable[Chunk], output_file: str, compression: Optional[str],
+                  progress: _ProgressReporter):
+    with _open_text(output_file, compression) as f:
+        for columns, rows in chunks:
+            f.write("".join(
+                json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n" for row in rows
+            ))
+            progress.update(len(rows))
+
+
+def _write_json(chunks: Iterable[Chunk], output_file: str, compression: Optional[str],
+                progress: _ProgressReporter):
+    """写出 JSON 数组，逐块追加元素而不在内存中构建整个数组"""
+    with _open_text(output_file, compression) as f:
+        f.write("[")
+        first = True
+        for columns, rows in chunks:
+            for row in rows:
+                f.write("\n  " if first else ",\n  ")
+                f.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False))
+                first = False
+            progress.update(len(rows))
+        f.write("\n]\n")
+
+
+def _write_parquet(chunks: Iterable[Chunk], output_file: str, compression: Optional[str],
+                   progress: _ProgressReporter, column_types: Optional[Dict[str, str]] = None):
+    """逐块写出 Parquet 行组，需要安装 pyarrow
+    
+    column_types 给出的列（INTEGER / REAL / TEXT）按来源的列类型写出，不受首块取值影响；
+    其余列按首块推断，首块中全为空值的列按字符串处理。
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("导出 Parquet 需要安装 pyarrow: pip install pyarrow")
+    
+    arrow_types = {"INTEGER": pa.int64(), "REAL": pa.float64(), "TEXT": pa.string()}
+    column_types = column_types or {}
+    for column, column_type in column_types.items():
+        if column_type not in arrow_types:
+            raise ValueError(f"不支持的列类型: {column} {column_type}")
+    
+    writer = None
+    schema = None
+    try:
+        for columns, rows in chunks:
+            if not rows:
+                continue
+            
+            if writer is None:
+                fields = []
+                for column, values in zip(columns, zip(*rows)):
+                    if column in column_types:
+                        fields.append(pa.field(column, arrow_types[column_types[column]]))
+                        continue
+                    inferred = pa.array(list(values)).type
+                    fields.append(pa.field(column, pa.string() if pa.types.is_null(inferred) else inferred))
+                schema = pa.schema(fields)
+                writer = pq.ParquetWriter(output_file, schema, compression=compression or "snappy")
+            
+            arrays = [pa.array(list(values), type=field.type) for field, values in zip(schema, zip(*rows))]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            progress.update(len(rows))
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def _sheet_title(name, part: int) -> str:
+    """生成合法的工作表名：去掉非法字符，不超过31个字符，续表加序号"""
+    title = re.sub(r'[\[\]:*?/\\]', '_', str(name or '')) or '未知'
+    suffix = f"_{part}" if part > 1 else ""
+    return title[:31 - len(suffix)] + suffix
+
+
+def _write_excel(chunks: Iterable[Chunk], output_file: str, compression: Optional[str],
+                 progress: _ProgressReporter, split_by: Optional[str] = None):
+    """使用只写模式的工作簿逐行写出 Excel
+    
+    行直接写入工作表的临时文件，内存占用与行数无关；工作表写满后自动续到新表，
+    指定 split_by 时按该列的取值分别写入不同工作表。
+    """
+    if compression:
+        raise ValueError("Excel 格式不支持额外压缩")
+    try:
+        from openpyxl import Workbook
+    except ImportError:
+        raise ImportError("导出 Excel 需要安装 openpyxl: pip install openpyxl")
+    
+    workbook = Workbook(write_only=True)
+    # 分表键 -> [工作表, 已写行数, 序号]
+    sheets = {}
+    
+    for columns, rows in chunks:
+        key_index = columns.index(split_by) if split_by else None
+        for row in rows:
+            key = row[key_index] if key_index is not None else EXCEL_SHEET_NAME
+            state = sheets.get(key)
+            if state is None or state[1] >= EXCEL_MAX_ROWS:
+                part = state[2] + 1 if state else 1
+                worksheet = workbook.create_sheet(_sheet_title(key, part))
+                worksheet.append(columns)
+                state = sheets[key] = [worksheet, 1, part]
+            state[0].append(row)
+            state[1] += 1
+        progress.update(len(rows))
+    
+    if not sheets:
+        workbook.create_sheet(EXCEL_SHEET_NAME)
+    workbook.save(output_file)
+
+
+WRITERS = {
+    "csv": _write_csv,
+    "json": _write_json,
+    "ndjson": _write_ndjson,
+    "parquet": _write_parquet,
+    "excel": _write_excel,
+}
+
+
+def export_chunks(chunks: Iterable[Chunk], output_file: str, format: str = "csv",
+                  compression: Optional[str] = None, split_by: Optional[str] = None,
+                  column_types: Optional[Dict[str, str]] = None) -> Dict:
+    """将分块数据流式写入文件，返回导出行数、耗时和速率
+    
+    split_by 仅对 Excel 有效，按该列的取值拆分工作表；
+    column_types 仅对 Parquet 有效，为列名到 INTEGER / REAL / TEXT 的映射。
+    """
+    format = format.lower()
+    if format not in WRITERS:
+        raise ValueError(f"不支持的格式: {format}")
+    
+    progress = _ProgressReporter(output_file)
+    if format == "excel":
+        _write_excel(chunks, output_file, compression, progress, split_by=split_by)
+    elif format == "parquet":
+        _write_parquet(chunks, output_file, compression, progress, column_types=column_types)
+    else:
+        WRITERS[format](chunks, output_file, compression, progress)
+    
+    result = progress.result(format, compression)
+    logger.info(f"数据已导出到 {output_file}, 共 {result['rows']} 条记录, "
+                f"耗时 {result['seconds']} 秒, {result['rows_per_second']} 条/秒")
+    return result
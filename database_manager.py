@@ -7,20 +7,161 @@
 
 import sqlite3
 import os
+import gzip
+import shutil
 import logging
 import json
-import pandas as pd
+import argparse
+import base64
+import re
+import time
 from datetime import datetime, timedelta
-from typing import List, Dict, Optional, Any
+from typing import List, Dict, Optional, Any, Callable, Iterator, Tuple
 import threading
 from contextlib import contextmanager
+from data_exporter import export_chunks
+from query_profiler import QueryProfiler, DEFAULT_SLOW_QUERY_MS
 
 logger = logging.getLogger(__name__)
 
+# market_prices 视图的列与旧版宽表保持一致，事实表只保存整数外键和数值列
+PRICE_SELECT_SQL = '''
+    SELECT
+        f.id AS id,
+        m.market_id AS market_id,
+        m.market_code AS market_code,
+        m.market_name AS market_name,
+        m.market_type AS market_type,
+        v.variety_id AS variety_id,
+        v.variety_name AS variety_name,
+        f.min_price AS min_price,
+        f.avg_price AS avg_price,
+        f.max_price AS max_price,
+        u.value AS unit,
+        f.trade_date AS trade_date,
+        f.trade_volume AS trade_volume,
+        pp.value AS produce_place,
+        sp.value AS sale_place,
+        p.province AS province,
+        p.province_code AS province_code,
+        m.area_name AS area_name,
+        m.area_code AS area_code,
+        v.variety_type AS variety_type,
+        v.variety_type_id AS variety_type_id,
+        f.crawl_time AS crawl_time,
+        f.created_at AS created_at,
+        f.updated_at AS updated_at
+    FROM {source} f
+    JOIN markets m ON m.id = f.market_key
+    JOIN varieties v ON v.id = f.variety_key
+    LEFT JOIN provinces p ON p.id = f.province_key
+    LEFT JOIN attribute_values u ON u.id = f.unit_key
+    LEFT JOIN attribute_values pp ON pp.id = f.produce_place_key
+    LEFT JOIN attribute_values sp ON sp.id = f.sale_place_key
+'''
+
+# 价格事实表（及各月分区表）的列，按建表顺序排列
+FACT_COLUMNS = [
+    "id", "market_key", "variety_key", "province_key", "unit_key",
+    "produce_place_key", "sale_place_key", "trade_date", "min_price",
+    "avg_price", "max_price", "trade_volume", "crawl_time",
+    "created_at", "updated_at"
+]
+
+# 按月分区，分区表的自增ID从 年月 * 10^9 起步，保证跨分区全局唯一且不超过15位有效数字
+PARTITION_ID_BASE = 10 ** 9
+INVALID_PARTITION_MONTH = "0000-00"
+
+# 最新价格表的写入语句：同一 (市场, 品种) 只接受交易日期不早于当前记录的数据
+LATEST_PRICES_UPSERT_SQL = '''
+    INSERT INTO latest_prices (
+        market_key, variety_key, province_key, unit_key, trade_date,
+        min_price, avg_price, max_price, trade_volume, crawl_time
+    ) {values}
+    ON CONFLICT(market_key, variety_key) DO UPDATE SET
+        province_key = excluded.province_key,
+        unit_key = excluded.unit_key,
+        trade_date = excluded.trade_date,
+        min_price = excluded.min_price,
+        avg_price = excluded.avg_price,
+        max_price = excluded.max_price,
+        trade_volume = excluded.trade_volume,
+        crawl_time = excluded.crawl_time,
+        updated_at = CURRENT_TIMESTAMP
+    WHERE excluded.trade_date >= latest_prices.trade_date
+'''
+
+# 连接缓存和内存映射按主机内存调整：缓存取内存的 1/64（8MB~256MB），mmap 取内存的 1/8（不超过2GB）
+CACHE_MEMORY_RATIO = 64
+CACHE_SIZE_MIN_KIB = 8 * 1024
+CACHE_SIZE_MAX_KIB = 256 * 1024
+MMAP_MEMORY_RATIO = 8
+MMAP_SIZE_MAX = 2 * 1024 ** 3
+DEFAULT_HOST_MEMORY = 1024 ** 3
+
+# 维护任务前后对比执行计划和耗时的代表性查询，{latest} 为最新的月分区表
+MAINTENANCE_QUERIES = [
+    ("province_variety_range", '''
+        SELECT id, avg_price FROM {latest}
+        WHERE province_key = (SELECT MIN(id) FROM provinces)
+          AND variety_key = (SELECT MIN(id) FROM varieties)
+          AND trade_date >= date('now', '-30 days')
+    '''),
+    ("latest_page", '''
+        SELECT id, trade_date, crawl_time FROM {latest}
+        ORDER BY trade_date DESC, crawl_time DESC, id DESC LIMIT 100
+    '''),
+    ("variety_latest_prices", '''
+        SELECT market_key, avg_price FROM latest_prices
+        WHERE variety_key = (SELECT MIN(id) FROM varieties)
+    '''),
+    ("variety_daily_trend", '''
+        SELECT trade_date, SUM(price_sum) / SUM(record_count) FROM daily_price_rollup
+        WHERE variety_key = (SELECT MIN(id) FROM varieties) AND trade_date >= date('now', '-90 days')
+        GROUP BY trade_date
+    '''),
+    ("price_movers", '''
+        SELECT market_id, variety_id, change_rate FROM price_history
+        WHERE price_date = (SELECT MAX(price_date) FROM price_history)
+        ORDER BY change_rate DESC LIMIT 20
+    '''),
+]
+
+
+def host_memory_bytes() -> int:
+    """返回主机物理内存大小，无法探测时按 1GB 估算"""
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, OSError, AttributeError):
+        return DEFAULT_HOST_MEMORY
+
+
+# 批量回填连接的页缓存（主机内存的 1/8，上限 1GB）和 WAL 自动检查点页数
+BULK_CACHE_MEMORY_RATIO = 8
+BULK_CACHE_MAX_KIB = 1024 * 1024
+BULK_WAL_AUTOCHECKPOINT = 100000
+
+# 价格分布区间：(名称, 汇总表列名, 下限, 上限)，按均价统计
+PRICE_RANGES = [
+    ("0-1元", "range_0_1", 0, 1),
+    ("1-5元", "range_1_5", 1, 5),
+    ("5-10元", "range_5_10", 5, 10),
+    ("10-20元", "range_10_20", 10, 20),
+    ("20-50元", "range_20_50", 20, 50),
+    ("50元以上", "range_50_plus", 50, None),
+]
+
 class DatabaseManager:
-    def __init__(self, db_path: str = "market_data.db"):
+    def __init__(self, db_path: str = "market_data.db", profile_queries: bool = False,
+                 slow_query_ms: float = DEFAULT_SLOW_QUERY_MS):
         self.db_path = db_path
         self.lock = threading.Lock()
+        # 开启后所有连接都记录每条语句的耗时，慢查询附带执行计划
+        self.profiler = QueryProfiler(slow_query_ms) if profile_queries else None
+        
+        memory = host_memory_bytes()
+        self.cache_size_kib = max(CACHE_SIZE_MIN_KIB, min(memory // CACHE_MEMORY_RATIO // 1024, CACHE_SIZE_MAX_KIB))
+        self.mmap_size = min(memory // MMAP_MEMORY_RATIO, MMAP_SIZE_MAX)
         self.init_database()
     
     @contextmanager
@@ -28,10 +169,15 @@ class DatabaseManager:
         """获取数据库连接的上下文管理器"""
         conn = None
         try:
-            conn = sqlite3.connect(self.db_path, timeout=30.0)
+            if self.profiler:
+                conn = sqlite3.connect(self.db_path, timeout=30.0, factory=self.profiler.connection_factory)
+            else:
+                conn = sqlite3.connect(self.db_path, timeout=30.0)
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")  # 新库启用增量回收，旧库需执行一次 VACUUM 生效
             conn.execute("PRAGMA journal_mode=WAL")  # 启用WAL模式提高并发性能
             conn.execute("PRAGMA synchronous=NORMAL")  # 平衡性能和安全性
-            conn.execute("PRAGMA cache_size=10000")  # 增加缓存大小
+            conn.execute(f"PRAGMA cache_size=-{self.cache_size_kib}")  # 按主机内存设置页缓存（KiB）
+            conn.execute(f"PRAGMA mmap_size={self.mmap_size}")  # 内存映射读取，减少系统调用和复制
             conn.execute("PRAGMA temp_store=MEMORY")  # 临时表存储在内存中
             yield conn
         except Exception as e:
@@ -47,34 +193,33 @@ class DatabaseManager:
         with self.get_connection() as conn:
             cursor = conn.cursor()
             
-            # 创建市场价格表
+            # 旧版宽表需要先改名，迁移完成后再删除
+            legacy_table = self._rename_legacy_table(cursor)
+            
+            # 创建省份字典表
             cursor.execute('''
-                CREATE TABLE IF NOT EXISTS market_prices (
+                CREATE TABLE IF NOT EXISTS provinces (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    market_id TEXT NOT NULL,
-                    market_code TEXT,
-                    market_name TEXT NOT NULL,
-                    market_type TEXT,
-                    variety_id TEXT,
-                    variety_name TEXT NOT NULL,
-                    min_price REAL DEFAULT 0,
-                    avg_price REAL DEFAULT 0,
-                    max_price REAL DEFAULT 0,
-                    unit TEXT,
-                    trade_date TEXT NOT NULL,
-                    trade_volume REAL DEFAULT 0,
-                    produce_place TEXT,
-                    sale_place TEXT,
-                    province TEXT,
+                    province TEXT UNIQUE NOT NULL,
                     province_code TEXT,
-                    area_name TEXT,
-                    area_code TEXT,
-                    variety_type TEXT,
-                    variety_type_id TEXT,
-                    crawl_time TEXT NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    UNIQUE(market_id, variety_id, trade_date)
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            
+            # 创建属性字典表（计量单位、产地、销售地等低基数文本）
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS attribute_values (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    value TEXT UNIQUE NOT NULL
+                )
+            ''')
+            
+            # 创建价格分区目录表（每个自然月一张事实表）
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS price_partitions (
+                    month TEXT PRIMARY KEY,
+                    table_name TEXT UNIQUE NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                 )
             ''')
             
@@ -105,6 +250,7 @@ class DatabaseManager:
                     market_type TEXT,
                     province TEXT,
                     province_code TEXT,
+                    province_key INTEGER REFERENCES provinces(id),
                     area_name TEXT,
                     area_code TEXT,
                     address TEXT,
@@ -116,6 +262,7 @@ class DatabaseManager:
                     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                 )
             ''')
+            self._ensure_column(cursor, "markets", "province_key", "INTEGER REFERENCES provinces(id)")
             
             # 创建品种信息表
             cursor.execute('''
@@ -150,6 +297,123 @@ class DatabaseManager:
                 )
             ''')
             
+            # 创建日汇总表（按 交易日期+品种+省份 预聚合均价，只统计均价大于0的记录）
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS daily_price_rollup (
+                    trade_date TEXT NOT NULL,
+                    variety_key INTEGER NOT NULL,
+                    province_key INTEGER NOT NULL,
+                    record_count INTEGER DEFAULT 0,
+                    price_sum REAL DEFAULT 0,
+                    min_price REAL,
+                    max_price REAL,
+                    volume_sum REAL DEFAULT 0,
+                    range_0_1 INTEGER DEFAULT 0,
+                    range_1_5 INTEGER DEFAULT 0,
+                    range_5_10 INTEGER DEFAULT 0,
+                    range_10_20 INTEGER DEFAULT 0,
+                    range_20_50 INTEGER DEFAULT 0,
+                    range_50_plus INTEGER DEFAULT 0,
+                    PRIMARY KEY (trade_date, variety_key, province_key)
+                )
+            ''')
+            
+            # 创建最新价格表（每个 市场+品种 只保留最近交易日的一行）
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS latest_prices (
+                    market_key INTEGER NOT NULL REFERENCES markets(id),
+                    variety_key INTEGER NOT NULL REFERENCES varieties(id),
+                    province_key INTEGER REFERENCES provinces(id),
+                    unit_key INTEGER REFERENCES attribute_values(id),
+                    trade_date TEXT NOT NULL,
+                    min_price REAL DEFAULT 0,
+                    avg_price REAL DEFAULT 0,
+                    max_price REAL DEFAULT 0,
+                    trade_volume REAL DEFAULT 0,
+                    crawl_time TEXT,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (market_key, variety_key)
+                )
+            ''')
+            
+            # 创建价格变更日志（版本号单调递增，供下游按版本增量同步）
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS price_changes (
+                    version INTEGER PRIMARY KEY AUTOINCREMENT,
+                    market_key INTEGER NOT NULL,
+                    variety_key INTEGER NOT NULL,
+                    trade_date TEXT NOT NULL,
+                    operation TEXT NOT NULL,
+                    old_min_price REAL,
+                    old_avg_price REAL,
+                    old_max_price REAL,
+                    new_min_price REAL,
+                    new_avg_price REAL,
+                    new_max_price REAL,
+                    changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            
+            # 变更日志状态（truncated_version: 已按保留期截断到的版本）
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS change_log_meta (
+                    name TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL
+                )
+            ''')
+            
+            # 批量回填记录：已导入的文件（按大小和修改时间判断是否变化）和回填批次，用于断点续传
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS backfill_files (
+                    path TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    mtime REAL NOT NULL,
+                    records INTEGER DEFAULT 0,
+                    loaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS backfill_runs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    finished_at TIMESTAMP,
+                    files INTEGER DEFAULT 0,
+                    records INTEGER DEFAULT 0
+                )
+            ''')
+            
+            # 迁移旧版宽表数据
+            if legacy_table:
+                self._create_fact_table(cursor, "price_facts")
+                self._migrate_legacy_table(cursor, legacy_table)
+            
+            # 将未分区的事实表拆分为按月分区
+            cursor.execute("SELECT type FROM sqlite_master WHERE name = 'price_facts'")
+            row = cursor.fetchone()
+            if row and row[0] == 'table':
+                self._partition_fact_table(cursor)
+            
+            # 创建兼容视图
+            self._create_views(cursor)
+            
+            # 已有分区补齐新增的索引和变更日志触发器（迁移写入的数据不记入变更日志），
+            # 中断的批量回填删掉的索引和触发器也在这里恢复
+            for table in self._partition_tables(cursor):
+                self._create_partition_indexes(cursor, table)
+                self._create_change_triggers(cursor, table)
+            
+            if legacy_table:
+                self._rebuild_price_history(cursor)
+            
+            # 已有数据但汇总表为空时全量重建
+            cursor.execute("SELECT 1 FROM daily_price_rollup LIMIT 1")
+            if not cursor.fetchone() and self._partition_tables(cursor):
+                self._rebuild_daily_rollup(cursor)
+            
+            cursor.execute("SELECT 1 FROM latest_prices LIMIT 1")
+            if not cursor.fetchone() and self._partition_tables(cursor):
+                self._rebuild_latest_prices(cursor)
+            
             # 创建索引
             self._create_indexes(cursor)
             
@@ -159,24 +423,338 @@ class DatabaseManager:
             conn.commit()
             logger.info("数据库初始化完成")
     
+    def _ensure_column(self, cursor, table: str, column: str, definition: str):
+        """为已存在的表补充缺失的列"""
+        cursor.execute(f"PRAGMA table_info({table})")
+        if column not in [row[1] for row in cursor.fetchall()]:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+    
+    def _create_fact_table(self, cursor, table: str):
+        """创建价格事实表（只保存整数外键和数值列）"""
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                market_key INTEGER NOT NULL REFERENCES markets(id),
+                variety_key INTEGER NOT NULL REFERENCES varieties(id),
+                province_key INTEGER REFERENCES provinces(id),
+                unit_key INTEGER REFERENCES attribute_values(id),
+                produce_place_key INTEGER REFERENCES attribute_values(id),
+                sale_place_key INTEGER REFERENCES attribute_values(id),
+                trade_date TEXT NOT NULL,
+                min_price REAL DEFAULT 0,
+                avg_price REAL DEFAULT 0,
+                max_price REAL DEFAULT 0,
+                trade_volume REAL DEFAULT 0,
+                crawl_time TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE(market_key, variety_key, trade_date)
+            )
+        ''')
+    
+    @staticmethod
+    def _partition_month(trade_date: str) -> str:
+        """根据交易日期计算所属的月分区，无法识别的日期归入单独分区"""
+        trade_date = str(trade_date or '')
+        if re.match(r'^\d{4}-\d{2}', trade_date):
+            return trade_date[:7]
+        return INVALID_PARTITION_MONTH
+    
+    def _ensure_partition(self, cursor, month: str, track_changes: bool = True):
+        """确保指定月份的分区表存在，返回 (表名, 是否新建)"""
+        cursor.execute("SELECT table_name FROM price_partitions WHERE month = ?", (month,))
+        row = cursor.fetchone()
+        if row:
+            return row[0], False
+        
+        table = "price_facts_" + month.replace('-', '')
+        self._create_fact_table(cursor, table)
+        self._create_partition_indexes(cursor, table)
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS update_{table}_timestamp
+            AFTER UPDATE ON {table}
+            BEGIN
+                UPDATE {table} SET updated_at = CURRENT_TIMESTAMP WHERE id = NEW.id;
+            END
+        ''')
+        
+        # 设置自增起点，使各分区的ID互不重叠
+        cursor.execute(
+            "INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)",
+            (table, int(month.replace('-', '')) * PARTITION_ID_BASE)
+        )
+        cursor.execute(
+            "INSERT INTO price_partitions (month, table_name) VALUES (?, ?)", (month, table)
+        )
+        if track_changes:
+            self._create_change_triggers(cursor, table)
+        logger.info(f"创建价格分区: {table}")
+        return table, True
+    
+    def _create_change_triggers(self, cursor, table: str):
+        """在分区表上创建变更日志触发器，只有价格实际变化的更新才会记录"""
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS log_{table}_insert
+            AFTER INSERT ON {table}
+            BEGIN
+                INSERT INTO price_changes (
+                    market_key, variety_key, trade_date, operation,
+                    new_min_price, new_avg_price, new_max_price
+                ) VALUES (
+                    NEW.market_key, NEW.variety_key, NEW.trade_date, 'insert',
+                    NEW.min_price, NEW.avg_price, NEW.max_price
+                );
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS log_{table}_update
+            AFTER UPDATE OF min_price, avg_price, max_price ON {table}
+            WHEN OLD.min_price IS NOT NEW.min_price
+              OR OLD.avg_price IS NOT NEW.avg_price
+              OR OLD.max_price IS NOT NEW.max_price
+            BEGIN
+                INSERT INTO price_changes (
+                    market_key, variety_key, trade_date, operation,
+                    old_min_price, old_avg_price, old_max_price,
+                    new_min_price, new_avg_price, new_max_price
+                ) VALUES (
+                    NEW.market_key, NEW.variety_key, NEW.trade_date, 'update',
+                    OLD.min_price, OLD.avg_price, OLD.max_price,
+                    NEW.min_price, NEW.avg_price, NEW.max_price
+                );
+            END
+        ''')
+    
+    def _partition_tables(self, cursor, start_date: str = None, end_date: str = None) -> List[str]:
+        """按月份顺序返回与日期范围相交的分区表"""
+        conditions = []
+        params = []
+        
+        if start_date:
+            conditions.append("month >= ?")
+            params.append(self._partition_month(start_date))
+        
+        if end_date:
+            conditions.append("month <= ?")
+            params.append(self._partition_month(end_date))
+        
+        where_clause = " AND ".join(conditions) if conditions else "1=1"
+        cursor.execute(
+            f"SELECT table_name FROM price_partitions WHERE {where_clause} ORDER BY month", params
+        )
+        return [row[0] for row in cursor.fetchall()]
+    
+    def _facts_select(self, tables: List[str]) -> str:
+        """生成合并多个分区表的 SELECT 语句"""
+        if not tables:
+            return "SELECT " + ", ".join(f"NULL AS {column}" for column in FACT_COLUMNS) + " LIMIT 0"
+        return " UNION ALL ".join(f"SELECT * FROM {table}" for table in tables)
+    
+    def _facts_source(self, cursor, start_date: str = None, end_date: str = None) -> str:
+        """生成只包含相关分区的 FROM 子句数据源"""
+        tables = self._partition_tables(cursor, start_date, end_date)
+        if len(tables) == 1:
+            return tables[0]
+        return f"({self._facts_select(tables)})"
+    
+    def _partition_fact_table(self, cursor):
+        """将未分区的 price_facts 表按交易月份拆分到各分区表"""
+        cursor.execute("DROP TRIGGER IF EXISTS update_price_facts_timestamp")
+        cursor.execute("SELECT DISTINCT substr(trade_date, 1, 7) FROM price_facts")
+        raw_months = [row[0] for row in cursor.fetchall()]
+        
+        moved = 0
+        for raw_month in raw_months:
+            table, _ = self._ensure_partition(cursor, self._partition_month(raw_month), track_changes=False)
+            cursor.execute(
+                f"INSERT INTO {table} SELECT * FROM price_facts WHERE substr(trade_date, 1, 7) = ?",
+                (raw_month,)
+            )
+            moved += cursor.rowcount
+        
+        cursor.execute("DROP TABLE price_facts")
+        logger.info(f"事实表分区完成: {moved} 条价格数据, {len(raw_months)} 个月份")
+    
+    def _rename_legacy_table(self, cursor) -> Optional[str]:
+        """检测旧版 market_prices 宽表，改名后等待迁移"""
+        cursor.execute("SELECT type FROM sqlite_master WHERE name = 'market_prices'")
+        row = cursor.fetchone()
+        if not row or row[0] != 'table':
+            return None
+        
+        logger.info("检测到旧版 market_prices 宽表，开始迁移到字典编码结构")
+        cursor.execute("DROP TRIGGER IF EXISTS update_market_prices_timestamp")
+        cursor.execute("ALTER TABLE market_prices RENAME TO market_prices_legacy")
+        return "market_prices_legacy"
+    
+    def _migrate_legacy_table(self, cursor, legacy_table: str):
+        """将旧版宽表的数据以集合操作方式迁移到事实表和字典表"""
+        cursor.execute(f"PRAGMA table_info({legacy_table})")
+        legacy_columns = [row[1] for row in cursor.fetchall()]
+        updated_at = "l.updated_at" if "updated_at" in legacy_columns else "l.created_at"
+        
+        cursor.execute(f'''
+            INSERT OR IGNORE INTO provinces (province, province_code)
+            SELECT COALESCE(province, ''), MAX(COALESCE(province_code, ''))
+            FROM {legacy_table} GROUP BY COALESCE(province, '')
+        ''')
+        
+        cursor.execute(f'''
+            INSERT OR IGNORE INTO markets (
+                market_id, market_code, market_name, market_type,
+                province, province_code, area_name, area_code
+            )
+            SELECT market_id, COALESCE(market_code, ''), market_name, COALESCE(market_type, ''),
+                   COALESCE(province, ''), COALESCE(province_code, ''),
+                   COALESCE(area_name, ''), COALESCE(area_code, '')
+            FROM {legacy_table} GROUP BY market_id
+        ''')
+        
+        cursor.execute(f'''
+            INSERT OR IGNORE INTO varieties (
+                variety_id, variety_name, variety_type, variety_type_id, unit
+            )
+            SELECT COALESCE(variety_id, ''), variety_name, COALESCE(variety_type, ''),
+                   COALESCE(variety_type_id, ''), COALESCE(unit, '')
+            FROM {legacy_table} GROUP BY COALESCE(variety_id, '')
+        ''')
+        
+        cursor.execute('''
+            UPDATE markets SET province_key = (
+                SELECT id FROM provinces WHERE provinces.province = COALESCE(markets.province, '')
+            ) WHERE province_key IS NULL
+        ''')
+        
+        cursor.execute(f'''
+            INSERT OR IGNORE INTO attribute_values (value)
+            SELECT COALESCE(unit, '') FROM {legacy_table}
+            UNION SELECT COALESCE(produce_place, '') FROM {legacy_table}
+            UNION SELECT COALESCE(sale_place, '') FROM {legacy_table}
+        ''')
+        
+        cursor.execute(f'''
+            INSERT OR REPLACE INTO price_facts (
+                market_key, variety_key, province_key, unit_key,
+                produce_place_key, sale_place_key, trade_date,
+                min_price, avg_price, max_price, trade_volume,
+                crawl_time, created_at, updated_at
+            )
+            SELECT m.id, v.id, p.id, u.id, pp.id, sp.id, l.trade_date,
+                   l.min_price, l.avg_price, l.max_price, l.trade_volume,
+                   l.crawl_time, l.created_at, {updated_at}
+            FROM {legacy_table} l
+            JOIN markets m ON m.market_id = l.market_id
+            JOIN varieties v ON v.variety_id = COALESCE(l.variety_id, '')
+            LEFT JOIN provinces p ON p.province = COALESCE(l.province, '')
+            LEFT JOIN attribute_values u ON u.value = COALESCE(l.unit, '')
+            LEFT JOIN attribute_values pp ON pp.value = COALESCE(l.produce_place, '')
+            LEFT JOIN attribute_values sp ON sp.value = COALESCE(l.sale_place, '')
+            ORDER BY l.id
+        ''')
+        migrated = cursor.rowcount
+        
+        cursor.execute(f"DROP TABLE {legacy_table}")
+        logger.info(f"旧版宽表迁移完成: {migrated} 条价格数据")
+    
+    def _rebuild_price_history(self, cursor):
+        """基于全部事实数据重建价格历史表"""
+        cursor.execute("DELETE FROM price_history")
+        cursor.execute('''
+            INSERT INTO price_history (
+                market_id, variety_id, price_date, min_price, avg_price, max_price,
+                price_change, change_rate
+            )
+            SELECT m.market_id, v.variety_id, s.trade_date,
+                   s.min_price, s.avg_price, s.max_price,
+                   COALESCE(s.avg_price - s.prev_price, 0),
+                   CASE WHEN s.prev_price > 0
+                        THEN ROUND((s.avg_price - s.prev_price) / s.prev_price * 100, 2)
+                        ELSE 0 END
+            FROM (
+                SELECT market_key, variety_key, trade_date, min_price, avg_price, max_price,
+                       LAG(avg_price) OVER (
+                           PARTITION BY market_key, variety_key ORDER BY trade_date
+                       ) AS prev_price
+                FROM price_facts
+            ) s
+            JOIN markets m ON m.id = s.market_key
+            JOIN varieties v ON v.id = s.variety_key
+        ''')
+    
+    def migrate(self, vacuum: bool = True) -> Dict:
+        """迁移工具：转换旧版数据库并回收空间，返回迁移前后的文件大小"""
+        size_before = os.path.getsize(self.db_path) if os.path.exists(self.db_path) else 0
+        
+        # 初始化时会自动迁移旧版宽表
+        self.init_database()
+        
+        if vacuum:
+            # VACUUM 同时将旧库转换为 auto_vacuum=INCREMENTAL
+            with self.lock:
+                with self.get_connection() as conn:
+                    conn.execute("VACUUM")
+        
+        size_after = os.path.getsize(self.db_path)
+        logger.info(f"数据库迁移完成: {size_before} -> {size_after} 字节")
+        
+        return {
+            "db_path": self.db_path,
+            "size_before": size_before,
+            "size_after": size_after
+        }
+    
+    def _create_views(self, cursor):
+        """创建合并全部分区的 price_facts 视图和与旧版宽表结构一致的兼容视图"""
+        cursor.execute("DROP VIEW IF EXISTS market_prices")
+        cursor.execute("DROP VIEW IF EXISTS price_facts")
+        cursor.execute(
+            "CREATE VIEW price_facts AS " + self._facts_select(self._partition_tables(cursor))
+        )
+        cursor.execute(
+            "CREATE VIEW market_prices AS " + PRICE_SELECT_SQL.format(source="price_facts")
+        )
+    
+    def _create_partition_indexes(self, cursor, table: str):
+        """创建分区表索引"""
+        indexes = [
+            # 覆盖分页排序和常用过滤列，分页查询只需回表读取当前页
+            f"CREATE INDEX IF NOT EXISTS idx_{table}_seek ON {table}"
+            f"(trade_date, crawl_time, id, province_key, variety_key, market_key, avg_price)",
+            f"DROP INDEX IF EXISTS idx_{table}_trade_date",
+            f"CREATE INDEX IF NOT EXISTS idx_{table}_crawl_time ON {table}(crawl_time)",
+            f"CREATE INDEX IF NOT EXISTS idx_{table}_avg_price ON {table}(avg_price)",
+            f"CREATE INDEX IF NOT EXISTS idx_{table}_variety ON {table}(variety_key, trade_date)",
+            f"CREATE INDEX IF NOT EXISTS idx_{table}_composite ON {table}(province_key, variety_key, trade_date)",
+        ]
+        
+        for index_sql in indexes:
+            try:
+                cursor.execute(index_sql)
+            except Exception as e:
+                logger.warning(f"创建索引失败: {index_sql}, 错误: {str(e)}")
+    
     def _create_indexes(self, cursor):
         """创建数据库索引"""
         indexes = [
-            # 市场价格表索引
-            "CREATE INDEX IF NOT EXISTS idx_market_prices_province ON market_prices(province)",
-            "CREATE INDEX IF NOT EXISTS idx_market_prices_market_name ON market_prices(market_name)",
-            "CREATE INDEX IF NOT EXISTS idx_market_prices_variety_name ON market_prices(variety_name)",
-            "CREATE INDEX IF NOT EXISTS idx_market_prices_trade_date ON market_prices(trade_date)",
-            "CREATE INDEX IF NOT EXISTS idx_market_prices_crawl_time ON market_prices(crawl_time)",
-            "CREATE INDEX IF NOT EXISTS idx_market_prices_avg_price ON market_prices(avg_price)",
-            "CREATE INDEX IF NOT EXISTS idx_market_prices_composite ON market_prices(province, variety_name, trade_date)",
-            
             # 价格历史表索引
             "CREATE INDEX IF NOT EXISTS idx_price_history_market_variety ON price_history(market_id, variety_id)",
             "CREATE INDEX IF NOT EXISTS idx_price_history_date ON price_history(price_date)",
+            "CREATE INDEX IF NOT EXISTS idx_price_history_movers ON price_history(price_date, change_rate)",
+            
+            # 日汇总表索引
+            "CREATE INDEX IF NOT EXISTS idx_daily_rollup_variety ON daily_price_rollup(variety_key, trade_date)",
+            
+            # 最新价格表索引（按市场查询直接使用主键）
+            "CREATE INDEX IF NOT EXISTS idx_latest_prices_variety ON latest_prices(variety_key, province_key)",
+            "CREATE INDEX IF NOT EXISTS idx_latest_prices_province ON latest_prices(province_key, variety_key)",
+            
+            # 变更日志索引（按键压缩时查找更新的版本）
+            "CREATE INDEX IF NOT EXISTS idx_price_changes_key ON price_changes(market_key, variety_key, trade_date, version)",
+            "CREATE INDEX IF NOT EXISTS idx_price_changes_time ON price_changes(changed_at)",
             
             # 市场信息表索引
             "CREATE INDEX IF NOT EXISTS idx_markets_province ON markets(province)",
+            "CREATE INDEX IF NOT EXISTS idx_markets_name ON markets(market_name)",
             "CREATE INDEX IF NOT EXISTS idx_markets_location ON markets(latitude, longitude)",
             
             # 品种信息表索引
@@ -192,15 +770,7 @@ class DatabaseManager:
     
     def _create_triggers(self, cursor):
         """创建数据库触发器"""
-        # 更新时间触发器
-        cursor.execute('''
-            CREATE TRIGGER IF NOT EXISTS update_market_prices_timestamp 
-            AFTER UPDATE ON market_prices
-            BEGIN
-                UPDATE market_prices SET updated_at = CURRENT_TIMESTAMP WHERE id = NEW.id;
-            END
-        ''')
-        
+        # 更新时间触发器（分区表的触发器在创建分区时建立）
         cursor.execute('''
             CREATE TRIGGER IF NOT EXISTS update_markets_timestamp 
             AFTER UPDATE ON markets
@@ -209,6 +779,94 @@ class DatabaseManager:
             END
         ''')
     
+    def _province_key(self, cursor, cache: Dict, data: Dict) -> int:
+        """获取省份的整数主键，不存在时写入字典表"""
+        province = data.get('省份') or ''
+        if province not in cache:
+            cursor.execute('''
+                INSERT INTO provinces (province, province_code) VALUES (?, ?)
+                ON CONFLICT(province) DO UPDATE SET province_code = excluded.province_code
+                WHERE excluded.province_code != '' AND provinces.province_code IS NOT excluded.province_code
+            ''', (province, data.get('省份代码') or ''))
+            cursor.execute("SELECT id FROM provinces WHERE province = ?", (province,))
+            cache[province] = cursor.fetchone()[0]
+        return cache[province]
+    
+    def _market_key(self, cursor, cache: Dict, data: Dict, province_key: int) -> int:
+        """获取市场的整数主键，同时更新市场信息表"""
+        market_id = data.get('市场ID') or ''
+        if market_id not in cache:
+            values = (
+                market_id,
+                data.get('市场代码') or '',
+                data.get('市场名称') or '',
+                data.get('市场类型') or '',
+                data.get('省份') or '',
+                data.get('省份代码') or '',
+                province_key,
+                data.get('地区名称') or '',
+                data.get('地区代码') or ''
+            )
+            cursor.execute('''
+                INSERT INTO markets (
+                    market_id, market_code, market_name, market_type,
+                    province, province_code, province_key, area_name, area_code
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(market_id) DO UPDATE SET
+                    market_code = excluded.market_code,
+                    market_name = excluded.market_name,
+                    market_type = excluded.market_type,
+                    province = excluded.province,
+                    province_code = excluded.province_code,
+                    province_key = excluded.province_key,
+                    area_name = excluded.area_name,
+                    area_code = excluded.area_code
+                WHERE markets.market_code IS NOT excluded.market_code
+                   OR markets.market_name IS NOT excluded.market_name
+                   OR markets.market_type IS NOT excluded.market_type
+                   OR markets.province_key IS NOT excluded.province_key
+                   OR markets.area_name IS NOT excluded.area_name
+                   OR markets.area_code IS NOT excluded.area_code
+            ''', values)
+            cursor.execute("SELECT id FROM markets WHERE market_id = ?", (market_id,))
+            cache[market_id] = cursor.fetchone()[0]
+        return cache[market_id]
+    
+    def _variety_key(self, cursor, cache: Dict, data: Dict) -> int:
+        """获取品种的整数主键，同时更新品种信息表"""
+        variety_id = data.get('品种ID') or ''
+        if variety_id not in cache:
+            cursor.execute('''
+                INSERT INTO varieties (
+                    variety_id, variety_name, variety_type, variety_type_id, unit
+                ) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(variety_id) DO UPDATE SET
+                    variety_name = excluded.variety_name,
+                    variety_type = excluded.variety_type,
+                    variety_type_id = excluded.variety_type_id
+                WHERE varieties.variety_name IS NOT excluded.variety_name
+                   OR varieties.variety_type IS NOT excluded.variety_type
+                   OR varieties.variety_type_id IS NOT excluded.variety_type_id
+            ''', (
+                variety_id,
+                data.get('品种名称') or '',
+                data.get('品种类型') or '',
+                data.get('品种类型ID') or '',
+                data.get('计量单位') or ''
+            ))
+            cursor.execute("SELECT id FROM varieties WHERE variety_id = ?", (variety_id,))
+            cache[variety_id] = cursor.fetchone()[0]
+        return cache[variety_id]
+    
+    def _attribute_key(self, cursor, cache: Dict, value: Any) -> int:
+        """获取低基数文本属性在字典表中的整数主键"""
+        value = str(value) if value else ''
+        if value not in cache:
+            cursor.execute("INSERT OR IGNORE INTO attribute_values (value) VALUES (?)", (value,))
+            cursor.execute("SELECT id FROM attribute_values WHERE value = ?", (value,))
+            cache[value] = cursor.fetchone()[0]
+        return cache[value]
+    
     def insert_market_data(self, data_list: List[Dict]) -> int:
         """批量插入市场数据"""
         if not data_list:
@@ -220,73 +878,32 @@ class DatabaseManager:
                 cursor = conn.cursor()
                 
                 try:
-                    for data in data_list:
-                        # 插入或更新市场价格数据
-                        cursor.execute('''
-                            INSERT OR REPLACE INTO market_prices (
-                                market_id, market_code, market_name, market_type,
-                                variety_id, variety_name, min_price, avg_price, max_price,
-                                unit, trade_date, trade_volume, produce_place, sale_place,
-                                province, province_code, area_name, area_code,
-                                variety_type, variety_type_id, crawl_time
-                            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                        ''', (
-                            data.get('市场ID', ''),
-                            data.get('市场代码', ''),
-                            data.get('市场名称', ''),
-                            data.get('市场类型', ''),
-                            data.get('品种ID', ''),
-                            data.get('品种名称', ''),
-                            float(data.get('最低价', 0) or 0),
-                            float(data.get('平均价', 0) or 0),
-                            float(data.get('最高价', 0) or 0),
-                            data.get('计量单位', ''),
-                            data.get('交易日期', ''),
-                            float(data.get('交易量', 0) or 0),
-                            data.get('产地', ''),
-                            data.get('销售地', ''),
-                            data.get('省份', ''),
-                            data.get('省份代码', ''),
-                            data.get('地区名称', ''),
-                            data.get('地区代码', ''),
-                            data.get('品种类型', ''),
-                            data.get('品种类型ID', ''),
-                            data.get('爬取时间', '')
-                        ))
-                        
-                        # 同时更新市场信息表
-                        if data.get('市场ID') and data.get('市场名称'):
-                            cursor.execute('''
-                                INSERT OR IGNORE INTO markets (
-                                    market_id, market_code, market_name, market_type,
-                                    province, province_code, area_name, area_code
-                                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                            ''', (
-                                data.get('市场ID', ''),
-                                data.get('市场代码', ''),
-                                data.get('市场名称', ''),
-                                data.get('市场类型', ''),
-                                data.get('省份', ''),
-                                data.get('省份代码', ''),
-                                data.get('地区名称', ''),
-                                data.get('地区代码', '')
-                            ))
-                        
-                        # 同时更新品种信息表
-                        if data.get('品种ID') and data.get('品种名称'):
-                            cursor.execute('''
-                                INSERT OR IGNORE INTO varieties (
-                                    variety_id, variety_name, variety_type, variety_type_id, unit
-                                ) VALUES (?, ?, ?, ?, ?)
-                            ''', (
-                                data.get('品种ID', ''),
-                                data.get('品种名称', ''),
-                                data.get('品种类型', ''),
-                                data.get('品种类型ID', ''),
-                                data.get('计量单位', '')
-                            ))
+                    rows, partition_rows = self._encode_rows(cursor, data_list)
+                    inserted_count = len(rows)
+                    
+                    # 按交易月份写入对应分区
+                    new_partition = False
+                    for month, month_rows in partition_rows.items():
+                        table, created = self._ensure_partition(cursor, month)
+                        new_partition = new_partition or created
                         
-                        inserted_count += 1
+                        # 插入或更新价格事实数据
+                        cursor.executemany(self._fact_upsert_sql(table), month_rows)
+                    
+                    if new_partition:
+                        self._create_views(cursor)
+                    
+                    # 刷新最新价格，较旧的补录数据不会覆盖已有的最新记录
+                    cursor.executemany(
+                        LATEST_PRICES_UPSERT_SQL.format(values="VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"),
+                        [(row[0], row[1], row[2], row[3], row[6], row[7], row[8], row[9], row[10], row[11])
+                         for row in rows]
+                    )
+                    
+                    # 在同一事务中计算本批次的日环比变化并刷新日汇总
+                    self._stage_batch(cursor, rows)
+                    self._update_price_history(cursor)
+                    self._update_daily_rollup(cursor)
                     
                     conn.commit()
                     logger.info(f"成功插入 {inserted_count} 条数据")
@@ -302,28 +919,252 @@ class DatabaseManager:
         
         return inserted_count
     
+    def _encode_rows(self, cursor, data_list: List[Dict]):
+        """将爬虫记录编码为事实表行，返回 (全部行, 按月分区分组的行)"""
+        # 批次内缓存字典表主键，避免重复查询
+        province_cache, market_cache, variety_cache, attribute_cache = {}, {}, {}, {}
+        rows = []
+        partition_rows = {}
+        
+        for data in data_list:
+            province_key = self._province_key(cursor, province_cache, data)
+            row = (
+                self._market_key(cursor, market_cache, data, province_key),
+                self._variety_key(cursor, variety_cache, data),
+                province_key,
+                self._attribute_key(cursor, attribute_cache, data.get('计量单位')),
+                self._attribute_key(cursor, attribute_cache, data.get('产地')),
+                self._attribute_key(cursor, attribute_cache, data.get('销售地')),
+                data.get('交易日期', ''),
+                float(data.get('最低价', 0) or 0),
+                float(data.get('平均价', 0) or 0),
+                float(data.get('最高价', 0) or 0),
+                float(data.get('交易量', 0) or 0),
+                data.get('爬取时间', '')
+            )
+            rows.append(row)
+            partition_rows.setdefault(self._partition_month(row[6]), []).append(row)
+        
+        return rows, partition_rows
+    
+    @staticmethod
+    def _fact_upsert_sql(table: str, newer_only: bool = False) -> str:
+        """分区表的插入或更新语句，newer_only 时只用爬取时间不早于现有记录的数据覆盖"""
+        return f'''
+            INSERT INTO {table} (
+                market_key, variety_key, province_key, unit_key,
+                produce_place_key, sale_place_key, trade_date,
+                min_price, avg_price, max_price, trade_volume, crawl_time
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(market_key, variety_key, trade_date) DO UPDATE SET
+                province_key = excluded.province_key,
+                unit_key = excluded.unit_key,
+                produce_place_key = excluded.produce_place_key,
+                sale_place_key = excluded.sale_place_key,
+                min_price = excluded.min_price,
+                avg_price = excluded.avg_price,
+                max_price = excluded.max_price,
+                trade_volume = excluded.trade_volume,
+                crawl_time = excluded.crawl_time
+            {"WHERE excluded.crawl_time >= " + table + ".crawl_time" if newer_only else ""}
+        '''
+    
+    def _stage_batch(self, cursor, rows: List[tuple]):
+        """将本批次涉及的 (市场, 品种, 交易日期) 写入临时表，供后续集合操作使用"""
+        cursor.execute('''
+            CREATE TEMP TABLE IF NOT EXISTS ingest_batch (
+                market_key INTEGER NOT NULL,
+                variety_key INTEGER NOT NULL,
+                trade_date TEXT NOT NULL,
+                PRIMARY KEY (market_key, variety_key, trade_date)
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute("DELETE FROM temp.ingest_batch")
+        cursor.executemany(
+            "INSERT OR IGNORE INTO temp.ingest_batch (market_key, variety_key, trade_date) VALUES (?, ?, ?)",
+            [(row[0], row[1], row[6]) for row in rows]
+        )
+    
+    def _update_price_history(self, cursor):
+        """根据本批次数据计算与同一序列上一交易日相比的价格变化
+        
+        相邻交易日可能落在不同月份分区，逐个分区按唯一索引查找后合并，
+        避免在 UNION ALL 视图上做关联子查询和连接。
+        """
+        tables = self._partition_tables(cursor)
+        cursor.execute('''
+            CREATE TEMP TABLE IF NOT EXISTS history_batch (
+                market_key INTEGER NOT NULL,
+                variety_key INTEGER NOT NULL,
+                trade_date TEXT NOT NULL,
+                next_date TEXT,
+                prev_date TEXT,
+                prev_avg REAL,
+                PRIMARY KEY (market_key, variety_key, trade_date)
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute("DELETE FROM temp.history_batch")
+        cursor.execute('''
+            INSERT INTO temp.history_batch (market_key, variety_key, trade_date)
+            SELECT market_key, variety_key, trade_date FROM temp.ingest_batch
+        ''')
+        
+        # 补录较早日期时，后一个交易日的变化也需要重新计算；从新到旧遍历分区，较早分区的结果覆盖较晚分区
+        for table in reversed(tables):
+            cursor.execute(f'''
+                UPDATE temp.history_batch SET next_date = COALESCE((
+                    SELECT MIN(f.trade_date) FROM {table} f
+                    WHERE f.market_key = history_batch.market_key
+                      AND f.variety_key = history_batch.variety_key
+                      AND f.trade_date > history_batch.trade_date
+                ), next_date)
+            ''')
+        cursor.execute('''
+            INSERT OR IGNORE INTO temp.history_batch (market_key, variety_key, trade_date)
+            SELECT market_key, variety_key, next_date FROM temp.history_batch
+            WHERE next_date IS NOT NULL
+        ''')
+        
+        # 上一交易日：从旧到新遍历分区，较晚分区的结果覆盖较早分区
+        for table in tables:
+            cursor.execute(f'''
+                UPDATE temp.history_batch SET prev_date = COALESCE((
+                    SELECT MAX(f.trade_date) FROM {table} f
+                    WHERE f.market_key = history_batch.market_key
+                      AND f.variety_key = history_batch.variety_key
+                      AND f.trade_date < history_batch.trade_date
+                ), prev_date)
+            ''')
+        for table in tables:
+            cursor.execute(f'''
+                UPDATE temp.history_batch SET prev_avg = (
+                    SELECT f.avg_price FROM {table} f
+                    WHERE f.market_key = history_batch.market_key
+                      AND f.variety_key = history_batch.variety_key
+                      AND f.trade_date = history_batch.prev_date
+                )
+                WHERE prev_date IS NOT NULL AND prev_avg IS NULL
+            ''')
+        
+        for table in tables:
+            cursor.execute(f'''
+                INSERT INTO price_history (
+                    market_id, variety_id, price_date, min_price, avg_price, max_price,
+                    price_change, change_rate
+                )
+                SELECT m.market_id, v.variety_id, cur.trade_date,
+                       cur.min_price, cur.avg_price, cur.max_price,
+                       COALESCE(cur.avg_price - b.prev_avg, 0),
+                       CASE WHEN b.prev_avg > 0
+                            THEN ROUND((cur.avg_price - b.prev_avg) / b.prev_avg * 100, 2)
+                            ELSE 0 END
+                FROM temp.history_batch b
+                JOIN {table} cur ON cur.market_key = b.market_key
+                    AND cur.variety_key = b.variety_key AND cur.trade_date = b.trade_date
+                JOIN markets m ON m.id = b.market_key
+                JOIN varieties v ON v.id = b.variety_key
+                WHERE true
+                ON CONFLICT(market_id, variety_id, price_date) DO UPDATE SET
+                    min_price = excluded.min_price,
+                    avg_price = excluded.avg_price,
+                    max_price = excluded.max_price,
+                    price_change = excluded.price_change,
+                    change_rate = excluded.change_rate
+            ''')
+    
+    def _rollup_select(self, table: str, condition: str) -> str:
+        """生成从分区表聚合日汇总行的 SELECT 语句"""
+        range_sums = "".join(
+            f",\n                SUM(f.avg_price >= {low}"
+            + (f" AND f.avg_price < {high})" if high is not None else ")")
+            for _, _, low, high in PRICE_RANGES
+        )
+        return f'''
+            SELECT f.trade_date, f.variety_key, COALESCE(f.province_key, 0),
+                COUNT(*), SUM(f.avg_price), MIN(f.avg_price), MAX(f.avg_price),
+                SUM(f.trade_volume){range_sums}
+            FROM {table} f
+            WHERE f.avg_price > 0 AND {condition}
+            GROUP BY f.trade_date, f.variety_key, COALESCE(f.province_key, 0)
+        '''
+    
+    def _update_daily_rollup(self, cursor):
+        """重新聚合本批次涉及的 (交易日期, 品种) 在日汇总表中的各省份行
+        
+        同一市场同一品种同一天在事实表中只有一行，更新时交易日期和品种不变，
+        因此按 (交易日期, 品种) 整组重算即可覆盖省份变化的情况。
+        """
+        cursor.execute('''
+            DELETE FROM daily_price_rollup
+            WHERE (trade_date, variety_key) IN (
+                SELECT DISTINCT trade_date, variety_key FROM temp.ingest_batch
+            )
+        ''')
+        
+        cursor.execute("SELECT MIN(trade_date), MAX(trade_date) FROM temp.ingest_batch")
+        start_date, end_date = cursor.fetchone()
+        for table in self._partition_tables(cursor, start_date, end_date):
+            cursor.execute(
+                "INSERT INTO daily_price_rollup " + self._rollup_select(
+                    table,
+                    "(f.variety_key, f.trade_date) IN "
+                    "(SELECT DISTINCT variety_key, trade_date FROM temp.ingest_batch)"
+                )
+            )
+    
+    def _rebuild_daily_rollup(self, cursor):
+        """按分区全量重建日汇总表"""
+        cursor.execute("DELETE FROM daily_price_rollup")
+        for table in self._partition_tables(cursor):
+            cursor.execute("INSERT INTO daily_price_rollup " + self._rollup_select(table, "1=1"))
+        
+        cursor.execute("SELECT COUNT(*) FROM daily_price_rollup")
+        logger.info(f"日汇总表重建完成: {cursor.fetchone()[0]} 行")
+    
+    def _rebuild_latest_prices(self, cursor):
+        """按分区从旧到新全量重建最新价格表"""
+        cursor.execute("DELETE FROM latest_prices")
+        for table in self._partition_tables(cursor):
+            cursor.execute(LATEST_PRICES_UPSERT_SQL.format(values=f'''
+                SELECT market_key, variety_key, province_key, unit_key, trade_date,
+                       min_price, avg_price, max_price, trade_volume, crawl_time
+                FROM {table} WHERE true
+            '''))
+        
+        cursor.execute("SELECT COUNT(*) FROM latest_prices")
+        logger.info(f"最新价格表重建完成: {cursor.fetchone()[0]} 行")
+    
     def _update_statistics(self, cursor):
         """更新数据统计"""
         today = datetime.now().strftime('%Y-%m-%d')
         
         # 计算统计数据
-        cursor.execute("SELECT COUNT(*) FROM market_prices")
+        cursor.execute("SELECT COUNT(*) FROM price_facts")
         total_records = cursor.fetchone()[0]
         
-        cursor.execute("SELECT COUNT(DISTINCT market_name) FROM market_prices")
+        cursor.execute('''
+            SELECT COUNT(DISTINCT market_name) FROM markets
+            WHERE id IN (SELECT market_key FROM price_facts)
+        ''')
         total_markets = cursor.fetchone()[0]
         
-        cursor.execute("SELECT COUNT(DISTINCT variety_name) FROM market_prices")
+        cursor.execute('''
+            SELECT COUNT(DISTINCT variety_name) FROM varieties
+            WHERE id IN (SELECT variety_key FROM price_facts)
+        ''')
         total_varieties = cursor.fetchone()[0]
         
-        cursor.execute("SELECT COUNT(DISTINCT province) FROM market_prices")
+        cursor.execute('''
+            SELECT COUNT(DISTINCT province) FROM provinces
+            WHERE id IN (SELECT province_key FROM price_facts)
+        ''')
         total_provinces = cursor.fetchone()[0]
         
-        cursor.execute("SELECT AVG(avg_price) FROM market_prices WHERE avg_price > 0")
+        cursor.execute("SELECT SUM(price_sum) / SUM(record_count) FROM daily_price_rollup")
         avg_price_result = cursor.fetchone()[0]
         avg_price_all = float(avg_price_result) if avg_price_result else 0
         
-        cursor.execute("SELECT COUNT(*) FROM market_prices WHERE DATE(crawl_time) = ?", (today,))
+        cursor.execute("SELECT COUNT(*) FROM price_facts WHERE DATE(crawl_time) = ?", (today,))
         price_updates = cursor.fetchone()[0]
         
         # 插入或更新统计数据
@@ -335,138 +1176,513 @@ class DatabaseManager:
         ''', (today, total_records, total_markets, total_varieties, 
               total_provinces, avg_price_all, price_updates))
     
-    def query_prices(self, filters: Dict[str, Any], limit: int = 100) -> List[Dict]:
-        """查询价格数据"""
+    @contextmanager
+    def bulk_connection(self):
+        """批量回填使用的连接：关闭同步刷盘、加大页缓存并放宽 WAL 自动检查点
+        
+        这些 PRAGMA 只对本连接生效，连接关闭后其他连接不受影响。synchronous=OFF 时
+        进程崩溃不会丢数据，但操作系统崩溃或断电可能损坏数据库，回填前应先备份。
+        """
+        memory = host_memory_bytes()
+        cache_size_kib = max(self.cache_size_kib, min(memory // BULK_CACHE_MEMORY_RATIO // 1024, BULK_CACHE_MAX_KIB))
         with self.get_connection() as conn:
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.execute(f"PRAGMA cache_size=-{cache_size_kib}")
+            conn.execute(f"PRAGMA wal_autocheckpoint={BULK_WAL_AUTOCHECKPOINT}")
+            yield conn
+    
+    def _drop_bulk_load_objects(self, cursor, table: str):
+        """删除分区表的二级索引和变更日志触发器，唯一约束的自动索引保留给 upsert 使用"""
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL",
+            (table,)
+        )
+        for (index_name,) in cursor.fetchall():
+            cursor.execute(f"DROP INDEX IF EXISTS {index_name}")
+        cursor.execute(f"DROP TRIGGER IF EXISTS log_{table}_insert")
+        cursor.execute(f"DROP TRIGGER IF EXISTS log_{table}_update")
+    
+    def begin_bulk_load(self, conn) -> int:
+        """开始批量回填，删除各分区的二级索引和变更日志触发器，返回回填批次ID
+        
+        上一次回填未完成时沿用该批次，索引和派生表在 finish_bulk_load 中统一重建。
+        """
+        with self.lock:
             cursor = conn.cursor()
+            run_id = self.get_unfinished_backfill(conn)
+            if run_id:
+                logger.info(f"继续未完成的回填批次 {run_id}")
+            else:
+                cursor.execute("INSERT INTO backfill_runs DEFAULT VALUES")
+                run_id = cursor.lastrowid
             
-            # 构建查询条件
-            conditions = []
-            params = []
-            
-            if filters.get('province'):
-                conditions.append("province LIKE ?")
-                params.append(f"%{filters['province']}%")
-            
-            if filters.get('market_name'):
-                conditions.append("market_name LIKE ?")
-                params.append(f"%{filters['market_name']}%")
-            
-            if filters.get('variety_name'):
-                conditions.append("variety_name LIKE ?")
-                params.append(f"%{filters['variety_name']}%")
+            for table in self._partition_tables(cursor):
+                self._drop_bulk_load_objects(cursor, table)
+            conn.commit()
+        
+        logger.info(f"回填批次 {run_id} 开始，已删除分区二级索引和变更日志触发器")
+        return run_id
+    
+    def get_unfinished_backfill(self, conn) -> Optional[int]:
+        """返回上一次中断的回填批次ID，没有时返回 None"""
+        cursor = conn.cursor()
+        cursor.execute("SELECT id FROM backfill_runs WHERE finished_at IS NULL ORDER BY id DESC LIMIT 1")
+        row = cursor.fetchone()
+        return row[0] if row else None
+    
+    def get_backfilled_files(self, conn) -> Dict[str, Tuple[int, float]]:
+        """返回已回填的文件及其导入时的 (大小, 修改时间)"""
+        cursor = conn.cursor()
+        cursor.execute("SELECT path, size, mtime FROM backfill_files")
+        return {path: (size, mtime) for path, size, mtime in cursor.fetchall()}
+    
+    def bulk_upsert(self, conn, data_list: List[Dict], files: List[tuple], run_id: int) -> int:
+        """在一个事务中写入一批回填记录并登记来源文件，返回实际写入或更新的行数
+        
+        已有记录只被爬取时间不早于它的数据覆盖，因此文件的导入顺序不影响结果；
+        files 为 (路径, 大小, 修改时间, 记录数) 列表，与数据同时提交，中断后可按文件续传。
+        """
+        with self.lock:
+            cursor = conn.cursor()
+            try:
+                _, partition_rows = self._encode_rows(cursor, data_list)
+                
+                written = 0
+                new_partition = False
+                for month, month_rows in partition_rows.items():
+                    table, created = self._ensure_partition(cursor, month, track_changes=False)
+                    if created:
+                        self._drop_bulk_load_objects(cursor, table)
+                        new_partition = True
+                    cursor.executemany(self._fact_upsert_sql(table, newer_only=True), month_rows)
+                    written += max(cursor.rowcount, 0)
+                
+                if new_partition:
+                    self._create_views(cursor)
+                
+                cursor.executemany('''
+                    INSERT INTO backfill_files (path, size, mtime, records) VALUES (?, ?, ?, ?)
+                    ON CONFLICT(path) DO UPDATE SET
+                        size = excluded.size,
+                        mtime = excluded.mtime,
+                        records = excluded.records,
+                        loaded_at = CURRENT_TIMESTAMP
+                ''', files)
+                cursor.execute(
+                    "UPDATE backfill_runs SET files = files + ?, records = records + ? WHERE id = ?",
+                    (len(files), written, run_id)
+                )
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                logger.error(f"回填数据写入失败: {str(e)}")
+                raise
+        
+        return written
+    
+    def finish_bulk_load(self, conn, run_id: int) -> Dict:
+        """结束批量回填：重建分区索引和变更日志触发器，全量重建价格历史、日汇总和最新价格表"""
+        timings = {}
+        with self.lock:
+            cursor = conn.cursor()
+            try:
+                start = time.time()
+                self._create_views(cursor)
+                for table in self._partition_tables(cursor):
+                    self._create_partition_indexes(cursor, table)
+                    self._create_change_triggers(cursor, table)
+                timings["indexes"] = round(time.time() - start, 3)
+                
+                start = time.time()
+                self._rebuild_price_history(cursor)
+                self._rebuild_daily_rollup(cursor)
+                self._rebuild_latest_prices(cursor)
+                timings["derived_tables"] = round(time.time() - start, 3)
+                
+                cursor.execute("SELECT records FROM backfill_runs WHERE id = ?", (run_id,))
+                row = cursor.fetchone()
+                if row and row[0]:
+                    self._invalidate_change_log(cursor)
+                cursor.execute(
+                    "UPDATE backfill_runs SET finished_at = CURRENT_TIMESTAMP WHERE id = ?", (run_id,)
+                )
+                conn.commit()
+                
+                self._update_statistics(cursor)
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                logger.error(f"回填收尾失败: {str(e)}")
+                raise
+        
+        logger.info(f"回填批次 {run_id} 完成: 重建索引 {timings['indexes']} 秒, "
+                    f"重建派生表 {timings['derived_tables']} 秒")
+        return timings
+    
+    def _invalidate_change_log(self, cursor):
+        """回填的数据不写入变更日志，推进截断版本使按版本同步的客户端全量同步一次"""
+        cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'price_changes'")
+        row = cursor.fetchone()
+        version = (row[0] if row else 0) + 1
+        if row:
+            cursor.execute("UPDATE sqlite_sequence SET seq = ? WHERE name = 'price_changes'", (version,))
+        else:
+            cursor.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('price_changes', ?)", (version,))
+        cursor.execute('''
+            INSERT INTO change_log_meta (name, value) VALUES ('truncated_version', ?)
+            ON CONFLICT(name) DO UPDATE SET value = MAX(value, excluded.value)
+        ''', (version,))
+    
+    def _build_price_conditions(self, filters: Dict[str, Any]):
+        """将查询条件转换为事实表上的条件，名称过滤先在字典表中解析为主键"""
+        conditions = []
+        params = []
+        
+        if filters.get('province'):
+            conditions.append("f.province_key IN (SELECT id FROM provinces WHERE province LIKE ?)")
+            params.append(f"%{filters['province']}%")
+        
+        if filters.get('market_name'):
+            conditions.append("f.market_key IN (SELECT id FROM markets WHERE market_name LIKE ?)")
+            params.append(f"%{filters['market_name']}%")
+        
+        if filters.get('variety_name'):
+            conditions.append("f.variety_key IN (SELECT id FROM varieties WHERE variety_name LIKE ?)")
+            params.append(f"%{filters['variety_name']}%")
+        
+        if filters.get('start_date'):
+            conditions.append("f.trade_date >= ?")
+            params.append(filters['start_date'])
+        
+        if filters.get('end_date'):
+            conditions.append("f.trade_date <= ?")
+            params.append(filters['end_date'])
+        
+        if filters.get('min_price'):
+            conditions.append("f.avg_price >= ?")
+            params.append(filters['min_price'])
+        
+        if filters.get('max_price'):
+            conditions.append("f.avg_price <= ?")
+            params.append(filters['max_price'])
+        
+        return conditions, params
+    
+    @staticmethod
+    def encode_cursor(row: Dict) -> str:
+        """将一行的排序键编码为不透明的分页游标"""
+        key = json.dumps([row['trade_date'], row['crawl_time'], row['id']], ensure_ascii=False)
+        return base64.urlsafe_b64encode(key.encode('utf-8')).decode('ascii').rstrip('=')
+    
+    @staticmethod
+    def decode_cursor(cursor: str) -> tuple:
+        """解析分页游标，返回 (trade_date, crawl_time, id)"""
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            trade_date, crawl_time, row_id = json.loads(base64.urlsafe_b64decode(padded).decode('utf-8'))
+            return str(trade_date), str(crawl_time), int(row_id)
+        except Exception:
+            raise ValueError(f"无效的分页游标: {cursor}")
+    
+    def query_prices(self, filters: Dict[str, Any], limit: int = 100, cursor: str = None) -> List[Dict]:
+        """查询价格数据"""
+        return self.query_prices_page(filters, limit, cursor)["data"]
+    
+    def query_prices_page(self, filters: Dict[str, Any], limit: int = 100, cursor: str = None) -> Dict:
+        """按 (交易日期, 爬取时间, ID) 倒序的游标分页查询
+        
+        从最新的分区开始逐个查询，每个分区通过覆盖索引定位到游标之后的位置，
+        因此任意深度的分页代价都相同。返回本页数据和下一页游标（没有更多数据时为 None）。
+        """
+        page = self.query_price_rows(filters, limit, cursor)
+        columns = page["columns"]
+        return {
+            "data": [dict(zip(columns, row)) for row in page["rows"]],
+            "next_cursor": page["next_cursor"]
+        }
+    
+    def query_price_rows(self, filters: Dict[str, Any], limit: int = 100, cursor: str = None) -> Dict:
+        """与 query_prices_page 相同，但本页数据保持为 (列名, 行元组列表)，供直接序列化"""
+        if limit <= 0:
+            return {"columns": [], "rows": [], "next_cursor": None}
+        
+        columns = []
+        rows = []
+        try:
+            # 多取一行用于判断是否还有下一页
+            for columns, chunk in self.iter_prices(filters, limit=limit + 1, cursor=cursor):
+                rows.extend(chunk)
+        except Exception as e:
+            logger.error(f"查询数据失败: {str(e)}")
+            raise
+        
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = self.encode_cursor(dict(zip(columns, rows[-1])))
+        
+        return {
+            "columns": columns,
+            "rows": rows,
+            "next_cursor": next_cursor
+        }
+    
+    def get_latest_prices(self, filters: Dict[str, Any] = None, limit: int = 100) -> List[Dict]:
+        """查询各市场各品种的最新价格，直接读取最新价格表而不扫描历史数据"""
+        return [
+            dict(zip(columns, row))
+            for columns, rows in self.iter_latest_prices(filters, limit)
+            for row in rows
+        ]
+    
+    def iter_latest_prices(self, filters: Dict[str, Any] = None, limit: Optional[int] = 100,
+                           chunk_size: int = 5000) -> Iterator[Tuple[List[str], List[tuple]]]:
+        """流式读取最新价格表，每次产出 (列名, 行列表)；limit 为 None 时不限条数"""
+        conditions, params = self._build_price_conditions(filters or {})
+        where_clause = " AND ".join(conditions) if conditions else "1=1"
+        if limit is not None:
+            params = params + [limit]
+        
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT m.market_id, m.market_name, v.variety_id, v.variety_name,
+                       p.province, f.min_price, f.avg_price, f.max_price, u.value AS unit,
+                       f.trade_date, f.trade_volume, f.crawl_time
+                FROM latest_prices f
+                JOIN markets m ON m.id = f.market_key
+                JOIN varieties v ON v.id = f.variety_key
+                LEFT JOIN provinces p ON p.id = f.province_key
+                LEFT JOIN attribute_values u ON u.id = f.unit_key
+                WHERE {where_clause}
+                ORDER BY f.trade_date DESC, v.variety_name, m.market_name
+                {"LIMIT ?" if limit is not None else ""}
+            ''', params)
             
-            if filters.get('start_date'):
-                conditions.append("trade_date >= ?")
-                params.append(filters['start_date'])
+            columns = [description[0] for description in cursor.description]
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield columns, rows
+    
+    def get_change_version(self) -> int:
+        """获取当前最新的变更版本号"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'price_changes'")
+            row = cursor.fetchone()
+            return row[0] if row else 0
+    
+    def get_price_changes(self, since: int = 0, limit: int = 1000) -> Dict:
+        """返回版本号大于 since 的价格变更，按版本分页
+        
+        客户端保存返回的 next_since 作为下次请求的 since；since 早于已截断的版本时
+        返回 reset_required，客户端需要先全量同步。
+        """
+        if since < 0:
+            raise ValueError("since 不能为负数")
+        
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT value FROM change_log_meta WHERE name = 'truncated_version'")
+            row = cursor.fetchone()
+            truncated_version = row[0] if row else 0
+            cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'price_changes'")
+            row = cursor.fetchone()
+            current_version = row[0] if row else 0
             
-            if filters.get('end_date'):
-                conditions.append("trade_date <= ?")
-                params.append(filters['end_date'])
+            if since < truncated_version:
+                return {
+                    "changes": [],
+                    "next_since": since,
+                    "has_more": False,
+                    "current_version": current_version,
+                    "reset_required": True
+                }
             
-            if filters.get('min_price'):
-                conditions.append("avg_price >= ?")
-                params.append(filters['min_price'])
+            cursor.execute('''
+                SELECT c.version, m.market_id, m.market_name, v.variety_id, v.variety_name,
+                       c.trade_date, c.operation,
+                       c.old_min_price, c.old_avg_price, c.old_max_price,
+                       c.new_min_price, c.new_avg_price, c.new_max_price, c.changed_at
+                FROM price_changes c
+                JOIN markets m ON m.id = c.market_key
+                JOIN varieties v ON v.id = c.variety_key
+                WHERE c.version > ?
+                ORDER BY c.version
+                LIMIT ?
+            ''', (since, limit + 1))
             
-            if filters.get('max_price'):
-                conditions.append("avg_price <= ?")
-                params.append(filters['max_price'])
+            columns = [description[0] for description in cursor.description]
+            changes = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        
+        has_more = len(changes) > limit
+        changes = changes[:limit]
+        return {
+            "changes": changes,
+            "next_since": changes[-1]["version"] if changes else since,
+            "has_more": has_more,
+            "current_version": current_version,
+            "reset_required": False
+        }
+    
+    def compact_change_log(self, compact_after_hours: int = 24, retention_days: int = 30,
+                           chunk_size: int = 5000, pause_seconds: float = 0.05) -> Dict:
+        """压缩变更日志
+        
+        早于 compact_after_hours 的记录中，同一 (市场, 品种, 交易日期) 只保留最新一条，
+        按版本同步的客户端得到的最终价格不变；早于 retention_days 的记录全部删除，
+        并记录截断版本，落后于该版本的客户端需要全量同步。
+        """
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT MAX(version) FROM price_changes WHERE changed_at < datetime('now', ?)",
+                (f"-{int(compact_after_hours)} hours",)
+            )
+            compact_version = cursor.fetchone()[0]
+            cursor.execute(
+                "SELECT MAX(version) FROM price_changes WHERE changed_at < datetime('now', ?)",
+                (f"-{int(retention_days)} days",)
+            )
+            truncate_version = cursor.fetchone()[0]
+        
+        superseded = 0
+        if compact_version:
+            superseded = self._delete_in_chunks(
+                "price_changes",
+                '''version <= ? AND EXISTS (
+                    SELECT 1 FROM price_changes n
+                    WHERE n.market_key = price_changes.market_key
+                      AND n.variety_key = price_changes.variety_key
+                      AND n.trade_date = price_changes.trade_date
+                      AND n.version > price_changes.version
+                )''',
+                (compact_version,), chunk_size, pause_seconds
+            )
+        
+        truncated = 0
+        if truncate_version:
+            # 先记录截断版本再删除，读取方不会在删除过程中拿到不完整的增量
+            with self.lock:
+                with self.get_connection() as conn:
+                    conn.execute('''
+                        INSERT INTO change_log_meta (name, value) VALUES ('truncated_version', ?)
+                        ON CONFLICT(name) DO UPDATE SET value = MAX(value, excluded.value)
+                    ''', (truncate_version,))
+                    conn.commit()
+            truncated = self._delete_in_chunks(
+                "price_changes", "version <= ?", (truncate_version,), chunk_size, pause_seconds
+            )
+        
+        logger.info(f"变更日志压缩完成: 合并 {superseded} 条, 截断 {truncated} 条")
+        return {
+            "superseded": superseded,
+            "truncated": truncated,
+            "truncated_version": truncate_version
+        }
+    
+    def get_price_movers(self, trade_date: str = None, limit: int = 20, direction: str = "up") -> List[Dict]:
+        """获取指定交易日涨跌幅最大的品种（默认取最新交易日）"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
             
-            where_clause = " AND ".join(conditions) if conditions else "1=1"
+            if not trade_date:
+                cursor.execute("SELECT MAX(price_date) FROM price_history")
+                trade_date = cursor.fetchone()[0]
+                if not trade_date:
+                    return []
             
-            sql = f'''
-                SELECT * FROM market_prices 
-                WHERE {where_clause}
-                ORDER BY trade_date DESC, crawl_time DESC
+            order = "DESC" if direction == "up" else "ASC"
+            cursor.execute(f'''
+                SELECT h.price_date, m.market_name, v.variety_name, h.avg_price,
+                       h.price_change, h.change_rate
+                FROM price_history h
+                JOIN markets m ON m.market_id = h.market_id
+                JOIN varieties v ON v.variety_id = h.variety_id
+                WHERE h.price_date = ?
+                ORDER BY h.change_rate {order}
                 LIMIT ?
-            '''
-            params.append(limit)
+            ''', (trade_date, limit))
             
-            try:
-                cursor.execute(sql, params)
-                columns = [description[0] for description in cursor.description]
-                results = []
-                
-                for row in cursor.fetchall():
-                    result = dict(zip(columns, row))
-                    results.append(result)
-                
-                return results
-                
-            except Exception as e:
-                logger.error(f"查询数据失败: {str(e)}")
-                raise
+            columns = [description[0] for description in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
     
     def get_price_statistics(self, variety_name: str = None, province: str = None, days: int = 30) -> Dict:
-        """获取价格统计信息"""
+        """获取价格统计信息（基于日汇总表，只有市场数需要回到事实表去重）"""
         with self.get_connection() as conn:
             cursor = conn.cursor()
             
-            conditions = ["avg_price > 0"]
+            conditions = []
             params = []
+            start_date = None
             
             if variety_name:
-                conditions.append("variety_name LIKE ?")
+                conditions.append("variety_key IN (SELECT id FROM varieties WHERE variety_name LIKE ?)")
                 params.append(f"%{variety_name}%")
             
             if province:
-                conditions.append("province LIKE ?")
+                conditions.append("province_key IN (SELECT id FROM provinces WHERE province LIKE ?)")
                 params.append(f"%{province}%")
             
             if days > 0:
-                conditions.append("trade_date >= date('now', '-{} days')".format(days))
+                start_date = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
+                conditions.append("trade_date >= ?")
+                params.append(start_date)
             
-            where_clause = " AND ".join(conditions)
+            where_clause = " AND ".join(conditions) if conditions else "1=1"
+            range_sums = ", ".join(f"SUM({column})" for _, column, _, _ in PRICE_RANGES)
             
             # 基本统计
             cursor.execute(f'''
                 SELECT 
-                    COUNT(*) as total_records,
-                    COUNT(DISTINCT market_name) as total_markets,
-                    COUNT(DISTINCT variety_name) as total_varieties,
-                    MIN(avg_price) as min_price,
-                    MAX(avg_price) as max_price,
-                    AVG(avg_price) as avg_price,
+                    SUM(record_count) as total_records,
+                    MIN(min_price) as min_price,
+                    MAX(max_price) as max_price,
+                    SUM(price_sum) / SUM(record_count) as avg_price,
                     MIN(trade_date) as earliest_date,
-                    MAX(trade_date) as latest_date
-                FROM market_prices 
+                    MAX(trade_date) as latest_date,
+                    {range_sums}
+                FROM daily_price_rollup
                 WHERE {where_clause}
             ''', params)
             
             stats = cursor.fetchone()
             
-            # 价格分布
             cursor.execute(f'''
-                SELECT 
-                    CASE 
-                        WHEN avg_price < 1 THEN '0-1元'
-                        WHEN avg_price < 5 THEN '1-5元'
-                        WHEN avg_price < 10 THEN '5-10元'
-                        WHEN avg_price < 20 THEN '10-20元'
-                        WHEN avg_price < 50 THEN '20-50元'
-                        ELSE '50元以上'
-                    END as price_range,
-                    COUNT(*) as count
-                FROM market_prices 
-                WHERE {where_clause}
-                GROUP BY price_range
-                ORDER BY MIN(avg_price)
+                SELECT COUNT(DISTINCT variety_name) FROM varieties
+                WHERE id IN (SELECT variety_key FROM daily_price_rollup WHERE {where_clause})
             ''', params)
+            total_varieties = cursor.fetchone()[0]
             
-            price_distribution = dict(cursor.fetchall())
+            # 市场数无法由汇总行相加得到，在相关分区上按覆盖索引去重
+            source = self._facts_source(cursor, start_date)
+            cursor.execute(f'''
+                SELECT COUNT(DISTINCT market_name) FROM markets
+                WHERE id IN (SELECT market_key FROM {source} WHERE avg_price > 0 AND {where_clause})
+            ''', params)
+            total_markets = cursor.fetchone()[0]
+            
+            # 价格分布
+            price_distribution = {
+                label: count
+                for (label, _, _, _), count in zip(PRICE_RANGES, stats[6:])
+                if count
+            }
             
             return {
-                "total_records": stats[0],
-                "total_markets": stats[1],
-                "total_varieties": stats[2],
+                "total_records": stats[0] or 0,
+                "total_markets": total_markets,
+                "total_varieties": total_varieties,
                 "price_range": {
-                    "min": float(stats[3]) if stats[3] else 0,
-                    "max": float(stats[4]) if stats[4] else 0,
-                    "avg": round(float(stats[5]), 2) if stats[5] else 0
+                    "min": float(stats[1]) if stats[1] else 0,
+                    "max": float(stats[2]) if stats[2] else 0,
+                    "avg": round(float(stats[3]), 2) if stats[3] else 0
                 },
                 "date_range": {
-                    "earliest": stats[6],
-                    "latest": stats[7]
+                    "earliest": stats[4],
+                    "latest": stats[5]
                 },
                 "price_distribution": price_distribution,
                 "query_params": {
@@ -476,69 +1692,439 @@ class DatabaseManager:
                 }
             }
     
-    def cleanup_old_data(self, days: int = 90):
-        """清理旧数据"""
+    def cleanup_old_data(self, days: int = 90, chunk_size: int = 5000, pause_seconds: float = 0.05,
+                         vacuum_pages: int = 2048,
+                         progress_callback: Optional[Callable[[str, int], None]] = None) -> Dict:
+        """清理旧数据
+        
+        整月过期的分区直接删除，边界分区和历史、统计表按 chunk_size 分批删除，
+        每批独立提交并在批次之间释放写锁，最后通过增量回收释放空闲页。
+        """
+        start_time = time.time()
+        cutoff_date = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
+        cutoff_month = self._partition_month(cutoff_date)
+        
+        # 删除整月过期的分区，每个分区一个短事务；
+        # 交易日期无法识别的分区无法按月判断是否过期，不参与清理
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT month, table_name FROM price_partitions WHERE month < ? AND month != ? ORDER BY month",
+                (cutoff_month, INVALID_PARTITION_MONTH)
+            )
+            expired = cursor.fetchall()
+            cursor.execute("SELECT table_name FROM price_partitions WHERE month = ?", (cutoff_month,))
+            row = cursor.fetchone()
+            boundary_table = row[0] if row else None
+        
+        deleted_prices = 0
+        for month, table in expired:
+            with self.lock:
+                with self.get_connection() as conn:
+                    cursor = conn.cursor()
+                    cursor.execute(f"SELECT COUNT(*) FROM {table}")
+                    deleted_prices += cursor.fetchone()[0]
+                    cursor.execute(f"DROP TABLE {table}")
+                    cursor.execute("DELETE FROM price_partitions WHERE month = ?", (month,))
+                    cursor.execute("DELETE FROM sqlite_sequence WHERE name = ?", (table,))
+                    self._create_views(cursor)
+                    conn.commit()
+            if progress_callback:
+                progress_callback(table, deleted_prices)
+            time.sleep(pause_seconds)
+        
+        # 分批删除边界分区中的旧价格数据
+        if boundary_table:
+            deleted_prices += self._delete_in_chunks(
+                boundary_table, "trade_date < ?", (cutoff_date,),
+                chunk_size, pause_seconds, progress_callback
+            )
+        
+        # 分批删除旧的价格历史
+        deleted_history = self._delete_in_chunks(
+            "price_history", "price_date < ?", (cutoff_date,),
+            chunk_size, pause_seconds, progress_callback
+        )
+        
+        # 分批删除旧的日汇总
+        self._delete_in_chunks(
+            "daily_price_rollup", "trade_date < ?", (cutoff_date,),
+            chunk_size, pause_seconds, progress_callback
+        )
+        
+        # 最近交易日已超出保留期的最新价格一并删除
+        self._delete_in_chunks(
+            "latest_prices", "trade_date < ?", (cutoff_date,),
+            chunk_size, pause_seconds, progress_callback
+        )
+        
+        # 删除旧的统计数据
+        deleted_stats = self._delete_in_chunks(
+            "data_statistics", "stat_date < ?", (cutoff_date,),
+            chunk_size, pause_seconds, progress_callback
+        )
+        
+        # 增量回收空闲页，代替阻塞读写的全量 VACUUM
+        vacuum_result = self.incremental_vacuum(max_pages=vacuum_pages, pause_seconds=pause_seconds)
+        
+        logger.info(f"清理完成: 删除 {len(expired)} 个分区, {deleted_prices} 条价格数据, "
+                    f"{deleted_history} 条历史数据, {deleted_stats} 条统计数据, "
+                    f"回收 {vacuum_result['reclaimed_bytes']} 字节")
+        
+        return {
+            "deleted_prices": deleted_prices,
+            "deleted_history": deleted_history,
+            "deleted_stats": deleted_stats,
+            "dropped_partitions": [table for _, table in expired],
+            "reclaimed_bytes": vacuum_result["reclaimed_bytes"],
+            "free_pages": vacuum_result["free_pages_after"],
+            "duration_seconds": round(time.time() - start_time, 3),
+            "cutoff_date": cutoff_date
+        }
+    
+    def _delete_in_chunks(self, table: str, condition: str, params: tuple, chunk_size: int,
+                          pause_seconds: float,
+                          progress_callback: Optional[Callable[[str, int], None]] = None) -> int:
+        """按批删除满足条件的行，每批独立提交，批次之间让出写锁"""
+        total_deleted = 0
+        while True:
+            with self.lock:
+                with self.get_connection() as conn:
+                    cursor = conn.cursor()
+                    cursor.execute(f'''
+                        DELETE FROM {table} WHERE rowid IN (
+                            SELECT rowid FROM {table} WHERE {condition} LIMIT ?
+                        )
+                    ''', (*params, chunk_size))
+                    deleted = cursor.rowcount
+                    conn.commit()
+            
+            total_deleted += deleted
+            if progress_callback:
+                progress_callback(table, total_deleted)
+            
+            if deleted < chunk_size:
+                return total_deleted
+            
+            logger.info(f"{table}: 已删除 {total_deleted} 条")
+            time.sleep(pause_seconds)
+    
+    def incremental_vacuum(self, step_pages: int = 256, max_pages: Optional[int] = None,
+                           pause_seconds: float = 0.05) -> Dict:
+        """分步回收空闲页，每步只短暂持有写锁，返回回收的空间"""
+        with self.get_connection() as conn:
+            auto_vacuum = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+            page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+            free_before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        
+        result = {
+            "auto_vacuum": auto_vacuum,
+            "free_pages_before": free_before,
+            "free_pages_after": free_before,
+            "reclaimed_bytes": 0
+        }
+        
+        if auto_vacuum != 2:
+            logger.warning("数据库未启用 auto_vacuum=INCREMENTAL，请执行一次迁移 (--migrate) 后再增量回收")
+            return result
+        
+        reclaimed_pages = 0
+        free_pages = free_before
+        while free_pages > 0 and (max_pages is None or reclaimed_pages < max_pages):
+            step = step_pages if max_pages is None else min(step_pages, max_pages - reclaimed_pages)
+            with self.lock:
+                with self.get_connection() as conn:
+                    # execute() 只单步执行，每次仅回收一页；executescript 会执行到结束
+                    conn.executescript(f"PRAGMA incremental_vacuum({int(step)});")
+                    free_after_step = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            
+            if free_after_step >= free_pages:
+                break
+            reclaimed_pages += free_pages - free_after_step
+            free_pages = free_after_step
+            time.sleep(pause_seconds)
+        
+        result["free_pages_after"] = free_pages
+        result["reclaimed_bytes"] = reclaimed_pages * page_size
+        return result
+    
+    def backup_database(self, backup_dir: str = "backups", pages_per_step: int = 1024,
+                        pause_seconds: float = 0.05, keep: int = 7, compress: bool = True) -> Dict:
+        """在线热备份
+        
+        使用 SQLite 备份接口每次只复制 pages_per_step 页，步与步之间暂停，写入方不会被长时间阻塞；
+        备份期间源库被其他连接修改时备份接口会自动重新开始。备份完成后做完整性检查，
+        再压缩并按 keep 轮换旧备份，返回耗时和每秒复制页数。
+        """
+        os.makedirs(backup_dir, exist_ok=True)
+        base_name = os.path.splitext(os.path.basename(self.db_path))[0]
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        backup_file = os.path.join(backup_dir, f"{base_name}_{timestamp}.db")
+        
+        start_time = time.time()
+        progress = {"pages": 0, "steps": 0}
+        
+        def on_progress(status, remaining, total):
+            progress["pages"] = total
+            progress["steps"] += 1
+            time.sleep(pause_seconds)
+        
+        source = sqlite3.connect(self.db_path)
+        target = sqlite3.connect(backup_file)
+        try:
+            source.backup(target, pages=pages_per_step, progress=on_progress)
+            copy_seconds = time.time() - start_time
+            # 备份文件独立使用，不保留源库的 WAL 模式
+            target.execute("PRAGMA journal_mode=DELETE")
+            integrity = target.execute("PRAGMA integrity_check").fetchone()[0]
+        finally:
+            target.close()
+            source.close()
+        
+        if integrity != "ok":
+            os.remove(backup_file)
+            raise RuntimeError(f"备份文件完整性检查失败: {integrity}")
+        
+        size_bytes = os.path.getsize(backup_file)
+        if compress:
+            with open(backup_file, 'rb') as src, gzip.open(backup_file + ".gz", 'wb', compresslevel=6) as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+            os.remove(backup_file)
+            backup_file += ".gz"
+        
+        # 按文件名中的时间戳轮换，只保留最近 keep 个备份
+        backups = sorted(
+            name for name in os.listdir(backup_dir)
+            if name.startswith(f"{base_name}_") and (name.endswith(".db") or name.endswith(".db.gz"))
+        )
+        removed = []
+        for name in backups[:-keep] if keep > 0 else []:
+            os.remove(os.path.join(backup_dir, name))
+            removed.append(name)
+        
+        duration = time.time() - start_time
+        result = {
+            "backup_file": backup_file,
+            "pages": progress["pages"],
+            "steps": progress["steps"],
+            "size_bytes": size_bytes,
+            "compressed_bytes": os.path.getsize(backup_file),
+            "integrity": integrity,
+            "copy_seconds": round(copy_seconds, 3),
+            "duration_seconds": round(duration, 3),
+            "pages_per_second": round(progress["pages"] / copy_seconds, 1) if copy_seconds > 0 else 0,
+            "removed_backups": removed
+        }
+        logger.info(f"数据库备份完成: {backup_file}, {result['pages']} 页, "
+                    f"{result['pages_per_second']} 页/秒, 耗时 {result['duration_seconds']} 秒")
+        return result
+    
+    def get_query_stats(self, top: int = 20, order_by: str = None) -> Dict:
+        """返回SQL性能统计：最慢、最频繁的SQL形态和最近的慢查询"""
+        if not self.profiler:
+            return {"enabled": False}
+        
+        report = self.profiler.report(top)
+        if order_by:
+            report["top"] = self.profiler.top(top, order_by)
+        return report
+    
+    def reset_query_stats(self):
+        """清空SQL性能统计"""
+        if self.profiler:
+            self.profiler.reset()
+    
+    def _profile_queries(self, cursor, repeat: int = 3) -> Dict:
+        """记录代表性查询的执行计划和最短耗时（毫秒）"""
+        tables = self._partition_tables(cursor)
+        latest = tables[-1] if tables else None
+        profile = {}
+        for name, sql in MAINTENANCE_QUERIES:
+            if "{latest}" in sql and not latest:
+                continue
+            sql = sql.format(latest=latest)
+            cursor.execute("EXPLAIN QUERY PLAN " + sql)
+            plan = " | ".join(row[3] for row in cursor.fetchall())
+            
+            best = None
+            for _ in range(repeat):
+                start = time.perf_counter()
+                cursor.execute(sql).fetchall()
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            profile[name] = {"plan": plan, "ms": round(best * 1000, 3)}
+        return profile
+    
+    def optimize_database(self, min_changes: int = 50000, checkpoint: bool = True,
+                          force: bool = False, analysis_limit: int = 1000) -> Dict:
+        """数据库维护：更新查询规划统计信息并截断 WAL
+        
+        自上次维护以来的变更数（按变更日志版本计）达到 min_changes，或尚无统计信息时执行 ANALYZE，
+        否则只执行 PRAGMA optimize。维护前后记录代表性查询的执行计划和耗时，便于发现计划变化。
+        """
+        start_time = time.time()
         with self.lock:
             with self.get_connection() as conn:
                 cursor = conn.cursor()
+                before = self._profile_queries(cursor)
                 
-                cutoff_date = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
-                
-                # 删除旧的价格数据
-                cursor.execute("DELETE FROM market_prices WHERE trade_date < ?", (cutoff_date,))
-                deleted_prices = cursor.rowcount
-                
-                # 删除旧的价格历史
-                cursor.execute("DELETE FROM price_history WHERE price_date < ?", (cutoff_date,))
-                deleted_history = cursor.rowcount
-                
-                # 删除旧的统计数据
-                cursor.execute("DELETE FROM data_statistics WHERE stat_date < ?", (cutoff_date,))
-                deleted_stats = cursor.rowcount
+                cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'price_changes'")
+                row = cursor.fetchone()
+                current_version = row[0] if row else 0
+                cursor.execute("SELECT value FROM change_log_meta WHERE name = 'optimized_version'")
+                row = cursor.fetchone()
+                changes = current_version - (row[0] if row else 0)
+                cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'")
+                has_stats = cursor.fetchone() is not None
                 
+                if force or not has_stats or changes >= min_changes:
+                    # analysis_limit 让 ANALYZE 只抽样每个索引的部分行，大表上也能很快完成
+                    cursor.execute(f"PRAGMA analysis_limit={int(analysis_limit)}")
+                    cursor.execute("ANALYZE")
+                    action = "analyze"
+                    cursor.execute('''
+                        INSERT INTO change_log_meta (name, value) VALUES ('optimized_version', ?)
+                        ON CONFLICT(name) DO UPDATE SET value = excluded.value
+                    ''', (current_version,))
+                else:
+                    cursor.execute("PRAGMA optimize")
+                    action = "optimize"
                 conn.commit()
                 
-                # 优化数据库
-                cursor.execute("VACUUM")
+                checkpoint_result = None
+                if checkpoint:
+                    busy, wal_pages, checkpointed = cursor.execute(
+                        "PRAGMA wal_checkpoint(TRUNCATE)"
+                    ).fetchone()
+                    checkpoint_result = {"busy": bool(busy), "wal_pages": wal_pages, "checkpointed": checkpointed}
                 
-                logger.info(f"清理完成: 删除 {deleted_prices} 条价格数据, {deleted_history} 条历史数据, {deleted_stats} 条统计数据")
-                
-                return {
-                    "deleted_prices": deleted_prices,
-                    "deleted_history": deleted_history,
-                    "deleted_stats": deleted_stats,
-                    "cutoff_date": cutoff_date
-                }
+                after = self._profile_queries(cursor)
+        
+        queries = {}
+        for name, result in after.items():
+            previous = before.get(name, {})
+            queries[name] = {
+                "before_ms": previous.get("ms"),
+                "after_ms": result["ms"],
+                "plan_changed": previous.get("plan") != result["plan"],
+                "before_plan": previous.get("plan"),
+                "after_plan": result["plan"]
+            }
+            if queries[name]["plan_changed"]:
+                logger.info(f"查询计划变化 {name}: {previous.get('plan')} -> {result['plan']}")
+        
+        result = {
+            "action": action,
+            "changes_since_last": changes,
+            "checkpoint": checkpoint_result,
+            "cache_size_kib": self.cache_size_kib,
+            "mmap_size": self.mmap_size,
+            "queries": queries,
+            "duration_seconds": round(time.time() - start_time, 3)
+        }
+        timings = ", ".join(f"{name} {q['before_ms']}->{q['after_ms']}ms" for name, q in queries.items())
+        logger.info(f"数据库维护完成: {action}, 距上次 {changes} 条变更, WAL检查点 {checkpoint_result}, "
+                    f"查询耗时 {timings}")
+        return result
     
-    def export_data(self, output_file: str, format: str = "csv", filters: Dict = None):
-        """导出数据"""
-        filters = filters or {}
-        data = self.query_prices(filters, limit=10000)
+    @staticmethod
+    def _column_types(cursor, relation: str) -> Dict[str, str]:
+        """按 SQLite 的类型亲和性规则返回表或视图各列的类型：INTEGER / REAL / TEXT
         
-        if not data:
-            logger.warning("没有数据可导出")
-            return
+        TIMESTAMP 等 NUMERIC 亲和性的列保存的是日期文本，按 TEXT 处理。
+        """
+        column_types = {}
+        cursor.execute(f"PRAGMA table_info({relation})")
+        for _, name, declared, *_ in cursor.fetchall():
+            declared = (declared or "").upper()
+            if "INT" in declared:
+                column_types[name] = "INTEGER"
+            elif any(token in declared for token in ("REAL", "FLOA", "DOUB")):
+                column_types[name] = "REAL"
+            else:
+                column_types[name] = "TEXT"
+        return column_types
+    
+    def iter_prices(self, filters: Dict[str, Any] = None, chunk_size: int = 5000,
+                    limit: Optional[int] = None, cursor: str = None) -> Iterator[Tuple[List[str], List[tuple]]]:
+        """按 (交易日期, 爬取时间, ID) 倒序流式读取价格数据，每次产出 (列名, 行列表)
         
-        df = pd.DataFrame(data)
+        limit 为 None 时读取全部匹配的行；cursor 为分页游标时从该位置之后开始。
+        """
+        filters = filters or {}
+        seek = self.decode_cursor(cursor) if cursor else None
         
-        if format.lower() == "csv":
-            df.to_csv(output_file, index=False, encoding='utf-8-sig')
-        elif format.lower() == "json":
-            df.to_json(output_file, orient='records', force_ascii=False, indent=2)
-        elif format.lower() == "excel":
-            df.to_excel(output_file, index=False)
-        else:
-            raise ValueError(f"不支持的格式: {format}")
+        with self.get_connection() as conn:
+            db_cursor = conn.cursor()
+            
+            conditions, params = self._build_price_conditions(filters)
+            if seek:
+                conditions.append("(f.trade_date, f.crawl_time, f.id) < (?, ?, ?)")
+                params.extend(seek)
+            where_clause = " AND ".join(conditions) if conditions else "1=1"
+            
+            end_date = filters.get('end_date')
+            if seek and (not end_date or seek[0] < end_date):
+                end_date = seek[0]
+            tables = self._partition_tables(db_cursor, filters.get('start_date'), end_date)
+            
+            remaining = limit
+            for table in reversed(tables):
+                if remaining is not None and remaining <= 0:
+                    break
+                
+                sql = PRICE_SELECT_SQL.format(source=table) + f'''
+                    WHERE {where_clause}
+                    ORDER BY f.trade_date DESC, f.crawl_time DESC, f.id DESC
+                '''
+                if remaining is None:
+                    db_cursor.execute(sql, params)
+                else:
+                    db_cursor.execute(sql + "LIMIT ?", params + [remaining])
+                columns = [description[0] for description in db_cursor.description]
+                
+                while True:
+                    rows = db_cursor.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    if remaining is not None:
+                        remaining -= len(rows)
+                    yield columns, rows
+    
+    def export_data(self, output_file: str, format: str = "csv", filters: Dict = None,
+                    chunk_size: int = 5000, compression: Optional[str] = None,
+                    split_by_province: bool = False) -> Dict:
+        """流式导出数据（无条数上限），支持 csv / json / ndjson / parquet / excel
+        
+        split_by_province 仅对 Excel 有效，每个省份写入单独的工作表。
+        """
+        with self.get_connection() as conn:
+            column_types = self._column_types(conn.cursor(), "market_prices")
+        chunks = self.iter_prices(filters, chunk_size)
+        split_by = "province" if split_by_province else None
         
-        logger.info(f"数据已导出到 {output_file}, 共 {len(data)} 条记录")
+        result = export_chunks(chunks, output_file, format, compression, split_by=split_by,
+                               column_types=column_types)
+        if not result["rows"]:
+            logger.warning("没有数据可导出")
+        return result
 
 # 使用示例
 if __name__ == "__main__":
-    db = DatabaseManager()
+    parser = argparse.ArgumentParser(description="数据库管理工具")
+    parser.add_argument("--db", default="market_data.db", help="数据库文件路径")
+    parser.add_argument("--migrate", action="store_true", help="将旧版宽表数据库迁移为字典编码结构")
+    args = parser.parse_args()
+    
+    db = DatabaseManager(args.db)
     
-    # 获取统计信息
-    stats = db.get_price_statistics(days=7)
-    print("最近7天统计:", json.dumps(stats, ensure_ascii=False, indent=2))
+    if args.migrate:
+        result = db.migrate()
+        print("迁移结果:", json.dumps(result, ensure_ascii=False, indent=2))
+    else:
+        # 获取统计信息
+        stats = db.get_price_statistics(days=7)
+        print("最近7天统计:", json.dumps(stats, ensure_ascii=False, indent=2))
     
     # 清理90天前的数据
     # cleanup_result = db.cleanup_old_data(90)
@@ -164,10 +164,11 @@ check_data_persistence() {
         log_success "✅ 数据目录存在"
         
         # CSV文件检查
-        if [ -f "data/market_prices.csv" ]; then
-            CSV_SIZE=$(du -h data/market_prices.csv | cut -f1)
-            CSV_LINES=$(wc -l < data/market_prices.csv 2>/dev/null || echo "0")
-            log_success "✅ CSV数据文件: $CSV_SIZE, $CSV_LINES 行"
+        if ls data/market_prices/*/segment-*.csv >/dev/null 2>&1; then
+            CSV_SIZE=$(du -sh data/market_prices | cut -f1)
+            CSV_SEGMENTS=$(ls data/market_prices/*/segment-*.csv | wc -l)
+            CSV_LINES=$(cat data/market_prices/*/segment-*.csv 2>/dev/null | wc -l || echo "0")
+            log_success "✅ CSV数据文件: $CSV_SIZE, $CSV_SEGMENTS 个分段, $CSV_LINES 行"
         else
             log_error "❌ CSV数据文件不存在"
         fi
@@ -305,8 +306,8 @@ show_management_commands() {
     echo
     echo "📊 数据管理:"
     echo "  修复数据: python3 fix-csv-data.py"
-    echo "  备份数据: cp data/market_prices.csv data/backup_\$(date +%Y%m%d).csv"
-    echo "  查看数据: head -10 data/market_prices.csv"
+    echo "  备份数据: cp -r data/market_prices data/backup_\$(date +%Y%m%d)"
+    echo "  查看数据: ls -l data/market_prices/"
     
     echo
     echo "📝 日志管理:"
@@ -162,6 +162,13 @@ create_app_structure() {
     cp ../market_crawler.py .
     cp ../api_server.py .
     cp ../database_manager.py .
+    cp ../data_exporter.py .
+    cp ../query_profiler.py .
+    cp ../backfill_importer.py .
+    cp ../arrow_snapshot.py .
+    cp ../storage_executor.py .
+    cp ../response_cache.py .
+    cp ../json_response.py .
     cp ../location_service.py .
     cp ../scheduler_service.py .
     cp ../requirements.txt .
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+API 响应序列化
+查询结果以 (列名, 行元组列表) 的形式直接编码为 JSON，不经过 FastAPI 的 jsonable_encoder；
+安装 orjson 时使用 orjson，否则使用标准库 json。
+NDJSON 模式下数据库游标在存储线程中逐块读取、编码后经有界队列交给响应流，
+内存占用只与块大小和队列长度有关，第一块数据读出后即开始发送
+"""
+
+import asyncio
+import json
+import logging
+import math
+import queue
+import threading
+import time
+from typing import Any, Callable, Iterable, List, Optional, Tuple
+
+import numpy as np
+from fastapi import Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from storage_executor import BoundedExecutor, StorageTimeout
+
+logger = logging.getLogger(__name__)
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+# 流式响应：每块行数、已编码但未发送的最多块数、客户端不读取时生产者最长等待时间（秒）
+STREAM_CHUNK_ROWS = 1000
+STREAM_QUEUE_CHUNKS = 8
+STREAM_STALL_SECONDS = 60.0
+STREAM_POLL_SECONDS = 0.5
+
+Chunk = Tuple[List[str], List[tuple]]
+
+_orjson = None
+
+
+def _load_orjson():
+    """orjson 是可选依赖，只在第一次序列化时尝试导入"""
+    global _orjson
+    if _orjson is None:
+        try:
+            import orjson
+        except ImportError:
+            orjson = False
+        _orjson = orjson
+    return _orjson
+
+
+class Rows:
+    """查询结果的行元组和列名，序列化时直接编码为对象数组，不预先为每行构造字典"""
+    
+    __slots__ = ("columns", "rows")
+    
+    def __init__(self, columns: List[str], rows: List[tuple]):
+        self.columns = columns
+        self.rows = rows
+    
+    def __len__(self) -> int:
+        return len(self.rows)
+    
+    @classmethod
+    def collect(cls, chunks: Iterable[Chunk]) -> "Rows":
+        """合并 (列名, 行列表) 迭代器的各块"""
+        columns = []
+        rows = []
+        for columns, chunk in chunks:
+            rows.extend(chunk)
+        return cls(columns, rows)
+    
+    def records(self) -> List[dict]:
+        columns = self.columns
+        return [dict(zip(columns, row)) for row in self.rows]
+
+
+def _default(obj: Any):
+    if isinstance(obj, Rows):
+        return obj.records()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"无法序列化 {type(obj).__name__}")
+
+
+def _json_safe(obj: Any) -> Any:
+    """把 NaN/Infinity 换成 None、numpy 标量换成 Python 值，与 orjson 的输出一致"""
+    if isinstance(obj, float):
+        return obj if math.isfinite(obj) else None
+    if isinstance(obj, dict):
+        return {key: _json_safe(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_json_safe(value) for value in obj]
+    if isinstance(obj, Rows):
+        return _json_safe(obj.records())
+    if isinstance(obj, np.generic):
+        return _json_safe(obj.item())
+    return obj
+
+
+def _stdlib_dumps(content: Any) -> str:
+    """标准库编码；含有 NaN/Infinity 时逐值替换后重新编码，不输出非法的 NaN 记号"""
+    try:
+        return json.dumps(content, default=_default, ensure_ascii=False, allow_nan=False, separators=(",", ":"))
+    except ValueError:
+        return json.dumps(_json_safe(content), ensure_ascii=False, allow_nan=False, separators=(",", ":"))
+
+
+def dumps(content: Any) -> bytes:
+    """编码为 UTF-8 JSON 字节串，中文不转义；无论是否安装 orjson，NaN 都编码为 null"""
+    orjson = _load_orjson()
+    if orjson:
+        return orjson.dumps(content, default=_default, option=orjson.OPT_SERIALIZE_NUMPY)
+    return _stdlib_dumps(content).encode("utf-8")
+
+
+def ndjson_lines(columns: List[str], rows: List[tuple]) -> bytes:
+    """每行一个 JSON 对象，以换行结尾"""
+    orjson = _load_orjson()
+    if orjson:
+        option = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_APPEND_NEWLINE
+        return b"".join(orjson.dumps(dict(zip(columns, row)), default=_default, option=option) for row in rows)
+    return "".join(_stdlib_dumps(dict(zip(columns, row))) + "\n" for row in rows).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """用 dumps() 渲染的 JSONResponse，内容中可以包含 Rows"""
+    
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def wants_ndjson(request: Request) -> bool:
+    """Accept: application/x-ndjson 或 ?stream=1 时返回逐行的流式响应"""
+    if request.query_params.get("stream", "").lower() in ("1", "true", "yes"):
+        return True
+    return NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+
+def ndjson_response(executor: BoundedExecutor, iterate: Callable[..., Iterable[Chunk]], *args,
+                    stall_seconds: float = STREAM_STALL_SECONDS, queue_chunks: int = STREAM_QUEUE_CHUNKS,
+                    headers: Optional[dict] = None, **kwargs) -> StreamingResponse:
+    """在 executor 的一个线程中迭代 iterate(*args, **kwargs) 并逐块流式返回 NDJSON
+    
+    同一个迭代器（及其数据库连接）只在一个线程中使用；名额已满时立即抛出 StorageOverloaded，
+    此时响应头尚未发送，客户端得到 503。客户端断开后生产者在下一块处停止并关闭迭代器。
+    """
+    loop = asyncio.get_running_loop()
+    chunks: queue.Queue = queue.Queue(maxsize=queue_chunks)
+    ready = asyncio.Event()
+    stopped = threading.Event()
+    
+    def produce() -> int:
+        total = 0
+        iterator = iter(iterate(*args, **kwargs))
+        try:
+            for columns, rows in iterator:
+                body = ndjson_lines(columns, rows)
+                deadline = time.monotonic() + stall_seconds
+                while True:
+                    if stopped.is_set():
+                        return total
+                    try:
+                        chunks.put(body, timeout=STREAM_POLL_SECONDS)
+                        break
+                    except queue.Full:
+                        if time.monotonic() > deadline:
+                            raise StorageTimeout(f"客户端超过 {stall_seconds} 秒未读取流式响应")
+                loop.call_soon_threadsafe(ready.set)
+                total += len(rows)
+        finally:
+            close = getattr(iterator, "close", None)
+            if close:
+                close()
+        return total
+    
+    def finished(f: asyncio.Future):
+        # 客户端已断开时无人等待结果，取走异常避免事件循环报告未处理的异常
+        if not f.cancelled():
+            f.exception()
+        ready.set()
+    
+    future = executor.submit(produce)
+    done = asyncio.wrap_future(future, loop=loop)
+    done.add_done_callback(finished)
+    
+    async def body():
+        try:
+            while True:
+                try:
+                    yield chunks.get_nowait()
+                    continue
+                except queue.Empty:
+                    pass
+                
+                if done.done():
+                    # 生产者结束前放入的块
+                    while not chunks.empty():
+                        yield chunks.get_nowait()
+                    rows = done.result()
+                    logger.debug(f"流式响应完成: {rows} 行")
+                    return
+                
+                ready.clear()
+                if chunks.empty() and not done.done():
+                    await ready.wait()
+        except Exception as e:
+            # 响应头已发送，只能中断连接
+            logger.error(f"流式响应中断: {str(e)}")
+            raise
+        finally:
+            stopped.set()
+            executor.cancel(future)
+    
+    return StreamingResponse(body(), media_type=NDJSON_MEDIA_TYPE, headers=headers)
@@ -34,8 +34,10 @@ class MarketLocation:
     distance: float = 0.0
 
 class LocationService:
-    def __init__(self, db_path: str = "market_data.db"):
+    def __init__(self, db_path: str = "market_data.db", profiler=None):
         self.db_path = db_path
+        # 可选的 QueryProfiler，与 DatabaseManager 共用SQL性能统计
+        self.profiler = profiler
         # 主要城市坐标数据（可以扩展）
         self.city_coordinates = {
             # 直辖市
@@ -83,6 +85,12 @@ class LocationService:
             "无锡市": {"lat": 31.4912, "lon": 120.3119, "province": "江苏省"},
         }
     
+    def _connect(self):
+        """打开数据库连接，配置了 profiler 时记录SQL耗时"""
+        if self.profiler:
+            return sqlite3.connect(self.db_path, factory=self.profiler.connection_factory)
+        return sqlite3.connect(self.db_path)
+    
     @staticmethod
     def calculate_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
         """
@@ -148,7 +156,7 @@ class LocationService:
             user_location = self.get_location_from_coordinates(lat, lon)
             
             # 从数据库获取市场数据
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             cursor = conn.cursor()
             
             # 获取最近的市场数据
@@ -285,15 +293,17 @@ class LocationService:
         获取指定地区指定品种的价格趋势
         """
         try:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             cursor = conn.cursor()
             
+            # 从日汇总表按日合并各品种、省份的均价和记录数
             cursor.execute('''
-                SELECT trade_date, AVG(avg_price) as avg_price, COUNT(*) as market_count
-                FROM market_prices 
-                WHERE variety_name LIKE ? AND province LIKE ?
+                SELECT trade_date, SUM(price_sum) / SUM(record_count) as avg_price,
+                       SUM(record_count) as market_count
+                FROM daily_price_rollup
+                WHERE variety_key IN (SELECT id FROM varieties WHERE variety_name LIKE ?)
+                AND province_key IN (SELECT id FROM provinces WHERE province LIKE ?)
                 AND trade_date >= date('now', '-{} days')
-                AND avg_price > 0
                 GROUP BY trade_date
                 ORDER BY trade_date
             '''.format(days), (f"%{variety}%", f"%{province}%"))
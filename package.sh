@@ -95,6 +95,13 @@ copy_core_files() {
     cp market_crawler.py "$target_dir/"
     cp api_server.py "$target_dir/"
     cp database_manager.py "$target_dir/"
+    cp data_exporter.py "$target_dir/"
+    cp query_profiler.py "$target_dir/"
+    cp backfill_importer.py "$target_dir/"
+    cp arrow_snapshot.py "$target_dir/"
+    cp storage_executor.py "$target_dir/"
+    cp response_cache.py "$target_dir/"
+    cp json_response.py "$target_dir/"
     cp location_service.py "$target_dir/"
     cp scheduler_service.py "$target_dir/"
     cp requirements.txt "$target_dir/"
@@ -723,6 +730,13 @@ verify_package() {
         "market_crawler.py"
         "api_server.py"
         "database_manager.py"
+        "data_exporter.py"
+        "query_profiler.py"
+        "backfill_importer.py"
+        "arrow_snapshot.py"
+        "storage_executor.py"
+        "response_cache.py"
+        "json_response.py"
         "location_service.py"
         "scheduler_service.py"
         "requirements.txt"
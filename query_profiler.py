@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SQL 查询性能分析
+通过自定义的 sqlite3 连接和游标记录每条语句的耗时和行数，按归一化后的 SQL 形态汇总，
+超过阈值的慢查询同时记录 EXPLAIN QUERY PLAN
+"""
+
+import logging
+import re
+import sqlite3
+import threading
+import time
+import weakref
+from collections import deque
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 默认慢查询阈值（毫秒）和保留的最近慢查询条数
+DEFAULT_SLOW_QUERY_MS = 100.0
+SLOW_QUERY_HISTORY = 100
+
+# SQL 样例保存的最大长度
+SQL_SAMPLE_LENGTH = 500
+
+# 只为这些语句获取执行计划（DDL、PRAGMA 等没有查询计划）
+PLAN_STATEMENTS = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE", "REPLACE")
+
+SORT_KEYS = {
+    "total": "total_ms",
+    "max": "max_ms",
+    "avg": "avg_ms",
+    "count": "count",
+}
+
+
+@lru_cache(maxsize=1024)
+def normalize_sql(sql: str) -> str:
+    """将 SQL 归一化为形态：去掉字面量、合并空白和 IN 列表，月分区表名统一为 price_facts_*"""
+    shape = re.sub(r"\bprice_facts_\d{6}\b", "price_facts_*", sql)
+    shape = re.sub(r"'(?:[^']|'')*'", "?", shape)
+    shape = re.sub(r"\b\d+(?:\.\d+)?\b", "?", shape)
+    shape = re.sub(r"\s+", " ", shape).strip()
+    shape = re.sub(r"\(\s*\?(?:\s*,\s*\?)+\s*\)", "(?, ...)", shape)
+    return shape
+
+
+class QueryProfiler:
+    """线程安全的查询统计，按 SQL 形态累计次数、耗时和行数"""
+    
+    def __init__(self, slow_query_ms: float = DEFAULT_SLOW_QUERY_MS, enabled: bool = True):
+        self.slow_query_ms = slow_query_ms
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+        self.shapes: Dict[str, Dict] = {}
+        self.slow_queries = deque(maxlen=SLOW_QUERY_HISTORY)
+        
+        # 绑定到本实例的连接和游标类，传给 sqlite3.connect(factory=...)
+        self.cursor_class = type("ProfilingCursor", (ProfilingCursor,), {"profiler": self})
+        self.connection_factory = type(
+            "ProfilingConnection", (ProfilingConnection,), {"cursor_class": self.cursor_class}
+        )
+    
+    def record(self, sql: str, elapsed: float, rows: int, new_statement: bool):
+        """累计一次执行（或同一语句后续取数）的耗时和行数"""
+        shape = normalize_sql(sql)
+        with self.lock:
+            stats = self.shapes.get(shape)
+            if stats is None:
+                stats = self.shapes[shape] = {
+                    "shape": shape,
+                    "sample": sql.strip()[:SQL_SAMPLE_LENGTH],
+                    "count": 0,
+                    "total_ms": 0.0,
+                    "max_ms": 0.0,
+                    "rows": 0,
+                    "slow_count": 0,
+                    "plan": None,
+                }
+            if new_statement:
+                stats["count"] += 1
+            stats["total_ms"] += elapsed * 1000
+            stats["rows"] += rows
+    
+    def finish(self, sql: str, elapsed: float, rows: int, plan: Optional[str]):
+        """一条语句结束时更新最大耗时，超过阈值的记入慢查询"""
+        elapsed_ms = elapsed * 1000
+        shape = normalize_sql(sql)
+        with self.lock:
+            stats = self.shapes.get(shape)
+            if stats is None:
+                return
+            stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+            if elapsed_ms < self.slow_query_ms:
+                return
+            stats["slow_count"] += 1
+            if plan:
+                stats["plan"] = plan
+            self.slow_queries.append({
+                "shape": shape,
+                "sql": sql.strip()[:SQL_SAMPLE_LENGTH],
+                "ms": round(elapsed_ms, 3),
+                "rows": rows,
+                "plan": plan,
+                "at": time.strftime('%Y-%m-%d %H:%M:%S')
+            })
+        logger.warning(f"慢查询 {elapsed_ms:.1f} ms, {rows} 行: {shape[:200]}")
+    
+    def top(self, n: int = 20, order_by: str = "total") -> List[Dict]:
+        """按指定指标返回前 n 个 SQL 形态"""
+        if order_by not in SORT_KEYS:
+            raise ValueError(f"不支持的排序方式: {order_by}，可选: {', '.join(SORT_KEYS)}")
+        
+        with self.lock:
+            items = [dict(stats) for stats in self.shapes.values()]
+        for item in items:
+            item["avg_ms"] = round(item["total_ms"] / item["count"], 3) if item["count"] else 0.0
+            item["total_ms"] = round(item["total_ms"], 3)
+            item["max_ms"] = round(item["max_ms"], 3)
+        
+        key = SORT_KEYS[order_by]
+        return sorted(items, key=lambda item: item[key], reverse=True)[:n]
+    
+    def report(self, n: int = 20) -> Dict:
+        """汇总报告：最慢、最频繁的 SQL 形态和最近的慢查询"""
+        with self.lock:
+            slow_queries = list(self.slow_queries)
+            shape_count = len(self.shapes)
+        return {
+            "enabled": self.enabled,
+            "slow_query_ms": self.slow_query_ms,
+            "since": time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.started_at)),
+            "shapes": shape_count,
+            "slowest": self.top(n, "total"),
+            "most_frequent": self.top(n, "count"),
+            "slow_queries": slow_queries[-n:][::-1]
+        }
+    
+    def reset(self):
+        """清空统计"""
+        with self.lock:
+            self.shapes.clear()
+            self.slow_queries.clear()
+            self.started_at = time.time()
+
+
+class ProfilingCursor(sqlite3.Cursor):
+    """记录执行和取数耗时的游标，同一语句的取数时间累计到该语句上"""
+    
+    profiler = None
+    
+    def _begin(self, sql: str, params, elapsed: float):
+        self._finish()
+        self._sql = sql
+        self._params = params
+        self._elapsed = elapsed
+        self._rows = max(super().rowcount, 0)
+        self.profiler.record(sql, elapsed, self._rows, new_statement=True)
+    
+    def _add(self, elapsed: float, rows: int):
+        if getattr(self, "_sql", None) is None:
+            return
+        self._elapsed += elapsed
+        self._rows += rows
+        self.profiler.record(self._sql, elapsed, rows, new_statement=False)
+    
+    def _finish(self):
+        sql = getattr(self, "_sql", None)
+        if sql is None:
+            return
+        self._sql = None
+        plan = None
+        if (self._elapsed * 1000 >= self.profiler.slow_query_ms
+                and sql.lstrip().upper().startswith(PLAN_STATEMENTS)):
+            plan = self._explain(sql, self._params)
+        self.profiler.finish(sql, self._elapsed, self._rows, plan)
+    
+    def _explain(self, sql: str, params) -> Optional[str]:
+        """用独立的原生游标获取执行计划，避免被再次统计"""
+        try:
+            cursor = sqlite3.Cursor(self.connection)
+            cursor.execute("EXPLAIN QUERY PLAN " + sql, params or ())
+            return " | ".join(row[3] for row in cursor.fetchall())
+        except sqlite3.Error as e:
+            return f"无法获取执行计划: {e}"
+    
+    def execute(self, sql, parameters=()):
+        if not self.profiler.enabled:
+            return super().execute(sql, parameters)
+        start = time.perf_counter()
+        super().execute(sql, parameters)
+        self._begin(sql, parameters, time.perf_counter() - start)
+        return self
+    
+    def executemany(self, sql, seq_of_parameters):
+        if not self.profiler.enabled:
+            return super().executemany(sql, seq_of_parameters)
+        seq_of_parameters = list(seq_of_parameters)
+        start = time.perf_counter()
+        super().executemany(sql, seq_of_parameters)
+        self._begin(sql, seq_of_parameters[0] if seq_of_parameters else (), time.perf_counter() - start)
+        return self
+    
+    def executescript(self, sql_script):
+        if not self.profiler.enabled:
+            return super().executescript(sql_script)
+        start = time.perf_counter()
+        super().executescript(sql_script)
+        self._finish()
+        self.profiler.record(sql_script, time.perf_counter() - start, 0, new_statement=True)
+        self.profiler.finish(sql_script, time.perf_counter() - start, 0, None)
+        return self
+    
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._add(time.perf_counter() - start, 1 if row is not None else 0)
+        return row
+    
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._add(time.perf_counter() - start, len(rows))
+        return rows
+    
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._add(time.perf_counter() - start, len(rows))
+        self._finish()
+        return rows
+    
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._finish()
+            raise
+        self._add(time.perf_counter() - start, 1)
+        return row
+    
+    def close(self):
+        self._finish()
+        super().close()
+    
+    def __del__(self):
+        # 未取完结果就被丢弃的游标在回收时补记
+        try:
+            self._finish()
+        except Exception:
+            pass
+
+
+class ProfilingConnection(sqlite3.Connection):
+    """cursor() 返回带统计的游标，execute 等快捷方法也改为经由 cursor() 执行"""
+    
+    cursor_class = None
+    
+    def cursor(self, factory=None):
+        cursor = super().cursor(factory or self.cursor_class)
+        if isinstance(cursor, ProfilingCursor):
+            if not hasattr(self, "_cursors"):
+                self._cursors = weakref.WeakSet()
+            self._cursors.add(cursor)
+        return cursor
+    
+    def close(self):
+        # 关闭前结算未取完结果的语句，此时还能获取执行计划
+        for cursor in list(getattr(self, "_cursors", ())):
+            cursor._finish()
+        super().close()
+    
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+    
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+    
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
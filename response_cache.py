@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+API 响应缓存
+读接口的响应体按 (接口, 规范化后的查询参数) 缓存，数据代数变化时整体失效，不依赖过期时间。
+数据代数保存在共享数据目录的 generation.json 中，爬取入库、清理和回填完成后递增，
+API 进程和定时任务进程看到的是同一个计数
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Dict, Mapping, Optional, Tuple
+from urllib.parse import urlencode
+
+logger = logging.getLogger(__name__)
+
+# API、定时任务、回填和 CSV 清理都通过 generation_path() 定位同一个代数文件；
+# 默认放在程序目录的 data/ 下，与启动时的工作目录无关，可用环境变量 MARKET_GENERATION_FILE 指定
+GENERATION_FILE_ENV = "MARKET_GENERATION_FILE"
+DEFAULT_GENERATION_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "generation.json")
+
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+# 共享缓存中的条目按代数区分，旧代数的条目不会再被读取，过期时间只用于回收空间
+DEFAULT_SHARED_TTL = 2 * 3600
+SHARED_PREFIX = "market_api:response"
+
+# 客户端可以保存响应，但每次使用前须用 ETag/Last-Modified 重新验证
+CACHE_CONTROL = "no-cache"
+
+
+def generation_path() -> str:
+    """所有进程共用的数据代数文件路径"""
+    return os.environ.get(GENERATION_FILE_ENV) or DEFAULT_GENERATION_FILE
+
+
+class DataGeneration:
+    """跨进程的数据代数计数器，每次数据变更后调用 bump()；path 默认为 generation_path()"""
+    
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or generation_path()
+        self.lock = threading.Lock()
+        self._stat = None
+        self._state = {"generation": 0, "updated_at": None}
+    
+    def _file_stat(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+    
+    def _read(self) -> Dict:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            return {"generation": int(state["generation"]), "updated_at": state.get("updated_at")}
+        except FileNotFoundError:
+            return {"generation": 0, "updated_at": None}
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning(f"读取数据代数文件失败: {e}")
+            return {"generation": 0, "updated_at": None}
+    
+    def current(self) -> Dict:
+        """当前的 {generation, updated_at}；文件未变化时只需一次 stat"""
+        stat = self._file_stat()
+        with self.lock:
+            if stat != self._stat:
+                self._state = self._read()
+                self._stat = stat
+            return dict(self._state)
+    
+    @contextmanager
+    def _bump_lock(self):
+        """多个进程同时递增时串行执行，避免丢失计数"""
+        try:
+            import fcntl
+        except ImportError:
+            yield
+            return
+        
+        with open(self.path + ".lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+    
+    def bump(self, reason: str = "") -> Dict:
+        """数据已写入后递增代数，返回新的状态"""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        
+        with self._bump_lock():
+            state = {
+                "generation": self._read()["generation"] + 1,
+                "updated_at": time.time(),
+                "reason": reason,
+            }
+            # 写临时文件后替换，读取方的 stat 一定能看到变化
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(state, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        
+        logger.info(f"数据代数更新为 {state['generation']} ({reason})")
+        return {"generation": state["generation"], "updated_at": state["updated_at"]}
+
+
+def cache_key(endpoint: str, params: Dict) -> str:
+    """接口路径加规范化的查询参数：去掉空值，按参数名排序，取值统一转为字符串"""
+    items = sorted((name, str(value)) for name, value in params.items() if value is not None)
+    return f"{endpoint}?{urlencode(items)}" if items else endpoint
+
+
+def validator_headers(key: str, state: Dict) -> Dict[str, str]:
+    """条件请求的验证头：ETag 由数据代数和缓存键决定，Last-Modified 取最近一次数据变更时间"""
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+    headers = {
+        "ETag": f'"{state["generation"]}-{digest}"',
+        "Cache-Control": CACHE_CONTROL,
+    }
+    if state.get("updated_at"):
+        headers["Last-Modified"] = formatdate(state["updated_at"], usegmt=True)
+    return headers
+
+
+def is_not_modified(request_headers: Mapping[str, str], headers: Dict[str, str]) -> bool:
+    """按 RFC 7232 判断条件 GET 能否返回 304：有 If-None-Match 时只比较 ETag，否则比较 If-Modified-Since"""
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match is not None:
+        if if_none_match.strip() == "*":
+            return True
+        # 弱比较：nginx 压缩响应时会把 ETag 改为 W/ 前缀
+        etag = headers["ETag"]
+        return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+    
+    if_modified_since = request_headers.get("if-modified-since")
+    last_modified = headers.get("Last-Modified")
+    if if_modified_since and last_modified:
+        try:
+            return parsedate_to_datetime(if_modified_since) >= parsedate_to_datetime(last_modified)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+class SharedBackend:
+    """Redis 兼容的共享缓存，多个 API 工作进程共用；client 只需提供 get(key) 和 set(key, value, ex=秒)"""
+    
+    def __init__(self, client, prefix: str = SHARED_PREFIX, ttl: int = DEFAULT_SHARED_TTL):
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+    
+    @classmethod
+    def from_url(cls, url: str, **kwargs) -> "SharedBackend":
+        try:
+            import redis
+        except ImportError:
+            raise ImportError("使用共享响应缓存需要安装 redis: pip install redis")
+        return cls(redis.Redis.from_url(url), **kwargs)
+    
+    def _key(self, key: str, generation: int) -> str:
+        return f"{self.prefix}:{generation}:{key}"
+    
+    def get(self, key: str, generation: int) -> Optional[bytes]:
+        return self.client.get(self._key(key, generation))
+    
+    def set(self, key: str, generation: int, body: bytes):
+        self.client.set(self._key(key, generation), body, ex=self.ttl)
+
+
+class ResponseCache:
+    """进程内 LRU 响应缓存，按条目数和总字节数淘汰，可选再加一层共享缓存"""
+    
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, max_bytes: int = DEFAULT_MAX_BYTES,
+                 shared: Optional[SharedBackend] = None):
+        if max_entries < 0 or max_bytes < 0:
+            raise ValueError("max_entries 和 max_bytes 不能小于0")
+        
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.shared = shared
+        self.lock = threading.Lock()
+        self.entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self.bytes = 0
+        self.generation = None
+        self.stats = {
+            "hits": 0,
+            "shared_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "evictions": 0,
+            "invalidations": 0,
+            "shared_errors": 0,
+        }
+    
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 and self.max_bytes > 0
+    
+    def _sync_generation(self, generation: int) -> bool:
+        """代数变大时清空本地条目；返回 False 表示调用方持有的代数已过时。调用方持有锁"""
+        if self.generation is None or generation > self.generation:
+            if self.entries:
+                self.stats["invalidations"] += len(self.entries)
+                self.entries.clear()
+                self.bytes = 0
+            self.generation = generation
+        return generation == self.generation
+    
+    def get(self, key: str, generation: int) -> Optional[bytes]:
+        """查找 generation 代的缓存响应，未命中返回 None"""
+        if self.enabled:
+            with self.lock:
+                if self._sync_generation(generation):
+                    body = self.entries.get(key)
+                    if body is not None:
+                        self.entries.move_to_end(key)
+                        self.stats["hits"] += 1
+                        return body
+        
+        if self.shared is not None:
+            try:
+                body = self.shared.get(key, generation)
+            except Exception as e:
+                body = None
+                with self.lock:
+                    self.stats["shared_errors"] += 1
+                logger.warning(f"读取共享响应缓存失败: {e}")
+            if body is not None:
+                self._store_local(key, generation, body)
+                with self.lock:
+                    self.stats["shared_hits"] += 1
+                return body
+        
+        with self.lock:
+            self.stats["misses"] += 1
+        return None
+    
+    def put(self, key: str, generation: int, body: bytes):
+        """保存按 generation 代数据计算出的响应"""
+        if self._store_local(key, generation, body):
+            with self.lock:
+                self.stats["stores"] += 1
+        
+        if self.shared is not None:
+            try:
+                self.shared.set(key, generation, body)
+            except Exception as e:
+                with self.lock:
+                    self.stats["shared_errors"] += 1
+                logger.warning(f"写入共享响应缓存失败: {e}")
+    
+    def _store_local(self, key: str, generation: int, body: bytes) -> bool:
+        size = len(body)
+        if not self.enabled or size > self.max_bytes:
+            return False
+        
+        with self.lock:
+            # 计算期间数据已更新，结果不再缓存
+            if not self._sync_generation(generation):
+                return False
+            
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.bytes -= len(old)
+            self.entries[key] = body
+            self.bytes += size
+            while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.bytes -= len(evicted)
+                self.stats["evictions"] += 1
+        return True
+    
+    def clear(self):
+        """清空本地条目，共享缓存中的条目随代数变化自然失效"""
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+    
+    def status(self) -> Dict:
+        """配置、占用和命中统计"""
+        with self.lock:
+            stats = dict(self.stats)
+            entries = len(self.entries)
+            size = self.bytes
+            generation = self.generation
+        lookups = stats["hits"] + stats["shared_hits"] + stats["misses"]
+        return {
+            "enabled": self.enabled,
+            "shared": self.shared is not None,
+            "generation": generation,
+            "entries": entries,
+            "bytes": size,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "hit_ratio": round((stats["hits"] + stats["shared_hits"]) / lookups, 4) if lookups else 0.0,
+            **stats,
+        }
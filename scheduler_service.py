@@ -16,6 +16,7 @@ import os
 from market_crawler import MarketCrawler
 from database_manager import DatabaseManager
 from location_service import LocationService
+from response_cache import DataGeneration
 import requests
 import signal
 import sys
@@ -37,7 +38,8 @@ class SchedulerService:
         self.config = self.load_config()
         self.crawler = MarketCrawler()
         self.db_manager = DatabaseManager()
-        self.location_service = LocationService()
+        self.data_generation = DataGeneration()  # 与 API 服务共享，数据变更后使其响应缓存失效
+        self.location_service = LocationService(profiler=self.db_manager.profiler)
         self.running = False
         self.scheduler_thread = None
         
@@ -45,6 +47,9 @@ class SchedulerService:
         self.task_stats = {
             "crawl_data": {"success": 0, "failed": 0, "last_run": None},
             "cleanup_data": {"success": 0, "failed": 0, "last_run": None},
+            "reclaim_space": {"success": 0, "failed": 0, "last_run": None},
+            "backup_database": {"success": 0, "failed": 0, "last_run": None},
+            "maintain_database": {"success": 0, "failed": 0, "last_run": None},
             "generate_reports": {"success": 0, "failed": 0, "last_run": None},
             "health_check": {"success": 0, "failed": 0, "last_run": None}
         }
@@ -61,6 +66,22 @@ class SchedulerService:
             "report_interval_hours": 6,
             "health_check_interval_minutes": 5,
             "data_retention_days": 90,
+            "cleanup_chunk_size": 5000,
+            "cleanup_pause_seconds": 0.05,
+            "vacuum_interval_minutes": 60,
+            "vacuum_pages_per_run": 2048,
+            "change_log_compact_hours": 24,
+            "change_log_retention_days": 30,
+            "backup_enabled": True,
+            "backup_interval_hours": 24,
+            "backup_dir": "backups",
+            "backup_keep": 7,
+            "backup_pages_per_step": 1024,
+            "backup_pause_seconds": 0.05,
+            "backup_compression": True,
+            "maintenance_interval_minutes": 60,
+            "maintenance_min_changes": 50000,
+            "maintenance_quiet_hours": [1, 2, 3, 4, 5],  # 在这些小时内截断WAL
             "max_retry_attempts": 3,
             "retry_delay_seconds": 60,
             "enable_notifications": False,
@@ -178,6 +199,11 @@ class SchedulerService:
             # 保存数据到数据库
             if all_data:
                 inserted_count = self.db_manager.insert_market_data(all_data)
+                self.data_generation.bump("scheduler_crawl")
+                
+                # 大批量入库后立即更新查询规划统计信息
+                if inserted_count >= self.config.get("maintenance_min_changes", 50000):
+                    self.maintain_database()
                 
                 # 发送通知
                 if self.config.get("enable_notifications"):
@@ -210,9 +236,25 @@ class SchedulerService:
             logger.info("开始执行数据清理任务...")
             
             retention_days = self.config.get("data_retention_days", 90)
-            result = self.db_manager.cleanup_old_data(retention_days)
+            result = self.db_manager.cleanup_old_data(
+                retention_days,
+                chunk_size=self.config.get("cleanup_chunk_size", 5000),
+                pause_seconds=self.config.get("cleanup_pause_seconds", 0.05),
+                vacuum_pages=self.config.get("vacuum_pages_per_run", 2048)
+            )
             
             logger.info(f"数据清理完成: {result}")
+            if result.get("deleted_prices"):
+                self.data_generation.bump("cleanup")
+            
+            # 压缩价格变更日志
+            change_result = self.db_manager.compact_change_log(
+                compact_after_hours=self.config.get("change_log_compact_hours", 24),
+                retention_days=self.config.get("change_log_retention_days", 30),
+                chunk_size=self.config.get("cleanup_chunk_size", 5000),
+                pause_seconds=self.config.get("cleanup_pause_seconds", 0.05)
+            )
+            logger.info(f"变更日志压缩完成: {change_result}")
             
             # 发送通知
             if self.config.get("enable_notifications"):
@@ -228,6 +270,81 @@ class SchedulerService:
             logger.error(f"数据清理任务失败: {str(e)}")
             self.task_stats[task_name]["failed"] += 1
     
+    def reclaim_space(self):
+        """空闲时段增量回收数据库空闲页任务"""
+        task_name = "reclaim_space"
+        start_time = datetime.now()
+        
+        try:
+            result = self.db_manager.incremental_vacuum(
+                max_pages=self.config.get("vacuum_pages_per_run", 2048),
+                pause_seconds=self.config.get("cleanup_pause_seconds", 0.05)
+            )
+            
+            if result["reclaimed_bytes"]:
+                logger.info(f"增量回收完成: 回收 {result['reclaimed_bytes']} 字节, "
+                            f"剩余空闲页 {result['free_pages_after']}")
+            
+            self.task_stats[task_name]["success"] += 1
+            self.task_stats[task_name]["last_run"] = start_time.isoformat()
+            
+        except Exception as e:
+            logger.error(f"增量回收任务失败: {str(e)}")
+            self.task_stats[task_name]["failed"] += 1
+    
+    def maintain_database(self):
+        """数据库维护任务：ANALYZE / PRAGMA optimize，空闲时段截断WAL"""
+        task_name = "maintain_database"
+        start_time = datetime.now()
+        
+        try:
+            quiet_hours = self.config.get("maintenance_quiet_hours", [1, 2, 3, 4, 5])
+            result = self.db_manager.optimize_database(
+                min_changes=self.config.get("maintenance_min_changes", 50000),
+                checkpoint=start_time.hour in quiet_hours
+            )
+            
+            changed = [name for name, query in result["queries"].items() if query["plan_changed"]]
+            if changed:
+                logger.info(f"维护后查询计划发生变化: {', '.join(changed)}")
+            
+            self.task_stats[task_name]["success"] += 1
+            self.task_stats[task_name]["last_run"] = start_time.isoformat()
+            
+        except Exception as e:
+            logger.error(f"数据库维护任务失败: {str(e)}")
+            self.task_stats[task_name]["failed"] += 1
+    
+    def backup_database(self):
+        """在线热备份数据库任务"""
+        task_name = "backup_database"
+        start_time = datetime.now()
+        
+        try:
+            logger.info("开始执行数据库备份任务...")
+            
+            result = self.db_manager.backup_database(
+                backup_dir=self.config.get("backup_dir", "backups"),
+                pages_per_step=self.config.get("backup_pages_per_step", 1024),
+                pause_seconds=self.config.get("backup_pause_seconds", 0.05),
+                keep=self.config.get("backup_keep", 7),
+                compress=self.config.get("backup_compression", True)
+            )
+            
+            logger.info(f"数据库备份完成: {result['backup_file']}, "
+                        f"{result['pages']} 页, {result['pages_per_second']} 页/秒, "
+                        f"耗时 {result['duration_seconds']} 秒")
+            
+            self.task_stats[task_name]["success"] += 1
+            self.task_stats[task_name]["last_run"] = start_time.isoformat()
+            
+        except Exception as e:
+            logger.error(f"数据库备份任务失败: {str(e)}")
+            self.task_stats[task_name]["failed"] += 1
+            
+            if self.config.get("enable_notifications"):
+                self.send_notification("数据库备份失败", str(e))
+    
     def generate_daily_report(self):
         """生成日报任务"""
         task_name = "generate_reports"
@@ -377,6 +494,19 @@ class SchedulerService:
         cleanup_interval = self.config.get("cleanup_interval_hours", 24)
         schedule.every(cleanup_interval).hours.do(self.cleanup_old_data)
         
+        # 增量回收任务（调度线程串行执行，运行时不会与爬取任务重叠）
+        vacuum_interval = self.config.get("vacuum_interval_minutes", 60)
+        schedule.every(vacuum_interval).minutes.do(self.reclaim_space)
+        
+        # 数据库维护任务
+        maintenance_interval = self.config.get("maintenance_interval_minutes", 60)
+        schedule.every(maintenance_interval).minutes.do(self.maintain_database)
+        
+        # 数据库备份任务
+        backup_interval = self.config.get("backup_interval_hours", 24)
+        if self.config.get("backup_enabled", True):
+            schedule.every(backup_interval).hours.do(self.backup_database)
+        
         # 报告生成任务
         report_interval = self.config.get("report_interval_hours", 6)
         schedule.every(report_interval).hours.do(self.generate_daily_report)
@@ -388,6 +518,10 @@ class SchedulerService:
         logger.info("定时任务已设置:")
         logger.info(f"- 数据爬取: 每 {crawl_interval} 分钟")
         logger.info(f"- 数据清理: 每 {cleanup_interval} 小时")
+        logger.info(f"- 增量回收: 每 {vacuum_interval} 分钟")
+        logger.info(f"- 数据库维护: 每 {maintenance_interval} 分钟")
+        if self.config.get("backup_enabled", True):
+            logger.info(f"- 数据库备份: 每 {backup_interval} 小时")
         logger.info(f"- 报告生成: 每 {report_interval} 小时")
         logger.info(f"- 健康检查: 每 {health_interval} 分钟")
     
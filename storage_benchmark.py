@@ -0,0 +1,506 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+存储性能基准测试
+用固定随机种子生成与爬虫记录结构一致的合成数据（省份、市场、品种、日期分布接近真实情况），
+在不同数据规模下测量 DatabaseManager 和 CSVDataManager 的入库吞吐、查询延迟分位数、
+存储体积和峰值内存，结果写成 JSON 便于在不同提交之间对比
+"""
+
+import argparse
+import json
+import logging
+import math
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import shutil
+import sqlite3
+import subprocess
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, Iterator, List
+
+logger = logging.getLogger(__name__)
+
+# 省份及权重（权重越大，市场越多）
+PROVINCES = [
+    ("北京市", "110000", 4), ("天津市", "120000", 2), ("河北省", "130000", 5),
+    ("山西省", "140000", 3), ("内蒙古自治区", "150000", 2), ("辽宁省", "210000", 4),
+    ("吉林省", "220000", 2), ("黑龙江省", "230000", 3), ("上海市", "310000", 4),
+    ("江苏省", "320000", 7), ("浙江省", "330000", 6), ("安徽省", "340000", 4),
+    ("福建省", "350000", 4), ("江西省", "360000", 3), ("山东省", "370000", 9),
+    ("河南省", "410000", 7), ("湖北省", "420000", 5), ("湖南省", "430000", 5),
+    ("广东省", "440000", 8), ("广西壮族自治区", "450000", 3), ("海南省", "460000", 1),
+    ("重庆市", "500000", 3), ("四川省", "510000", 6), ("贵州省", "520000", 2),
+    ("云南省", "530000", 3), ("西藏自治区", "540000", 1), ("陕西省", "610000", 3),
+    ("甘肃省", "620000", 2), ("青海省", "630000", 1), ("宁夏回族自治区", "640000", 1),
+    ("新疆维吾尔自治区", "650000", 2),
+]
+
+# 品种类型 -> (类型ID, 基础价格区间, 品种名称)
+VARIETY_CATALOG = {
+    "蔬菜": ("1", (1.0, 8.0), [
+        "白萝卜", "土豆", "白菜", "西红柿", "黄瓜", "茄子", "青椒", "胡萝卜", "芹菜", "菠菜",
+        "生菜", "洋葱", "大蒜", "生姜", "韭菜", "豆角", "冬瓜", "南瓜", "莲藕", "花菜",
+    ]),
+    "水果": ("2", (3.0, 15.0), [
+        "苹果", "香蕉", "梨", "橙子", "葡萄", "西瓜", "桃", "草莓", "猕猴桃", "柚子",
+    ]),
+    "畜禽": ("3", (10.0, 80.0), ["猪肉", "牛肉", "羊肉", "鸡蛋", "白条鸡"]),
+    "水产": ("4", (8.0, 60.0), ["草鱼", "鲤鱼", "带鱼", "对虾", "鲫鱼"]),
+}
+
+# 品种数超过目录时追加的规格后缀
+VARIETY_GRADES = ["", "(精品)", "(统货)", "(一级)", "(二级)", "(散装)"]
+
+MARKET_KINDS = ["农产品批发市场", "蔬菜批发市场", "果品批发市场", "农副产品物流园"]
+
+# 规模参数支持 K / M 后缀
+SCALE_SUFFIXES = {"K": 1000, "M": 1000 * 1000}
+
+
+def parse_scale(value: str) -> int:
+    """将 100K、1M、50M 等写法转换为行数"""
+    value = value.strip().upper()
+    if value and value[-1] in SCALE_SUFFIXES:
+        return int(float(value[:-1]) * SCALE_SUFFIXES[value[-1]])
+    return int(value)
+
+
+class SyntheticDataGenerator:
+    """确定性的合成行情数据生成器，输出与爬虫相同字段的记录"""
+    
+    def __init__(self, seed: int = 42, markets: int = 600, varieties: int = 120,
+                 min_basket: int = 20, max_basket: int = 80, end_date: date = None):
+        self.seed = seed
+        self.end_date = end_date or date.today()
+        rng = random.Random(seed)
+        
+        # 品种：按目录和规格后缀展开，热门程度服从 Zipf 分布
+        catalog = [
+            (name, type_name, type_id, price_range)
+            for type_name, (type_id, price_range, names) in VARIETY_CATALOG.items()
+            for name in names
+        ]
+        self.varieties = []
+        for index in range(varieties):
+            name, type_name, type_id, (low, high) = catalog[index % len(catalog)]
+            round_index = index // len(catalog)
+            name += VARIETY_GRADES[round_index % len(VARIETY_GRADES)]
+            if round_index >= len(VARIETY_GRADES):
+                name += str(round_index // len(VARIETY_GRADES))
+            self.varieties.append({
+                "id": f"SV{index:04d}",
+                "name": name,
+                "type_name": type_name,
+                "type_id": type_id,
+                "base_price": rng.uniform(low, high),
+                "phase": rng.uniform(0, 2 * math.pi),
+            })
+        popularity = [1.0 / (rank + 1) for rank in range(varieties)]
+        
+        # 市场：按省份权重分布，每个市场经营一篮子品种
+        province_weights = [weight for _, _, weight in PROVINCES]
+        self.markets = []
+        for index in range(markets):
+            province, code, _ = rng.choices(PROVINCES, weights=province_weights)[0]
+            basket_size = min(varieties, rng.randint(min_basket, max_basket))
+            basket = set()
+            while len(basket) < basket_size:
+                basket.add(rng.choices(range(varieties), weights=popularity)[0])
+            area = province.rstrip("省市") + f"{index % 17 + 1}区"
+            self.markets.append({
+                "id": f"SM{index:05d}",
+                "code": f"{code[:2]}{index:05d}",
+                "name": f"{area}{MARKET_KINDS[index % len(MARKET_KINDS)]}{index}",
+                "type": "批发市场",
+                "province": province,
+                "province_code": code,
+                "area_name": area,
+                "area_code": f"{code[:4]}{index % 17 + 1:02d}",
+                "price_factor": rng.uniform(0.85, 1.2),
+                "basket": sorted(basket),
+            })
+        
+        self.rows_per_day = sum(len(market["basket"]) for market in self.markets)
+    
+    def days_for(self, total_rows: int) -> int:
+        """生成 total_rows 行需要的交易天数"""
+        return max(1, math.ceil(total_rows / self.rows_per_day))
+    
+    def records(self, total_rows: int) -> Iterator[Dict]:
+        """按 交易日期 -> 市场 -> 品种 的顺序生成记录，最后一天为 end_date"""
+        rng = random.Random(self.seed + total_rows)
+        days = self.days_for(total_rows)
+        start = self.end_date - timedelta(days=days - 1)
+        produced = 0
+        
+        for day in range(days):
+            trade_date = start + timedelta(days=day)
+            date_text = trade_date.isoformat()
+            season = 2 * math.pi * trade_date.timetuple().tm_yday / 365
+            for market in self.markets:
+                crawl_time = f"{date_text} {rng.randint(6, 22):02d}:{rng.randint(0, 59):02d}:{rng.randint(0, 59):02d}"
+                for variety_index in market["basket"]:
+                    if produced >= total_rows:
+                        return
+                    variety = self.varieties[variety_index]
+                    avg_price = round(
+                        variety["base_price"] * market["price_factor"]
+                        * (1 + 0.15 * math.sin(season + variety["phase"]))
+                        * rng.uniform(0.95, 1.05), 2
+                    )
+                    spread = rng.uniform(0.05, 0.2)
+                    yield {
+                        "市场ID": market["id"],
+                        "市场代码": market["code"],
+                        "市场名称": market["name"],
+                        "市场类型": market["type"],
+                        "品种ID": variety["id"],
+                        "品种名称": variety["name"],
+                        "最低价": round(avg_price * (1 - spread), 2),
+                        "平均价": avg_price,
+                        "最高价": round(avg_price * (1 + spread), 2),
+                        "计量单位": "元/公斤",
+                        "交易日期": date_text,
+                        "交易量": round(rng.lognormvariate(3, 1), 1),
+                        "产地": market["province"],
+                        "销售地": market["province"],
+                        "省份": market["province"],
+                        "省份代码": market["province_code"],
+                        "地区名称": market["area_name"],
+                        "地区代码": market["area_code"],
+                        "品种类型": variety["type_name"],
+                        "品种类型ID": variety["type_id"],
+                        "入库时间": crawl_time,
+                        "爬取时间": crawl_time,
+                    }
+                    produced += 1
+    
+    def batches(self, total_rows: int, batch_size: int) -> Iterator[List[Dict]]:
+        """将记录流切分为批次"""
+        batch = []
+        for record in self.records(total_rows):
+            batch.append(record)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+def percentiles(samples: List[float]) -> Dict:
+    """计算延迟分位数（毫秒）"""
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+    
+    def pick(p):
+        return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000, 3)
+    
+    return {
+        "count": len(ordered),
+        "p50_ms": pick(0.50),
+        "p95_ms": pick(0.95),
+        "p99_ms": pick(0.99),
+        "max_ms": round(ordered[-1] * 1000, 3),
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 3),
+    }
+
+
+def measure(func: Callable, params: List, repeats: int) -> Dict:
+    """依次用不同参数执行查询，返回延迟分位数"""
+    samples = []
+    for index in range(repeats):
+        start = time.perf_counter()
+        func(params[index % len(params)])
+        samples.append(time.perf_counter() - start)
+    return percentiles(samples)
+
+
+def file_size(path: str) -> int:
+    """文件及其 WAL / SHM 文件的总大小"""
+    return sum(os.path.getsize(p) for p in (path, path + "-wal", path + "-shm") if os.path.exists(p))
+
+
+def peak_rss_mb() -> float:
+    """当前进程的峰值常驻内存（MB）"""
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 单位为 KB，macOS 为字节
+    return round(usage / 1024 / (1024 if platform.system() == "Darwin" else 1), 1)
+
+
+def query_params(generator: SyntheticDataGenerator, seed: int, count: int = 50) -> List[Dict]:
+    """按热门程度抽取查询用的省份和品种"""
+    rng = random.Random(seed)
+    params = []
+    for _ in range(count):
+        market = rng.choice(generator.markets)
+        variety = generator.varieties[rng.choice(market["basket"])]
+        params.append({"province": market["province"], "variety_name": variety["name"], "market_name": market["name"]})
+    return params
+
+
+def benchmark_database(generator: SyntheticDataGenerator, rows: int, workdir: str,
+                       batch_size: int, repeats: int, retention_days: int) -> Dict:
+    """DatabaseManager：入库吞吐、查询延迟、数据库体积和清理耗时"""
+    from database_manager import DatabaseManager
+    
+    db_path = os.path.join(workdir, "benchmark.db")
+    db = DatabaseManager(db_path)
+    
+    start = time.perf_counter()
+    batch_seconds = []
+    for batch in generator.batches(rows, batch_size):
+        batch_start = time.perf_counter()
+        db.insert_market_data(batch)
+        batch_seconds.append(time.perf_counter() - batch_start)
+    ingest_seconds = time.perf_counter() - start
+    
+    params = query_params(generator, generator.seed)
+    recent = (generator.end_date - timedelta(days=30)).isoformat()
+    queries = {
+        "query_prices_province_variety": measure(
+            lambda p: db.query_prices({"province": p["province"], "variety_name": p["variety_name"]}, limit=100),
+            params, repeats),
+        "query_prices_variety_30d": measure(
+            lambda p: db.query_prices({"variety_name": p["variety_name"], "start_date": recent}, limit=100),
+            params, repeats),
+        "query_prices_first_page": measure(lambda p: db.query_prices({}, limit=100), params, repeats),
+        "latest_prices_variety": measure(
+            lambda p: db.get_latest_prices({"variety_name": p["variety_name"]}, limit=1000), params, repeats),
+        "price_statistics_variety_30d": measure(
+            lambda p: db.get_price_statistics(variety_name=p["variety_name"], days=30), params, repeats),
+        "price_statistics_province_90d": measure(
+            lambda p: db.get_price_statistics(province=p["province"], days=90), params, max(1, repeats // 5)),
+    }
+    
+    size_before_cleanup = file_size(db_path)
+    start = time.perf_counter()
+    cleanup = db.cleanup_old_data(retention_days, pause_seconds=0)
+    cleanup_seconds = time.perf_counter() - start
+    
+    return {
+        "ingest": {
+            "rows": rows,
+            "seconds": round(ingest_seconds, 3),
+            "rows_per_second": round(rows / ingest_seconds, 1) if ingest_seconds else 0,
+            "batch_size": batch_size,
+            "batch_latency": percentiles(batch_seconds),
+        },
+        "queries": queries,
+        "db_size_bytes": size_before_cleanup,
+        "bytes_per_row": round(size_before_cleanup / rows, 1) if rows else 0,
+        "cleanup": {
+            "retention_days": retention_days,
+            "seconds": round(cleanup_seconds, 3),
+            "deleted_prices": cleanup["deleted_prices"],
+            "dropped_partitions": len(cleanup["dropped_partitions"]),
+            "db_size_after_bytes": file_size(db_path),
+        },
+    }
+
+
+def benchmark_csv(generator: SyntheticDataGenerator, rows: int, workdir: str,
+                  repeats: int, **_) -> Dict:
+    """CSVDataManager：按交易日批量保存的吞吐、搜索延迟和文件体积"""
+    from csv_data_manager import CSVDataManager
+    
+    manager = CSVDataManager(os.path.join(workdir, "csv"))
+    
+    # 爬虫每天保存一次，按天分批
+    start = time.perf_counter()
+    batch_seconds = []
+    for batch in generator.batches(rows, generator.rows_per_day):
+        batch_start = time.perf_counter()
+        manager.save_data(batch)
+        batch_seconds.append(time.perf_counter() - batch_start)
+    ingest_seconds = time.perf_counter() - start
+    
+    params = query_params(generator, generator.seed)
+    queries = {
+        "search_province_variety": measure(
+            lambda p: manager.search_data({"省份": p["province"], "品种名称": p["variety_name"]}, 100),
+            params, repeats),
+        "search_market": measure(lambda p: manager.search_data({"市场名称": p["market_name"]}, 100), params, repeats),
+    }
+    
+    storage = manager.storage_info()
+    return {
+        "ingest": {
+            "rows": rows,
+            "seconds": round(ingest_seconds, 3),
+            "rows_per_second": round(rows / ingest_seconds, 1) if ingest_seconds else 0,
+            "batch_size": generator.rows_per_day,
+            "batch_latency": percentiles(batch_seconds),
+        },
+        "queries": queries,
+        "segments": storage["segments"],
+        "file_size_bytes": storage["bytes"],
+        "bytes_per_row": round(storage["bytes"] / rows, 1) if rows else 0,
+    }
+
+
+TARGETS = {
+    "database": benchmark_database,
+    "csv": benchmark_csv,
+}
+
+
+def _run_target(target: str, rows: int, options: Dict, queue):
+    """在独立子进程中运行单个基准，峰值内存互不影响"""
+    logging.basicConfig(level=logging.WARNING)
+    workdir = tempfile.mkdtemp(prefix=f"benchmark_{target}_", dir=options["workdir"])
+    try:
+        os.chdir(workdir)
+        generator = SyntheticDataGenerator(
+            seed=options["seed"], markets=options["markets"], varieties=options["varieties"]
+        )
+        result = TARGETS[target](
+            generator, rows, workdir,
+            batch_size=options["batch_size"], repeats=options["repeats"],
+            retention_days=options["retention_days"]
+        )
+        result.update({
+            "target": target,
+            "rows": rows,
+            "days": generator.days_for(rows),
+            "peak_rss_mb": peak_rss_mb(),
+        })
+        queue.put(result)
+    except Exception as e:
+        queue.put({"target": target, "rows": rows, "error": str(e)})
+    finally:
+        if not options["keep_files"]:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def git_commit() -> str:
+    """当前提交号，非 git 目录返回空字符串"""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10
+        ).stdout.strip()
+    except Exception:
+        return ""
+
+
+def run_benchmarks(scales: List[int], targets: List[str], options: Dict) -> Dict:
+    """按规模和目标依次运行基准测试，返回完整结果"""
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for rows in scales:
+        for target in targets:
+            if target == "csv" and rows > options["csv_max_rows"]:
+                logger.info(f"跳过 CSV {rows} 行（超过 --csv-max-rows {options['csv_max_rows']}）")
+                continue
+            logger.info(f"运行基准: {target}, {rows} 行")
+            queue = context.Queue()
+            process = context.Process(target=_run_target, args=(target, rows, options, queue))
+            process.start()
+            result = queue.get()
+            process.join()
+            results.append(result)
+            logger.info(f"完成: {json.dumps(result, ensure_ascii=False)[:300]}")
+    
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "options": {key: value for key, value in options.items() if key != "workdir"},
+        },
+        "results": results,
+    }
+
+
+def _flatten(result: Dict, prefix: str = "") -> Dict[str, float]:
+    """把嵌套结果展开为 路径 -> 数值，便于对比"""
+    flat = {}
+    for key, value in result.items():
+        path = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            flat.update(_flatten(value, path))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[path] = value
+    return flat
+
+
+def compare_results(baseline: Dict, current: Dict) -> List[Dict]:
+    """对比两次结果中同一 (目标, 行数) 的各项指标，ratio 为 当前/基线"""
+    baseline_map = {(r["target"], r["rows"]): _flatten(r) for r in baseline.get("results", [])}
+    rows = []
+    for result in current.get("results", []):
+        before = baseline_map.get((result["target"], result["rows"]))
+        if not before:
+            continue
+        for metric, value in _flatten(result).items():
+            if metric in before and before[metric]:
+                rows.append({
+                    "target": result["target"],
+                    "rows": result["rows"],
+                    "metric": metric,
+                    "baseline": before[metric],
+                    "current": value,
+                    "ratio": round(value / before[metric], 3),
+                })
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="存储性能基准测试")
+    parser.add_argument("--scales", nargs="+", default=["100K"], help="数据规模，如 1M 10M 50M")
+    parser.add_argument("--targets", nargs="+", default=list(TARGETS), choices=list(TARGETS), help="测试目标")
+    parser.add_argument("--seed", type=int, default=42, help="随机种子")
+    parser.add_argument("--markets", type=int, default=600, help="市场数量")
+    parser.add_argument("--varieties", type=int, default=120, help="品种数量")
+    parser.add_argument("--batch-size", type=int, default=5000, help="数据库每批入库行数")
+    parser.add_argument("--repeats", type=int, default=50, help="每种查询的执行次数")
+    parser.add_argument("--retention-days", type=int, default=90, help="清理测试的保留天数")
+    parser.add_argument("--csv-max-rows", type=int, default=2 * 1000 * 1000, help="CSV 测试的最大行数")
+    parser.add_argument("--workdir", default=tempfile.gettempdir(), help="临时数据目录")
+    parser.add_argument("--keep-files", action="store_true", help="保留生成的数据库和CSV文件")
+    parser.add_argument("--output", help="结果JSON文件，默认 benchmark_results/<提交>_<时间>.json")
+    parser.add_argument("--compare", help="与之前的结果JSON对比")
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    
+    options = {
+        "seed": args.seed,
+        "markets": args.markets,
+        "varieties": args.varieties,
+        "batch_size": args.batch_size,
+        "repeats": args.repeats,
+        "retention_days": args.retention_days,
+        "csv_max_rows": args.csv_max_rows,
+        "workdir": os.path.abspath(args.workdir),
+        "keep_files": args.keep_files,
+    }
+    report = run_benchmarks([parse_scale(scale) for scale in args.scales], args.targets, options)
+    
+    output = args.output
+    if not output:
+        os.makedirs("benchmark_results", exist_ok=True)
+        output = os.path.join(
+            "benchmark_results",
+            f"{report['meta']['commit'] or 'local'}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+        )
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"结果已保存: {output}")
+    
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        for row in compare_results(baseline, report):
+            print(f"{row['target']:<9} {row['rows']:>10} {row['metric']:<55} "
+                  f"{row['baseline']:>14} -> {row['current']:<14} x{row['ratio']}")
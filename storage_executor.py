@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+阻塞存储操作的有界线程池
+API 处理函数通过 run() 把 sqlite3 查询和 pandas 计算放到线程池中执行，事件循环不被阻塞；
+执行和排队的请求数有上限，超出时立即拒绝，单个请求超过时限时返回超时
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# 默认排队数为线程数的倍数
+DEFAULT_QUEUE_FACTOR = 4
+
+
+class StorageUnavailable(Exception):
+    """存储线程池无法处理请求，status_code 为返回给客户端的 HTTP 状态码"""
+    
+    status_code = 503
+
+
+class StorageOverloaded(StorageUnavailable):
+    """执行和排队的请求已满"""
+    
+    status_code = 503
+
+
+class StorageTimeout(StorageUnavailable):
+    """请求超过时限"""
+    
+    status_code = 504
+
+
+class BoundedExecutor:
+    """限制并发和排队数量的线程池，供 async 处理函数调用阻塞操作"""
+    
+    def __init__(self, name: str, workers: int, queue_size: Optional[int] = None, timeout: float = 30.0):
+        if workers <= 0:
+            raise ValueError("workers 必须大于0")
+        if queue_size is None:
+            queue_size = workers * DEFAULT_QUEUE_FACTOR
+        if queue_size < 0:
+            raise ValueError("queue_size 不能小于0")
+        if timeout <= 0:
+            raise ValueError("timeout 必须大于0")
+        
+        self.name = name
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"{name}-storage")
+        # 每个执行中或排队中的请求占用一个名额，在线程中执行结束（或排队时被取消）后归还
+        self.slots = threading.BoundedSemaphore(workers + queue_size)
+        self.lock = threading.Lock()
+        self.stats = {
+            "running": 0,
+            "pending": 0,
+            "completed": 0,
+            "failed": 0,
+            "rejected": 0,
+            "timeouts": 0,
+            "busy_seconds": 0.0,
+        }
+    
+    def _call(self, func: Callable, args: tuple, kwargs: Dict):
+        with self.lock:
+            self.stats["pending"] -= 1
+            self.stats["running"] += 1
+        start = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        except BaseException:
+            with self.lock:
+                self.stats["failed"] += 1
+            raise
+        else:
+            with self.lock:
+                self.stats["completed"] += 1
+            return result
+        finally:
+            with self.lock:
+                self.stats["running"] -= 1
+                self.stats["busy_seconds"] += time.perf_counter() - start
+            self.slots.release()
+    
+    def submit(self, func: Callable, *args, **kwargs) -> Future:
+        """提交任务但不等待结果，名额已满时立即抛出 StorageOverloaded"""
+        if not self.slots.acquire(blocking=False):
+            with self.lock:
+                self.stats["rejected"] += 1
+            raise StorageOverloaded(
+                f"{self.name} 存储线程池已满（{self.workers} 个执行中, 最多排队 {self.queue_size} 个），请稍后重试"
+            )
+        
+        with self.lock:
+            self.stats["pending"] += 1
+        try:
+            future = self.executor.submit(self._call, func, args, kwargs)
+        except RuntimeError:
+            # 线程池已关闭
+            with self.lock:
+                self.stats["pending"] -= 1
+            self.slots.release()
+            raise StorageOverloaded(f"{self.name} 存储线程池已关闭")
+        return future
+    
+    async def run(self, func: Callable, *args, timeout: Optional[float] = None, **kwargs):
+        """在线程池中执行 func(*args, **kwargs) 并等待结果
+        
+        名额已满时抛出 StorageOverloaded；超时抛出 StorageTimeout，尚未开始执行的任务会被取消，
+        已在执行的任务无法中断，继续运行到结束后归还名额。
+        """
+        future = self.submit(func, *args, **kwargs)
+        wrapped = asyncio.wrap_future(future)
+        # 超时后无人等待结果，取走异常避免事件循环报告未处理的异常
+        wrapped.add_done_callback(lambda f: f.cancelled() or f.exception())
+        limit = timeout or self.timeout
+        try:
+            return await asyncio.wait_for(asyncio.shield(wrapped), limit)
+        except asyncio.TimeoutError:
+            self.cancel(future)
+            with self.lock:
+                self.stats["timeouts"] += 1
+            logger.warning(f"{self.name} 存储操作超时 ({limit} 秒): {getattr(func, '__name__', func)}")
+            raise StorageTimeout(f"{self.name} 存储操作超过 {limit} 秒未完成")
+    
+    def cancel(self, future: Future) -> bool:
+        """取消尚未开始执行的任务并归还名额，已在执行的任务返回 False"""
+        if not future.cancel():
+            return False
+        with self.lock:
+            self.stats["pending"] -= 1
+        self.slots.release()
+        return True
+    
+    def status(self) -> Dict:
+        """线程池配置和累计统计"""
+        with self.lock:
+            stats = dict(self.stats)
+        stats["busy_seconds"] = round(stats["busy_seconds"], 3)
+        return {
+            "workers": self.workers,
+            "queue_size": self.queue_size,
+            "timeout": self.timeout,
+            **stats,
+        }
+    
+    def shutdown(self, wait: bool = False):
+        """关闭线程池，取消排队中的任务"""
+        self.executor.shutdown(wait=wait, cancel_futures=True)